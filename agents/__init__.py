@@ -1,6 +1,6 @@
-from .query_analyzer import query_analyzer
-from .retriever_agent import retriever_agent
-from .document_cleaner import document_cleaner
-from .relevance_evaluator import relevance_evaluator
-from .answer_generator import answer_generator
-from .retriever_reformulator import retriever_reformulator
\ No newline at end of file
+from .query_analyzer import query_analyzer, aquery_analyzer
+from .retriever_agent import retriever_agent, aretriever_agent
+from .document_cleaner import document_cleaner, adocument_cleaner
+from .relevance_evaluator import relevance_evaluator, arelevance_evaluator
+from .answer_generator import answer_generator, aanswer_generator
+from .retriever_reformulator import retriever_reformulator, aretriever_reformulator
\ No newline at end of file
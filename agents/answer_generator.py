@@ -1,37 +1,55 @@
-from langchain_openai import ChatOpenAI
+from utils.llm import invoke_llm, stream_llm, ainvoke_llm, astream_llm, DEFAULT_MODEL
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
+from typing import Dict, Any
 from utils.state import AgentState
+from utils.config import PipelineConfig
+from utils.context_packer import get_token_counter, pack_context, MIN_SOURCE_TOKENS
 
-# 5. Answer generation agent
-def answer_generator(state: AgentState) -> AgentState:
-    """Generate the final answer based on relevant documents"""
+def _token_callback(config):
+    return ((config or {}).get("configurable") or {}).get("token_callback")
+
+def _pack_sources(query, records, pipeline_config):
+    """Return (docs_content, steps): the sources packed into the token budget, and packing stats as steps"""
+    if pipeline_config.context_token_budget <= 0:
+        # Packing disabled: every document in full
+        return "\n\n".join([f"Source {i+1}:\n{record.content}" for i, record in enumerate(records)]), []
+    
+    docs_content, stats = pack_context(query, records, pipeline_config.context_token_budget,
+                                       get_token_counter(DEFAULT_MODEL))
+    print(f"Context packing: {stats}")
+    step = (f"Context packed: {stats['tokens_packed']} of {stats['tokens_total']} document tokens "
+            f"({stats['tokens_dropped']} dropped) from {stats['sources_packed']} of {stats['sources']} sources, "
+            f"{stats['sources_trimmed']} trimmed, budget {stats['budget']}")
+    steps = [step]
+    if stats["dropped_sources"]:
+        steps.append(f"Dropped source(s) {', '.join(str(n) for n in stats['dropped_sources'])} from the answer context: "
+                     f"fewer than {MIN_SOURCE_TOKENS} tokens of budget were left for them")
+    return docs_content, steps
+
+def _answer_prompt(state, pipeline_config):
+    """Return (rendered_prompt, None, steps), or (None, fixed_answer, []) if there are no documents"""
     query = state["query"]
-    docs = state["relevant_docs"] or state["cleaned_docs"] or state["retrieved_docs"]
+    docs = state["doc_store"].records_for(state["relevant_ids"] or state["cleaned_ids"] or state["retrieved_ids"])
     confidence_score = state["confidence_score"] or 0
     reformulation_count = state.get("reformulation_count", 0)
     
     if (not docs or len(docs) == 0) and reformulation_count > 0:
-        state["answer"] = (
+        return None, (
             f"Sorry, I attempted multiple queries ({reformulation_count} attempts), but could not find relevant information for your question."
             " This may be because: 1) The database does not contain this information; 2) Your question needs more specific details;"
             " 3) It relates to information after September 2021. Please try rephrasing your question or providing more details."
-        )
-        return state
+        ), []
     
     if not docs:
-        state["answer"] = "Sorry, I could not find information related to your question. Please try asking in a different way or provide more details."
-        return state
+        return None, "Sorry, I could not find information related to your question. Please try asking in a different way or provide more details.", []
     
     print("Documents used for answer generation:")
     for i, doc in enumerate(docs):
-        print(f"Document {i+1} summary: {doc.page_content[:150]}...")
-    
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
+        print(f"Document {i+1} summary: {doc.content[:150]}...")
     
-    docs_content = "\n\n".join([
-        f"Source {i+1}:\n{doc.page_content}" 
-        for i, doc in enumerate(docs)
-    ])
+    # Source numbers follow the document order, whatever packing trims, drops or reorders
+    docs_content, steps = _pack_sources(query, docs, pipeline_config)
     
     confidence_prompt = ""
     if confidence_score < 5:
@@ -60,12 +78,52 @@ def answer_generator(state: AgentState) -> AgentState:
        Response:"""
     )
     
-    answer = llm.invoke(prompt.format(
+    return prompt.format(
         query=query, 
         confidence_prompt=confidence_prompt,
         docs_content=docs_content
-    )).content
+    ), None, steps
+
+# 5. Answer generation agent
+def answer_generator(state: AgentState, config: RunnableConfig = None, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """
+    Generate the final answer based on relevant documents
+
+    If the run config carries a "token_callback" under "configurable", the answer is
+    streamed and each text chunk is passed to the callback as it arrives.
+    """
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    rendered_prompt, fixed_answer, steps = _answer_prompt(state, pipeline_config)
+    if rendered_prompt is None:
+        return {"answer": fixed_answer}
+    
+    token_callback = _token_callback(config)
+    if token_callback is None:
+        answer = invoke_llm(rendered_prompt, temperature=0.3)
+    else:
+        chunks = []
+        for chunk in stream_llm(rendered_prompt, temperature=0.3):
+            chunks.append(chunk)
+            token_callback(chunk)
+        answer = "".join(chunks)
+    
+    return {"answer": answer, "intermediate_steps": steps}
+
+async def aanswer_generator(state: AgentState, config: RunnableConfig = None, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of answer_generator"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    rendered_prompt, fixed_answer, steps = _answer_prompt(state, pipeline_config)
+    if rendered_prompt is None:
+        return {"answer": fixed_answer}
     
-    state["answer"] = answer
+    token_callback = _token_callback(config)
+    if token_callback is None:
+        answer = await ainvoke_llm(rendered_prompt, temperature=0.3)
+    else:
+        chunks = []
+        async for chunk in astream_llm(rendered_prompt, temperature=0.3):
+            chunks.append(chunk)
+            token_callback(chunk)
+        answer = "".join(chunks)
     
-    return state
\ No newline at end of file
+    return {"answer": answer, "intermediate_steps": steps}
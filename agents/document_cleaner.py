@@ -1,58 +1,233 @@
 # 3. Document cleaning agent
-from langchain_openai import ChatOpenAI
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain.prompts import ChatPromptTemplate
-from langchain.schema import Document
+from typing import Dict, Any
 from utils.state import AgentState
+from utils.config import PipelineConfig
+from utils.tracing import propagate_context
+from utils.llm import invoke_llm, ainvoke_llm
+from utils.text import split_sentences
+from utils.document_memo import get_document_memo, cleaning_settings, CLEANED
 
-def document_cleaner(state: AgentState) -> AgentState:
+# Define prompt template
+CLEANING_PROMPT = ChatPromptTemplate.from_template(
+    """You are a professional document cleaning expert. Your task is to clean and extract relevant information from the retrieved documents.
+    
+    Query: {query}
+    
+    Document Content:
+    {doc_content}
+    
+    Please perform the following tasks:
+    1. Remove content unrelated to the query
+    2. Eliminate redundant information
+    3. Extract the most relevant facts and data
+    4. Maintain sentence integrity
+    
+    Return the cleaned document content, ensuring that all important information related to the query is retained."""
+)
+
+def get_cleaner_parallelism():
+    """Maximum number of concurrent cleaning calls (CLEANER_MAX_WORKERS, default 5)"""
+    return max(1, int(os.environ.get("CLEANER_MAX_WORKERS", "5")))
+
+def _clean_one(query, record, text=None):
+    """Clean a single document (or `text` extracted from it), falling back to the input text if the LLM call fails"""
+    text = record.text if text is None else text
+    try:
+        cleaned_content = invoke_llm(CLEANING_PROMPT.format(
+            query=query, 
+            doc_content=text
+        ))
+        failed = False
+    except Exception as e:
+        print(f"Error cleaning document, keeping original text: {e}")
+        cleaned_content = text
+        failed = True
+    
+    return cleaned_content, failed
+
+async def _aclean_one(query, record, semaphore, text=None):
+    """Async version of _clean_one; the semaphore bounds concurrent LLM calls"""
+    text = record.text if text is None else text
+    async with semaphore:
+        try:
+            cleaned_content = await ainvoke_llm(CLEANING_PROMPT.format(
+                query=query, 
+                doc_content=text
+            ))
+            failed = False
+        except Exception as e:
+            print(f"Error cleaning document, keeping original text: {e}")
+            cleaned_content = text
+            failed = True
+    
+    return cleaned_content, failed
+
+def _select_sentences(sentences, scores, budget):
+    """
+    Keep the highest-scoring sentences that fit in `budget` characters, in their original order
+
+    The best sentence is always kept, so a document with one overlong sentence can exceed the budget.
+    """
+    chosen, used = [], 0
+    for i in np.argsort(-scores, kind="stable"):
+        length = len(sentences[i]) + (1 if chosen else 0)
+        if chosen and used + length > budget:
+            continue
+        chosen.append(i)
+        used += length
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+def _extract_relevant(query, records, budget):
+    """
+    Extractive cleaning: keep each document's sentences most similar to the query, up to `budget` characters
+
+    The sentences of all documents are embedded in one batch with the shared MiniLM model and
+    scored against the query embedding by cosine similarity. Documents already within budget
+    are kept as they are.
+    """
+    from utils.retriever import get_embeddings
+
+    to_extract = [i for i, record in enumerate(records) if len(record.text) > budget]
+    extracted = [record.text for record in records]
+    if not to_extract:
+        return extracted
+    
+    sentences = [split_sentences(records[i].text) for i in to_extract]
+    embeddings = get_embeddings()
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    sentence_vectors = np.asarray(embeddings.embed_documents([s for doc in sentences for s in doc]), dtype=np.float32)
+    
+    # Vectorized cosine similarity of every sentence to the query
+    norms = np.linalg.norm(sentence_vectors, axis=1) * np.linalg.norm(query_vector)
+    similarities = sentence_vectors @ query_vector / np.maximum(norms, 1e-12)
+    
+    offset = 0
+    for i, doc_sentences in zip(to_extract, sentences):
+        scores = similarities[offset:offset + len(doc_sentences)]
+        offset += len(doc_sentences)
+        if doc_sentences:
+            extracted[i] = _select_sentences(doc_sentences, scores, budget)
+    return extracted
+
+def _cleaning_update(records, results):
+    # Cleaned text is stored on the shared records; the state only carries IDs
+    for record, (cleaned_content, _) in zip(records, results):
+        record.cleaned_text = cleaned_content
+    failures = sum(1 for _, failed in results if failed)
+    
+    steps = [f"Cleaned {len(records)} documents"]
+    if failures:
+        steps.append(f"Cleaning failed for {failures} documents, original text kept")
+    
+    return {"cleaned_ids": [record.doc_id for record in records], "intermediate_steps": steps}
+
+def _extractive_update(records, results, second_pass):
+    """Store extractive results; `second_pass` counts documents the LLM cleaned because they were still over budget"""
+    update = _cleaning_update(records, results)
+    update["intermediate_steps"][0] = f"Extracted query-relevant sentences from {len(records)} documents"
+    if second_pass:
+        update["intermediate_steps"].insert(1, f"Cleaned {second_pass} documents still over budget with the LLM")
+    return update
+
+def _over_budget(texts, pipeline_config):
+    """Indices of extracted texts that get the optional LLM second pass"""
+    if not pipeline_config.cleaning_llm_pass:
+        return []
+    return [i for i, text in enumerate(texts) if len(text) > pipeline_config.cleaning_budget]
+
+def _pending_cleaning(query, records, pipeline_config):
+    """
+    Documents that still need cleaning
+
+    Records cleaned in an earlier reformulation round keep their cleaned text; with the
+    process-wide memo, text cleaned for the same question by an earlier request is reused too.
+    """
+    memo = get_document_memo()
+    pending = []
+    for record in records:
+        if record.cleaned_text is None and memo is not None:
+            record.cleaned_text = memo.get(CLEANED, record.doc_id, query, cleaning_settings(pipeline_config))
+        if record.cleaned_text is None:
+            pending.append(record)
+    return pending
+
+def _finish_cleaning(query, records, pending, results, update, pipeline_config):
+    """Memoize the new cleaned texts and report every document, reused ones included, as cleaned"""
+    memo = get_document_memo()
+    if memo is not None:
+        for record, (_, failed) in zip(pending, results):
+            if not failed:
+                memo.put(CLEANED, record.doc_id, query, cleaning_settings(pipeline_config), record.cleaned_text)
+    reused = len(records) - len(pending)
+    update["cleaned_ids"] = [record.doc_id for record in records]
+    if reused:
+        update["intermediate_steps"].append(f"Reused cleaned text for {reused} documents")
+    return update
+
+def document_cleaner(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
     """Clean retrieved documents by removing noise and extracting the most relevant content"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
     query = state["query"]
-    docs = state["retrieved_docs"]
-    
-    if not docs:
-        state["cleaned_docs"] = []
-        state["intermediate_steps"].append("No documents found to clean")
-        return state
-    
-    # Create LLM
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-    
-    cleaned_docs = []
-    for i, doc in enumerate(docs):
-        # Define prompt template
-        prompt = ChatPromptTemplate.from_template(
-            """You are a professional document cleaning expert. Your task is to clean and extract relevant information from the retrieved documents.
-            
-            Query: {query}
-            
-            Document Content:
-            {doc_content}
-            
-            Please perform the following tasks:
-            1. Remove content unrelated to the query
-            2. Eliminate redundant information
-            3. Extract the most relevant facts and data
-            4. Maintain sentence integrity
-            
-            Return the cleaned document content, ensuring that all important information related to the query is retained."""
-        )
-        
-        # Clean document
-        cleaned_content = llm.invoke(prompt.format(
-            query=query, 
-            doc_content=doc.page_content
-        )).content
-        
-        # Create new document object
-        cleaned_doc = Document(
-            page_content=cleaned_content,
-            metadata=doc.metadata
-        )
-        
-        cleaned_docs.append(cleaned_doc)
-    
-    # Update state
-    state["cleaned_docs"] = cleaned_docs
-    state["intermediate_steps"].append(f"Cleaned {len(cleaned_docs)} documents")
-    
-    return state
\ No newline at end of file
+    records = state["doc_store"].records_for(state["retrieved_ids"])
+    
+    if not records:
+        return {"cleaned_ids": [], "intermediate_steps": ["No documents found to clean"]}
+    
+    # Only documents not cleaned before reach the cleaner
+    pending = _pending_cleaning(query, records, pipeline_config)
+    if not pending:
+        return _finish_cleaning(query, records, pending, [], {"intermediate_steps": []}, pipeline_config)
+    
+    if pipeline_config.cleaning_mode == "extractive":
+        texts = _extract_relevant(query, pending, pipeline_config.cleaning_budget)
+        results = [(text, False) for text in texts]
+        # Optional LLM second pass, only for documents extraction could not bring within budget
+        over_budget = _over_budget(texts, pipeline_config)
+        if over_budget:
+            with ThreadPoolExecutor(max_workers=min(get_cleaner_parallelism(), len(over_budget))) as executor:
+                second_pass = list(executor.map(propagate_context(lambda i: _clean_one(query, pending[i], texts[i])), over_budget))
+            for i, result in zip(over_budget, second_pass):
+                results[i] = result
+        update = _extractive_update(pending, results, len(over_budget))
+        return _finish_cleaning(query, records, pending, results, update, pipeline_config)
+    
+    # Clean documents concurrently; map() keeps the original document order
+    max_workers = min(get_cleaner_parallelism(), len(pending))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(propagate_context(lambda record: _clean_one(query, record)), pending))
+    
+    return _finish_cleaning(query, records, pending, results, _cleaning_update(pending, results), pipeline_config)
+
+async def adocument_cleaner(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of document_cleaner; gather() keeps the original document order"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state["query"]
+    records = state["doc_store"].records_for(state["retrieved_ids"])
+    
+    if not records:
+        return {"cleaned_ids": [], "intermediate_steps": ["No documents found to clean"]}
+    
+    pending = _pending_cleaning(query, records, pipeline_config)
+    if not pending:
+        return _finish_cleaning(query, records, pending, [], {"intermediate_steps": []}, pipeline_config)
+    
+    semaphore = asyncio.Semaphore(get_cleaner_parallelism())
+    if pipeline_config.cleaning_mode == "extractive":
+        # Embedding is CPU-bound, keep it off the event loop
+        texts = await asyncio.to_thread(_extract_relevant, query, pending, pipeline_config.cleaning_budget)
+        results = [(text, False) for text in texts]
+        over_budget = _over_budget(texts, pipeline_config)
+        second_pass = await asyncio.gather(*[_aclean_one(query, pending[i], semaphore, texts[i]) for i in over_budget])
+        for i, result in zip(over_budget, second_pass):
+            results[i] = result
+        update = _extractive_update(pending, results, len(over_budget))
+        return _finish_cleaning(query, records, pending, results, update, pipeline_config)
+    
+    results = await asyncio.gather(*[_aclean_one(query, record, semaphore) for record in pending])
+    
+    return _finish_cleaning(query, records, pending, results, _cleaning_update(pending, results), pipeline_config)
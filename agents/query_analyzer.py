@@ -1,31 +1,60 @@
 # agents/query_analyzer.py
+import os
+import re
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 from utils.state import AgentState
-from models.lora_model import LoRAModel
-from langchain_openai import ChatOpenAI
+from utils.config import PipelineConfig
+from models.batching import BatchedGenerator
+from utils.llm import invoke_llm, ainvoke_llm
+from utils.tracing import span, propagate_context, LORA
 from langchain.prompts import ChatPromptTemplate
-import os
 
 # Singleton pattern to ensure the model is loaded only once
 lora_model = None
+_lora_model_lock = threading.Lock()
 
 def get_lora_model():
     global lora_model
     if lora_model is None:
-        lora_model = LoRAModel()
+        # Concurrent requests may arrive from worker threads; load only once
+        with _lora_model_lock:
+            if lora_model is None:
+                # torch/transformers/peft are imported only when the LoRA model is actually needed
+                from models.lora_model import LoRAModel
+                model = LoRAModel()
+                model.set_prompt_prefix(LORA_PROMPT_PREFIX)
+                lora_model = model
     return lora_model
 
-def query_analyzer(state: AgentState) -> AgentState:
-    """Analyze user query to enhance search effectiveness"""
-    query = state["query"]
-    
-    # Check if LoRA model is disabled
-    if os.environ.get("DISABLE_LORA") == "true":
-        # Use standard LLM
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-        
-        prompt = ChatPromptTemplate.from_template(
-            """You are a professional query analysis expert. Your task is to analyze and refine user queries to improve search effectiveness.
+# Micro-batching queue in front of the LoRA model, shared by all concurrent requests
+lora_batcher = None
+
+def get_lora_batch_size():
+    """
+    Maximum number of prompts per batched LoRA generate call (LORA_BATCH_SIZE, default 1: no batching)
+
+    Batching is opt-in: batches of two or more prompts are prefilled in full, without the
+    cached prompt prefix, so it only pays off under sustained concurrent load.
+    """
+    return int(os.environ.get("LORA_BATCH_SIZE", "1"))
+
+def get_lora_batcher():
+    global lora_batcher
+    if lora_batcher is None:
+        with _lora_model_lock:
+            if lora_batcher is None:
+                lora_batcher = BatchedGenerator(
+                    lambda prompts, **options: get_lora_model().generate_batch(prompts, **options),
+                    max_batch_size=get_lora_batch_size(),
+                    max_wait=float(os.environ.get("LORA_BATCH_WAIT_MS", "20")) / 1000
+                )
+    return lora_batcher
+
+LLM_PROMPT = ChatPromptTemplate.from_template(
+    """You are a professional query analysis expert. Your task is to analyze and refine user queries to improve search effectiveness.
             
             Original Query: {query}
             
@@ -36,15 +65,19 @@ def query_analyzer(state: AgentState) -> AgentState:
             4. Should additional relevant keywords be added for better search results?
             
             Please provide an enhanced query that helps the retrieval system find the most relevant environmental news articles. The returned query should be a comprehensive search string."""
-        )
-        
-        analyzed_query = llm.invoke(prompt.format(query=query)).content
-        state["intermediate_steps"].append("Standard LLM used for query analysis (LoRA disabled)")
-    else:
-        # Use LoRA fine-tuned model
-        model = get_lora_model()
-        
-        prompt = f"""You are a professional query analysis expert. Your task is to analyze and refine user queries to improve search effectiveness.
+)
+
+VARIANTS_PROMPT = ChatPromptTemplate.from_template(
+    """You are a query expansion expert for a search system over environmental news articles.
+            
+            Original Query: {query}
+            
+            Write {count} alternative search queries for the same information need. Each one should use different keywords or a different perspective (synonyms, related organizations or places, narrower or broader phrasing), so that together they find articles a single query would miss.
+            
+            Return only the queries, one per line, without numbering or explanations."""
+)
+
+LORA_PROMPT_TEMPLATE = """You are a professional query analysis expert. Your task is to analyze and refine user queries to improve search effectiveness.
         
         Original Query: {query}
         
@@ -55,13 +88,101 @@ def query_analyzer(state: AgentState) -> AgentState:
         4. Should additional relevant keywords be added for better search results?
         
         Please provide an enhanced query that helps the retrieval system find the most relevant environmental news articles. The returned query should be a comprehensive search string."""
-        
-        # Use LoRA model to generate analysis results
-        analyzed_query = model.generate(prompt, max_new_tokens=150)
-        state["intermediate_steps"].append("LoRA fine-tuned model used for query analysis")
+
+# Everything before the query is identical for all requests; the LoRA model caches its key/values
+LORA_PROMPT_PREFIX = LORA_PROMPT_TEMPLATE.split("{query}")[0]
+
+def _lora_prompt(query):
+    return LORA_PROMPT_TEMPLATE.format(query=query)
+
+def _lora_generate(query):
+    # Use LoRA model to generate analysis results
+    with span("generate", LORA, batched=get_lora_batch_size() > 1, max_new_tokens=150):
+        if get_lora_batch_size() <= 1:
+            return get_lora_model().generate(_lora_prompt(query), max_new_tokens=150)
+        # Concurrent queries are grouped into one batched generate call
+        return get_lora_batcher().generate(_lora_prompt(query), max_new_tokens=150)
+
+def _parse_variants(text, count, query):
+    """Up to `count` distinct query lines from the model's answer, list markers removed"""
+    variants, seen = [], {query.strip().lower()}
+    for line in text.splitlines():
+        variant = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+        if variant and variant.lower() not in seen:
+            seen.add(variant.lower())
+            variants.append(variant)
+    return variants[:count]
+
+def _generate_variants(query, count):
+    """Alternative queries for multi-query retrieval; an empty list if the LLM call fails"""
+    try:
+        return _parse_variants(invoke_llm(VARIANTS_PROMPT.format(query=query, count=count)), count, query)
+    except Exception as e:
+        print(f"Error generating query variants, searching with the analyzed query only: {e}")
+        return []
+
+async def _agenerate_variants(query, count):
+    try:
+        return _parse_variants(await ainvoke_llm(VARIANTS_PROMPT.format(query=query, count=count)), count, query)
+    except Exception as e:
+        print(f"Error generating query variants, searching with the analyzed query only: {e}")
+        return []
+
+def _analyze(query, pipeline_config):
+    # Check if LoRA model is disabled
+    if not pipeline_config.use_lora:
+        # Use standard LLM
+        return invoke_llm(LLM_PROMPT.format(query=query))
+    # Use LoRA fine-tuned model
+    return _lora_generate(query)
+
+async def _aanalyze(query, pipeline_config):
+    if not pipeline_config.use_lora:
+        return await ainvoke_llm(LLM_PROMPT.format(query=query))
+    return await asyncio.to_thread(_lora_generate, query)
+
+def _analysis_update(analyzed_query, used_lora, variants=None):
+    if used_lora:
+        model_step = "LoRA fine-tuned model used for query analysis"
+    else:
+        model_step = "Standard LLM used for query analysis (LoRA disabled)"
+    
+    # Partial state update
+    update = {
+        "analyzed_query": analyzed_query,
+        "intermediate_steps": [model_step, f"Query analysis: Original query refined to: {analyzed_query}"]
+    }
+    if variants is not None:
+        update["query_variants"] = variants
+        update["intermediate_steps"].append(f"Generated {len(variants)} query variants: {variants}")
+    return update
+
+def query_analyzer(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Analyze user query to enhance search effectiveness"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state["query"]
+    
+    if pipeline_config.query_variants <= 1:
+        return _analysis_update(_analyze(query, pipeline_config), pipeline_config.use_lora)
+    
+    # Variants are written from the original query, so they are generated while the analysis runs
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        variants_future = executor.submit(propagate_context(_generate_variants), query, pipeline_config.query_variants - 1)
+        analyzed_query = _analyze(query, pipeline_config)
+        variants = variants_future.result()
+    
+    return _analysis_update(analyzed_query, pipeline_config.use_lora, variants)
+
+async def aquery_analyzer(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of query_analyzer; LoRA loading and generation run in a worker thread"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state["query"]
     
-    # Update state
-    state["analyzed_query"] = analyzed_query
-    state["intermediate_steps"].append(f"Query analysis: Original query refined to: {analyzed_query}")
+    if pipeline_config.query_variants <= 1:
+        return _analysis_update(await _aanalyze(query, pipeline_config), pipeline_config.use_lora)
     
-    return state
\ No newline at end of file
+    analyzed_query, variants = await asyncio.gather(
+        _aanalyze(query, pipeline_config),
+        _agenerate_variants(query, pipeline_config.query_variants - 1)
+    )
+    return _analysis_update(analyzed_query, pipeline_config.use_lora, variants)
@@ -1,25 +1,23 @@
 # 4. Relevance Evaluation Agent
 import json
-from langchain_openai import ChatOpenAI
+import uuid
+import asyncio
+import numpy as np
+from typing import Dict, Any
 from langchain.prompts import ChatPromptTemplate
 from utils.state import AgentState
+from utils.config import PipelineConfig
+from utils.llm import invoke_llm, ainvoke_llm
+from utils.similarity_policy import get_similarity_policy, calibration_enabled, log_calibration_samples, ACCEPT, REJECT
+from utils.document_memo import get_document_memo, relevance_settings, RELEVANCE
+from utils.tracing import metrics
 
-def relevance_evaluator(state: AgentState) -> AgentState:
-    """Evaluate document relevance and assign a score to each document"""
-    query = state["query"]
-    docs = state["cleaned_docs"] or state["retrieved_docs"]
-    
-    if not docs:
-        state["relevant_docs"] = []
-        state["intermediate_steps"].append("No relevant documents found")
-        return state
-    
-    # Create LLM
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-    
-    # Define prompt template
-    prompt = ChatPromptTemplate.from_template(
-        """You are a document relevance evaluation expert. Your task is to assess the relevance of the following documents to the given query.
+# Documents scoring at least this much (1-10 scale) are retained
+RETAIN_THRESHOLD = 6
+
+# Define prompt template
+EVALUATION_PROMPT = ChatPromptTemplate.from_template(
+    """You are a document relevance evaluation expert. Your task is to assess the relevance of the following documents to the given query.
         
         Query: {query}
         
@@ -42,20 +40,23 @@ def relevance_evaluator(state: AgentState) -> AgentState:
             ],
             "retained_document_indices": [0, ...]
         }}"""
-    )
-    
+)
+
+def _evaluation_prompt(query, records):
     # Prepare document string
     docs_content = "\n\n---Document Separator---\n\n".join([
-        f"Document {i}:\n{doc.page_content}" 
-        for i, doc in enumerate(docs)
+        f"Document {i}:\n{record.content}" 
+        for i, record in enumerate(records)
     ])
-    
-    # Generate evaluation result
-    evaluation_result_text = llm.invoke(prompt.format(
-        query=query, 
-        docs_content=docs_content
-    )).content
-    
+    return EVALUATION_PROMPT.format(query=query, docs_content=docs_content)
+
+def _evaluation_update(records, evaluation_result_text):
+    """
+    Parse the LLM evaluation into a partial state update
+
+    Also returns the number of evaluation items the confidence score was averaged over,
+    which may differ from len(records) when the LLM skips or repeats documents.
+    """
     print(f"Raw evaluation result text: {evaluation_result_text}")
     
     # Parse evaluation result (JSON parsing should be used in actual implementation)
@@ -64,23 +65,233 @@ def relevance_evaluator(state: AgentState) -> AgentState:
         relevant_indices = evaluation_result.get("retained_document_indices", [])
         
         # Filter relevant documents
-        relevant_docs = [docs[i] for i in relevant_indices if i < len(docs)]
+        relevant_ids = [records[i].doc_id for i in relevant_indices if i < len(records)]
         
         # Compute average relevance score as confidence score
         scores = [item.get("relevance_score", 0) for item in evaluation_result.get("evaluation", [])]
+        for item in evaluation_result.get("evaluation", []):
+            index = item.get("document_index")
+            if isinstance(index, int) and 0 <= index < len(records):
+                records[index].relevance_score = item.get("relevance_score")
+                records[index].scored_by = "llm"
         confidence_score = sum(scores) / len(scores) if scores else 0
+        averaged_over = len(scores)
         
         print(f"Relevant document indices: {relevant_indices}")
         print(f"Confidence score: {confidence_score}")
     except Exception as e:
         print(f"Error parsing evaluation result: {e}")
         # If parsing fails, retain all documents
-        relevant_docs = docs
+        relevant_ids = [record.doc_id for record in records]
         confidence_score = 5.0  # Default to medium confidence
+        averaged_over = len(records)
+    
+    # Partial state update
+    return {
+        "relevant_ids": relevant_ids,
+        "confidence_score": confidence_score,
+        "intermediate_steps": [f"Evaluation completed, retained {len(relevant_ids)} relevant documents"]
+    }, averaged_over
+
+def _question_similarities(query, records):
+    """
+    Cosine similarity of each document to the user's question, embedded once per record
+
+    The vector store's score refers to the analysed or reformulated query it was searched
+    with, while the evaluators the fast path stands in for judge documents against the
+    question itself. Returns None if the embedding model is unavailable.
+    """
+    missing = [record for record in records if record.question_similarity is None]
+    if missing:
+        try:
+            from utils.retriever import get_embeddings
+            embeddings = get_embeddings()
+            question = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+            vectors = np.asarray(embeddings.embed_documents([record.text for record in missing]), dtype=np.float32)
+        except Exception as e:
+            print(f"Question similarity unavailable: {type(e).__name__}: {e}")
+            return None
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(question)
+        for record, similarity in zip(missing, vectors @ question / np.maximum(norms, 1e-12)):
+            record.question_similarity = float(similarity)
+    return [record.question_similarity for record in records]
+
+def _similarity_update(query, records):
+    """
+    Decide relevance from the documents' similarity to the question when it is clearly high or low
+
+    Returns None for ambiguous cases (or when similarities are unavailable), which go to the evaluator.
+    Callers pass only unscored records, so LLM and cross-encoder scores are never overwritten.
+    """
+    similarities = _question_similarities(query, records)
+    if similarities is None:
+        return None
+    policy = get_similarity_policy()
+    decision, scores = policy.decide(similarities)
+    if decision not in (ACCEPT, REJECT):
+        print(f"Similarity policy: {decision}, running the relevance evaluator")
+        return None
+    
+    for record, score in zip(records, scores):
+        record.relevance_score, record.scored_by = score, "similarity"
+    relevant_ids = [record.doc_id for record, score in zip(records, scores) if score >= policy.retain_threshold]
+    confidence_score = sum(scores) / len(scores)
+    print(f"Similarity policy: {decision} (confidence {confidence_score:.2f}), skipping the relevance evaluator")
+    
+    return {
+        "relevant_ids": relevant_ids,
+        "confidence_score": confidence_score,
+        "intermediate_steps": [f"Similarity scores are clearly {'high' if decision == ACCEPT else 'low'}, retained {len(relevant_ids)} relevant documents without evaluation"]
+    }
+
+def _cross_encoder_update(query, records, pipeline_config):
+    """
+    Score the documents with the local cross-encoder in one batched pass
+
+    Returns None when scoring failed and the LLM fallback is enabled, so the caller asks
+    the LLM instead; without the fallback the failure is raised rather than keeping every
+    document unscored.
+    """
+    try:
+        from models.reranker import get_reranker
+        scores = get_reranker().score(query, [record.content for record in records])
+    except Exception as e:
+        print(f"Cross-encoder scoring failed: {type(e).__name__}: {e}")
+        metrics.increment("relevance_scoring_failures_total", scorer="cross_encoder")
+        if pipeline_config.relevance_llm_fallback:
+            print("Falling back to LLM relevance evaluation")
+            return None
+        raise RuntimeError(f"Cross-encoder relevance scoring failed ({type(e).__name__}: {e}); "
+                           "set RELEVANCE_LLM_FALLBACK=true to score with the LLM instead") from e
+    
+    for record, score in zip(records, scores):
+        record.relevance_score, record.scored_by = score, "cross_encoder"
+    relevant_ids = [record.doc_id for record, score in zip(records, scores) if score >= RETAIN_THRESHOLD]
+    # Average relevance score as confidence score, as with the LLM evaluation
+    confidence_score = sum(scores) / len(scores)
+    print(f"Cross-encoder relevance scores: {[round(score, 2) for score in scores]}")
+    print(f"Confidence score: {confidence_score}")
+    
+    return {
+        "relevant_ids": relevant_ids,
+        "confidence_score": confidence_score,
+        "intermediate_steps": [f"Cross-encoder evaluation completed, retained {len(relevant_ids)} relevant documents"]
+    }
+
+def _scored(record):
+    # Scores from the similarity policy refer to the retrieval query, not the question; they are not reused
+    return record.scored_by in ("llm", "cross_encoder") and isinstance(record.relevance_score, (int, float))
+
+def _pending_scores(query, records, pipeline_config):
+    """
+    Documents that still need a relevance score
+
+    Records scored in an earlier reformulation round keep their score; with the process-wide
+    memo, scores given for the same question by an earlier request are reused too.
+    """
+    memo = get_document_memo()
+    pending = []
+    for record in records:
+        if not _scored(record) and memo is not None:
+            memoized = memo.get(RELEVANCE, record.doc_id, query, relevance_settings(pipeline_config))
+            if memoized is not None:
+                record.relevance_score, record.scored_by = memoized
+        if not _scored(record):
+            pending.append(record)
+    return pending
+
+def _finish_scoring(query, records, pending, update, pipeline_config, averaged_over=None):
+    """
+    Memoize the new scores and fold documents scored earlier into the retained set and confidence score
+
+    `averaged_over` is the number of scores behind update["confidence_score"] (default: one per
+    pending document).
+
+    With SIMILARITY_CALIBRATION_LOG set, the new evaluator scores are also logged next to the
+    documents' similarity to the question, as data for fit_similarity_policy().
+    """
+    scored = [record for record in pending if _scored(record)]
+    memo = get_document_memo()
+    if memo is not None:
+        for record in scored:
+            memo.put(RELEVANCE, record.doc_id, query, relevance_settings(pipeline_config),
+                     (record.relevance_score, record.scored_by))
+    if scored and calibration_enabled() and _question_similarities(query, scored) is not None:
+        log_calibration_samples(uuid.uuid4().hex, scored)
+    pending_ids = {record.doc_id for record in pending}
+    reused = [record for record in records if record.doc_id not in pending_ids]
+    if not reused:
+        return update
+    
+    retained = set(update["relevant_ids"]) | {record.doc_id for record in reused if record.relevance_score >= RETAIN_THRESHOLD}
+    update["relevant_ids"] = [record.doc_id for record in records if record.doc_id in retained]
+    # Mean over all scores, with the new confidence weighted by the count it was averaged over
+    if averaged_over is None:
+        averaged_over = len(pending)
+    total = update["confidence_score"] * averaged_over + sum(record.relevance_score for record in reused)
+    update["confidence_score"] = total / (averaged_over + len(reused))
+    update["intermediate_steps"].append(f"Reused relevance scores for {len(reused)} documents, retained {len(update['relevant_ids'])} in total")
+    return update
+
+def _records_to_evaluate(state):
+    return state["doc_store"].records_for(state["cleaned_ids"] or state["retrieved_ids"])
+
+def relevance_evaluator(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Evaluate document relevance and assign a score to each document"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state["query"]
+    records = _records_to_evaluate(state)
+    
+    if not records:
+        return {"relevant_ids": [], "intermediate_steps": ["No relevant documents found"]}
+    
+    # Only documents not scored before are evaluated
+    pending = _pending_scores(query, records, pipeline_config)
+    if not pending:
+        return _finish_scoring(query, records, pending, {"relevant_ids": [], "confidence_score": 0, "intermediate_steps": []}, pipeline_config)
+    
+    if pipeline_config.similarity_fast_path:
+        update = _similarity_update(query, pending)
+        if update is not None:
+            return _finish_scoring(query, records, pending, update, pipeline_config)
+    
+    if pipeline_config.relevance_mode == "cross_encoder":
+        update = _cross_encoder_update(query, pending, pipeline_config)
+        if update is not None:
+            return _finish_scoring(query, records, pending, update, pipeline_config)
+    
+    # Generate evaluation result
+    evaluation_result_text = invoke_llm(_evaluation_prompt(query, pending))
+    
+    update, averaged_over = _evaluation_update(pending, evaluation_result_text)
+    return _finish_scoring(query, records, pending, update, pipeline_config, averaged_over)
+
+async def arelevance_evaluator(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of relevance_evaluator"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state["query"]
+    records = _records_to_evaluate(state)
+    
+    if not records:
+        return {"relevant_ids": [], "intermediate_steps": ["No relevant documents found"]}
+    
+    pending = _pending_scores(query, records, pipeline_config)
+    if not pending:
+        return _finish_scoring(query, records, pending, {"relevant_ids": [], "confidence_score": 0, "intermediate_steps": []}, pipeline_config)
+    
+    if pipeline_config.similarity_fast_path:
+        # Embedding the question and documents is CPU-bound, keep it off the event loop
+        update = await asyncio.to_thread(_similarity_update, query, pending)
+        if update is not None:
+            return _finish_scoring(query, records, pending, update, pipeline_config)
+    
+    if pipeline_config.relevance_mode == "cross_encoder":
+        # The forward pass is CPU-bound, keep it off the event loop
+        update = await asyncio.to_thread(_cross_encoder_update, query, pending, pipeline_config)
+        if update is not None:
+            return _finish_scoring(query, records, pending, update, pipeline_config)
     
-    # Update state
-    state["relevant_docs"] = relevant_docs
-    state["confidence_score"] = confidence_score
-    state["intermediate_steps"].append(f"Evaluation completed, retained {len(relevant_docs)} relevant documents")
+    evaluation_result_text = await ainvoke_llm(_evaluation_prompt(query, pending))
     
-    return state
\ No newline at end of file
+    update, averaged_over = _evaluation_update(pending, evaluation_result_text)
+    return _finish_scoring(query, records, pending, update, pipeline_config, averaged_over)
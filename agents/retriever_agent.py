@@ -1,43 +1,190 @@
 # 2. Retrieval agent
-from utils.state import AgentState
-from utils.retriever import get_retriever
-from copy import deepcopy
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+from langchain_core.documents import Document
+from utils.state import AgentState, DocumentStore
+from utils.config import PipelineConfig
+from utils.dedup import collapse_near_duplicates
+from utils.sparse_index import reciprocal_rank_fusion, hybrid_stats
+from utils.retriever import get_retriever, get_vector_backend, get_sparse_index, search_with_vectors, TEXT_KEY
+from utils.tracing import span, metrics, propagate_context, VECTORSTORE
 
-def retriever_agent(state: AgentState) -> AgentState:
-    """Retrieve relevant documents from the vector database"""
-    # Create a deep copy of the state to avoid modifying references directly
-    state_copy = deepcopy(state)
+def _search_with_scores(retriever, query):
+    """
+    Run the retriever's similarity search directly on its vector store, keeping the scores
+
+    Returns (Document, similarity) pairs; retrievers without a vector store are invoked
+    as before and give no scores.
+    """
+    vectorstore = getattr(retriever, "vectorstore", None)
+    if vectorstore is not None and hasattr(vectorstore, "similarity_search_with_score"):
+        k = getattr(retriever, "search_kwargs", {}).get("k", 4)
+        return vectorstore.similarity_search_with_score(query, k=k)
+    try:
+        # Attempt using the new recommended invoke method
+        retrieved_docs = retriever.invoke(query)
+    except (AttributeError, TypeError):
+        # If it fails, fall back to the old method
+        print("Retrieving documents using the old method")
+        retrieved_docs = retriever.get_relevant_documents(query)
+    return [(doc, None) for doc in retrieved_docs]
+
+def _dense_candidates(vectorstore, query, fetch_k):
+    """(candidates, vectors): (Document, similarity) pairs, with stored vectors if the store returns them"""
+    matches = search_with_vectors(vectorstore, query, fetch_k)
+    if matches is None:
+        return vectorstore.similarity_search_with_score(query, k=fetch_k), None
+    return [(doc, score) for doc, score, _ in matches], [vector for _, _, vector in matches]
+
+def _sparse_candidates(sparse_index, query, fetch_k):
+    """(Document, None) pairs for the best BM25 matches; keyword scores are not similarities"""
+    candidates = []
+    for row, _ in sparse_index.search(query, fetch_k):
+        metadata = sparse_index.payload(row)
+        text = metadata.pop(TEXT_KEY, "")
+        candidates.append((Document(id=sparse_index.ids[row], page_content=text, metadata=metadata), None))
+    return candidates
+
+def _fuse(rankings):
+    """
+    Merge ranked candidate lists by reciprocal rank fusion
+
+    `rankings` holds one (candidates, vectors, source) triple per list: (Document, similarity)
+    pairs in ranking order, their stored vectors or None, and the retrieval path ("dense",
+    "sparse"). Returns (candidates, vectors, sources): a candidate found by several lists keeps
+    its best similarity, vectors are returned only if every fused candidate has one, and
+    sources gives per candidate the retrieval paths that found it.
+    """
+    by_id, vectors, sources = {}, {}, {}
+    for candidates, candidate_vectors, source in rankings:
+        for position, (doc, score) in enumerate(candidates):
+            doc_id = DocumentStore.document_id(doc)
+            best = by_id.get(doc_id)
+            if best is None or (score is not None and (best[1] is None or score > best[1])):
+                by_id[doc_id] = (doc, score)
+            if candidate_vectors is not None:
+                vectors.setdefault(doc_id, candidate_vectors[position])
+            sources.setdefault(doc_id, set()).add(source)
     
-    query = state_copy.get("analyzed_query") or state_copy.get("query", "")
+    fused = reciprocal_rank_fusion([
+        [DocumentStore.document_id(doc) for doc, _ in candidates] for candidates, _, _ in rankings
+    ])
+    fused_vectors = [vectors[doc_id] for doc_id in fused] if all(doc_id in vectors for doc_id in fused) else None
+    return [by_id[doc_id] for doc_id in fused], fused_vectors, [tuple(sorted(sources[doc_id])) for doc_id in fused]
+
+def _rankings(retriever, vectorstore, query, fetch_k, sparse_index):
+    """Ranked candidate lists for one query: dense results, plus BM25 matches when hybrid retrieval is on"""
+    if vectorstore is None:
+        return [(_search_with_scores(retriever, query), None, "dense")]
+    candidates, vectors = _dense_candidates(vectorstore, query, fetch_k)
+    rankings = [(candidates, vectors, "dense")]
+    if sparse_index is not None:
+        with span("keyword_search", VECTORSTORE, backend="bm25") as keyword_span:
+            sparse = _sparse_candidates(sparse_index, query, fetch_k)
+            keyword_span.set(documents=len(sparse))
+        rankings.append((sparse, None, "sparse"))
+    return rankings
+
+def _search_distinct(retriever, queries, pipeline_config):
+    """
+    Over-fetch candidates and collapse near-duplicates (syndicated copies of one story)
+
+    Fetches k * dedup_overfetch candidates for each query, fused with BM25 keyword matches when
+    hybrid retrieval is on. Several queries (multi-query mode) are searched concurrently, their
+    rankings merged by reciprocal rank fusion, and up to k documents per query are kept.
+    Returns (results, sources, candidates, duplicates): distinct (Document, similarity) pairs
+    in ranking order and the retrieval paths of each. Duplicates are found by cosine
+    similarity of the stored vectors when available, and by MinHash signatures otherwise.
+    """
+    vectorstore = getattr(retriever, "vectorstore", None)
+    k = getattr(retriever, "search_kwargs", {}).get("k", 4)
+    sparse_index = get_sparse_index() if pipeline_config.hybrid_retrieval else None
+    single_query = len(queries) == 1
+    if single_query and (vectorstore is None or (pipeline_config.dedup_overfetch <= 1 and sparse_index is None)):
+        results = _search_with_scores(retriever, queries[0])
+        return results, [()] * len(results), len(results), 0
+    
+    fetch_k = k * max(1, pipeline_config.dedup_overfetch)
+    if single_query:
+        rankings = _rankings(retriever, vectorstore, queries[0], fetch_k, sparse_index)
+    else:
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            per_query = executor.map(propagate_context(lambda query: _rankings(retriever, vectorstore, query, fetch_k, sparse_index)), queries)
+            rankings = [ranking for query_rankings in per_query for ranking in query_rankings]
+    
+    if len(rankings) == 1:
+        candidates, vectors, _ = rankings[0]
+        sources = [()] * len(candidates)
+    else:
+        candidates, vectors, sources = _fuse(rankings)
+        if vectors is None and hasattr(vectorstore, "vectors_for"):
+            # Keyword-only hits have no vector from the search; the local index has them stored
+            vectors = vectorstore.vectors_for([DocumentStore.document_id(doc) for doc, _ in candidates])
+        if sparse_index is None:
+            sources = [()] * len(candidates)   # Retrieval paths only matter for hybrid retrieval
+    
+    limit = k * len(queries)
+    if pipeline_config.dedup_overfetch <= 1:
+        kept, duplicates = list(range(min(limit, len(candidates)))), 0
+    else:
+        kept, duplicates = collapse_near_duplicates([doc.page_content for doc, _ in candidates], limit, vectors=vectors,
+                                                    cosine_threshold=pipeline_config.dedup_threshold)
+    return [candidates[i] for i in kept], [sources[i] for i in kept], len(candidates), duplicates
+
+def retriever_agent(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Retrieve relevant documents from the vector database"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    query = state.get("analyzed_query") or state.get("query", "")
     
     if not query:
-        state_copy["retrieved_docs"] = []
-        state_copy["intermediate_steps"].append("Error: No query found")
-        return state_copy
+        return {"retrieved_ids": [], "intermediate_steps": ["Error: No query found"]}
     
     # Get retriever
     retriever = get_retriever()
+    # In multi-query mode the analyzer's variants are searched in the same round
+    queries = [query] + list(state.get("query_variants") or [])
     
-    # Retrieve documents - using the new invocation method
-    try:
-        # Attempt using the new recommended invoke method
-        retrieved_docs = retriever.invoke(query)
-        
-        # Debugging information
-        print(f"Number of retrieved documents: {len(retrieved_docs)}")
-        if retrieved_docs:
-            print(f"First document summary: {retrieved_docs[0].page_content[:100]}...")
-    except (AttributeError, TypeError):
-        # If it fails, fall back to the old method
-        retrieved_docs = retriever.get_relevant_documents(query)
-        
-        # Debugging information
-        print(f"Number of documents retrieved using the old method: {len(retrieved_docs)}")
-        if retrieved_docs:
-            print(f"First document summary: {retrieved_docs[0].page_content[:100]}...")
+    # Retrieve distinct documents together with their similarity scores
+    with span("similarity_search", VECTORSTORE, backend=get_vector_backend(), queries=len(queries)) as search_span:
+        results, sources, candidates, duplicates = _search_distinct(retriever, queries, pipeline_config)
+        search_span.set(documents=len(results), candidates=candidates, duplicates_dropped=duplicates)
+    if duplicates:
+        metrics.increment("duplicates_dropped_total", duplicates)
     
-    # Update state
-    state_copy["retrieved_docs"] = retrieved_docs
-    state_copy["intermediate_steps"].append(f"Retrieved {len(retrieved_docs)} documents")
+    # Debugging information
+    print(f"Number of retrieved documents: {len(results)}")
+    if results:
+        doc, similarity = results[0]
+        print(f"First document summary (similarity {similarity}): {doc.page_content[:100]}...")
     
-    return state_copy
\ No newline at end of file
+    # Documents are stored once per request; the state only carries their IDs
+    doc_store = state["doc_store"]
+    retrieved_ids = []
+    for (doc, similarity), retrieved_by in zip(results, sources):
+        doc_id = doc_store.add(doc, similarity)
+        doc_store.get(doc_id).retrieved_by = retrieved_by
+        retrieved_ids.append(doc_id)
+    retrieved_ids = list(dict.fromkeys(retrieved_ids))
+    keyword_only = sum(1 for retrieved_by in sources if retrieved_by == ("sparse",))
+    if any(sources):
+        hybrid_stats.record("retrievals")
+        if keyword_only:
+            hybrid_stats.record("contributed")
+    
+    steps = [f"Retrieved {len(retrieved_ids)} documents"]
+    if len(queries) > 1:
+        steps.append(f"Searched {len(queries)} queries concurrently")
+    if duplicates:
+        steps.append(f"Dropped {duplicates} near-duplicate documents out of {candidates} candidates")
+    if keyword_only:
+        steps.append(f"{keyword_only} documents found only by keyword search")
+    
+    return {
+        "retrieved_ids": retrieved_ids,
+        "intermediate_steps": steps
+    }
+
+async def aretriever_agent(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of retriever_agent; query embedding is CPU-bound, so retrieval runs in a worker thread"""
+    return await asyncio.to_thread(retriever_agent, state, pipeline_config)
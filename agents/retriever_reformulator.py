@@ -1,30 +1,11 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from utils.state import AgentState
-from copy import deepcopy
+from utils.llm import invoke_llm, ainvoke_llm
+from utils.config import PipelineConfig
+from typing import Dict, Any
 
-def retriever_reformulator(state: AgentState) -> AgentState:
-    """Reconstruct the retrieval query to obtain better results"""
-    # Create a deep copy of the state to avoid modifying references directly
-    state_copy = deepcopy(state)
-    
-    query = state_copy["query"]
-    docs = state_copy["relevant_docs"] or []
-    
-    reformulation_count = state_copy.get("reformulation_count", 0) + 1
-    state_copy["reformulation_count"] = reformulation_count
-    
-    state_copy["intermediate_steps"].append(f"Starting reformulation attempt {reformulation_count}")
-    
-    # Check if the maximum number of reconfigurations has been reached
-    if reformulation_count >= 2:
-        state_copy["intermediate_steps"].append(f"Maximum reformulation attempts reached")
-        return state_copy
-    
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
-    
-    prompt = ChatPromptTemplate.from_template(
-        """You are an advanced query reformulation expert. The following query has been initially retrieved, but the results are not ideal. Please help reformulate the query to obtain more relevant results.
+REFORMULATION_PROMPT = ChatPromptTemplate.from_template(
+    """You are an advanced query reformulation expert. The following query has been initially retrieved, but the results are not ideal. Please help reformulate the query to obtain more relevant results.
         
         Original Query: {query}
         
@@ -34,26 +15,66 @@ def retriever_reformulator(state: AgentState) -> AgentState:
         This is reformulation attempt {reformulation_count}. Based on the original query and existing information, generate a query variation significantly different from previous attempts, ensuring the use of new keywords and perspectives.
         
         Return a final query string that incorporates these variations while remaining relevant to the original question but improving retrieval effectiveness."""
-    )
+)
+
+def _start_reformulation(state, pipeline_config):
+    """Bump the counter; returns (update, prompt), prompt is None when the limit is reached"""
+    query = state["query"]
+    records = state["doc_store"].records_for(state["relevant_ids"])
+    
+    reformulation_count = state.get("reformulation_count", 0) + 1
+    update = {
+        "reformulation_count": reformulation_count,
+        "intermediate_steps": [f"Starting reformulation attempt {reformulation_count}"]
+    }
     
-    docs_summary = "No sufficiently relevant documents found." if not docs else "\n".join([
-        f"{i+1}. " + (doc.page_content[:150] + "..." if len(doc.page_content) > 150 else doc.page_content)
-        for i, doc in enumerate(docs[:3])
+    # Check if the maximum number of reconfigurations has been reached
+    if reformulation_count >= pipeline_config.max_reformulations:
+        update["intermediate_steps"].append(f"Maximum reformulation attempts reached")
+        return update, None
+    
+    docs_summary = "No sufficiently relevant documents found." if not records else "\n".join([
+        f"{i+1}. " + (record.content[:150] + "..." if len(record.content) > 150 else record.content)
+        for i, record in enumerate(records[:3])
     ])
     
-    reformulated_query = llm.invoke(prompt.format(
+    prompt = REFORMULATION_PROMPT.format(
         query=query, 
         docs_summary=docs_summary,
         reformulation_count=reformulation_count
-    )).content
-    
+    )
+    return update, prompt
+
+def _apply_reformulation(update, reformulated_query):
     # Ensure that only the analyzed query is updated and not the original query
-    state_copy["analyzed_query"] = reformulated_query
-    state_copy["intermediate_steps"].append(f"Reformulated query: {reformulated_query}")
+    update["analyzed_query"] = reformulated_query
+    update["intermediate_steps"].append(f"Reformulated query: {reformulated_query}")
+    
+    # Clearing previous search results to avoid status confusion; the records stay in the store
+    update["retrieved_ids"] = None
+    update["cleaned_ids"] = None
+    update["relevant_ids"] = None
+    
+    return update
+
+def retriever_reformulator(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Reconstruct the retrieval query to obtain better results"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    update, prompt = _start_reformulation(state, pipeline_config)
+    if prompt is None:
+        return update
+    
+    reformulated_query = invoke_llm(prompt, temperature=0.3)
+    
+    return _apply_reformulation(update, reformulated_query)
+
+async def aretriever_reformulator(state: AgentState, pipeline_config: PipelineConfig = None) -> Dict[str, Any]:
+    """Async version of retriever_reformulator"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    update, prompt = _start_reformulation(state, pipeline_config)
+    if prompt is None:
+        return update
     
-    # Clearing previous search results to avoid status confusion
-    state_copy["retrieved_docs"] = None
-    state_copy["cleaned_docs"] = None
-    state_copy["relevant_docs"] = None
+    reformulated_query = await ainvoke_llm(prompt, temperature=0.3)
     
-    return state_copy
\ No newline at end of file
+    return _apply_reformulation(update, reformulated_query)
@@ -1,91 +1,328 @@
 # app.py
+from utils.startup import startup_timer, start_background_warm_up
 import os
+import json
+import time
+import queue
+import asyncio
 import argparse
+import threading
 from dotenv import load_dotenv
 
-from utils.state import initialize_state
-from graph import build_rag_graph, visualize_rag_graph
-from interface import create_gradio_interface
-from evaluation.evaluator import evaluate_all_systems
+from utils.state import initialize_state, apply_update
+from utils.config import PipelineConfig
+from utils.semantic_cache import cached_run, lookup_cached_result, store_result
+from utils.tracing import start_trace
 
-def run_rag_system(query: str):
-    """Run the multi-agent RAG system"""
-    # Build graph
-    _, rag_chain = build_rag_graph()
+# Heavy modules (graph/agents/LoRA model, Gradio, evaluation) are imported by the code paths that use them
+startup_timer.record("core imports", startup_timer.elapsed())
+
+def run_rag_system(query: str, pipeline_config: PipelineConfig = None):
+    """Run the multi-agent RAG system, serving repeated questions from the semantic cache when enabled"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    return cached_run(query, pipeline_config.mode_name, lambda: _run_rag_graph(query, pipeline_config))
+
+def _run_rag_graph(query: str, pipeline_config: PipelineConfig):
+    """Run the compiled agent graph for a single query, recording a trace of its nodes and calls"""
+    with start_trace(query, pipeline_config.mode_name) as trace:
+        result = _invoke_rag_graph(query, pipeline_config)
+    result["trace"] = trace.to_dict()
+    return result
+
+def _invoke_rag_graph(query: str, pipeline_config: PipelineConfig):
+    from graph import get_compiled_graph
+    
+    # Get the shared compiled graph (built once per configuration); timed separately from the query
+    graph_start = time.perf_counter()
+    rag_chain = get_compiled_graph(pipeline_config)
+    graph_build_time = time.perf_counter() - graph_start
     
     # Initialize state
     state = initialize_state(query)
     
     # Add configuration to prevent infinite recursion
     config = {
-        "recursion_limit": 20,  # Increase recursion limit to ensure sufficient execution
+        "recursion_limit": pipeline_config.recursion_limit,  # Increase recursion limit to ensure sufficient execution
         "interrupt_before": [],  # Optional: Interrupt before certain nodes
         "interrupt_after": []    # Optional: Interrupt after certain nodes
     }
     
+    query_start = time.perf_counter()
     try:
         # Run workflow
         print("Starting workflow execution...")
         result = rag_chain.invoke(state, config=config)
         print("Workflow execution completed")
+        result["graph_build_time"] = graph_build_time
+        result["query_time"] = time.perf_counter() - query_start
+        print(f"Graph build: {graph_build_time:.3f}s, query: {result['query_time']:.2f}s")
         return result
     except Exception as e:
-        # Handle possible errors
-        print(f"Error occurred while running RAG system: {e}")
-        
-        # Emergency handling: If recursion error occurs but documents are retrieved, attempt answer generation
-        if "recursion_limit" in str(e) and (state.get("retrieved_docs") or state.get("cleaned_docs")):
-            from agents.answer_generator import answer_generator
-            print("Detected recursion error but retrieved documents exist. Attempting emergency answer generation...")
-            state = answer_generator(state)  # Directly invoke answer generator
-        else:
-            # Return result with error message
-            state["answer"] = f"An error occurred while processing your query. Please try a more specific or different query.\nError details: {str(e)[:100]}..."
-            state["intermediate_steps"].append(f"Error: {str(e)}")
-        
+        state = _recover_from_error(state, e)
+        state["graph_build_time"] = graph_build_time
+        state["query_time"] = time.perf_counter() - query_start
         return state
 
+async def arun_rag_system(query: str, pipeline_config: PipelineConfig = None):
+    """
+    Async version of run_rag_system
+
+    Runs the async agent graph with ainvoke, so many queries can be in flight in one
+    process. CPU-bound work (embedding the query for the semantic cache, LoRA generation,
+    retrieval) is offloaded to worker threads by the agents.
+    """
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    
+    cached = await asyncio.to_thread(lookup_cached_result, query, pipeline_config.mode_name)
+    if cached is not None:
+        return cached
+    
+    from graph import get_compiled_graph
+    
+    graph_start = time.perf_counter()
+    rag_chain = get_compiled_graph(pipeline_config, use_async=True)
+    graph_build_time = time.perf_counter() - graph_start
+    
+    state = initialize_state(query)
+    config = {"recursion_limit": pipeline_config.recursion_limit}
+    
+    query_start = time.perf_counter()
+    with start_trace(query, pipeline_config.mode_name) as trace:
+        try:
+            result = await rag_chain.ainvoke(state, config=config)
+        except Exception as e:
+            # Emergency answer generation is a blocking call, keep it off the event loop
+            result = await asyncio.to_thread(_recover_from_error, state, e)
+    result["graph_build_time"] = graph_build_time
+    result["query_time"] = time.perf_counter() - query_start
+    result["trace"] = trace.to_dict()
+    
+    await asyncio.to_thread(store_result, query, pipeline_config.mode_name, result)
+    return result
+
+def _recover_from_error(state, e):
+    """Turn a failed graph run into a result state with an answer or error message"""
+    # Handle possible errors
+    print(f"Error occurred while running RAG system: {e}")
+    state["error"] = str(e)
+    
+    # Emergency handling: If recursion error occurs but documents are retrieved, attempt answer generation
+    if "recursion_limit" in str(e) and (state.get("retrieved_ids") or state.get("cleaned_ids")):
+        from agents.answer_generator import answer_generator
+        print("Detected recursion error but retrieved documents exist. Attempting emergency answer generation...")
+        state = apply_update(state, answer_generator(state))  # Directly invoke answer generator
+    else:
+        # Return result with error message
+        state["answer"] = f"An error occurred while processing your query. Please try a more specific or different query.\nError details: {str(e)[:100]}..."
+        state["intermediate_steps"].append(f"Error: {str(e)}")
+    
+    return state
+
+def stream_rag_system(query: str, pipeline_config: PipelineConfig = None):
+    """
+    Run the multi-agent RAG system and yield progress events as they happen
+
+    Yields dicts with a "type" key:
+        {"type": "step", "node": name, "steps": [...]}  new intermediate steps after each graph node
+        {"type": "token", "text": chunk}                 answer text as the answer generator streams it
+        {"type": "result", "state": final_state}         the final state, always the last event
+    """
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    
+    cached = lookup_cached_result(query, pipeline_config.mode_name)
+    if cached is not None:
+        yield {"type": "step", "node": "semantic_cache", "steps": cached["intermediate_steps"]}
+        yield {"type": "token", "text": cached["answer"]}
+        yield {"type": "result", "state": cached}
+        return
+    
+    from graph import get_compiled_graph
+    
+    graph_start = time.perf_counter()
+    rag_chain = get_compiled_graph(pipeline_config)
+    graph_build_time = time.perf_counter() - graph_start
+    
+    state = initialize_state(query)
+    events = queue.Queue()
+    streamed = []
+    
+    def on_token(text):
+        streamed.append(text)
+        events.put({"type": "token", "text": text})
+    
+    config = {
+        "recursion_limit": pipeline_config.recursion_limit,
+        "configurable": {"token_callback": on_token}
+    }
+    
+    def run_graph():
+        # The graph runs in a worker thread so node updates and answer tokens can be yielded as they arrive
+        query_start = time.perf_counter()
+        final_state = state
+        with start_trace(query, pipeline_config.mode_name) as trace:
+            try:
+                for mode, chunk in rag_chain.stream(state, config=config, stream_mode=["updates", "values"]):
+                    if mode == "values":
+                        final_state = chunk
+                        continue
+                    for node, update in chunk.items():
+                        # Nodes return only their new steps, so updates can be forwarded as they are
+                        events.put({"type": "step", "node": node, "steps": (update or {}).get("intermediate_steps") or []})
+            except Exception as e:
+                final_state = _recover_from_error(final_state, e)
+        # Answers that were not produced by the streaming LLM call (fixed messages, errors) arrive in one piece
+        if not streamed and final_state.get("answer"):
+            events.put({"type": "token", "text": final_state["answer"]})
+        final_state["graph_build_time"] = graph_build_time
+        final_state["query_time"] = time.perf_counter() - query_start
+        final_state["trace"] = trace.to_dict()
+        events.put({"type": "result", "state": final_state})
+    
+    threading.Thread(target=run_graph, daemon=True).start()
+    while True:
+        event = events.get()
+        yield event
+        if event["type"] == "result":
+            store_result(query, pipeline_config.mode_name, event["state"])
+            return
+
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description="Advanced RAG System with LoRA Fine-tuned Agent")
     parser.add_argument("--evaluate", action="store_true", help="Run evaluation on all system configurations")
+    parser.add_argument("--eval-workers", type=int, default=4, help="Question/system pairs evaluated concurrently")
+    parser.add_argument("--eval-with-caches", action="store_true", help="Keep the LLM response cache and document memo enabled during evaluation")
+    parser.add_argument("--eval-restart", action="store_true", help="Discard earlier evaluation results instead of resuming")
     parser.add_argument("--visualize", action="store_true", help="Generate and display RAG system graph")
     parser.add_argument("--test", action="store_true", help="Run a test query to verify system functionality")
+    parser.add_argument("--export-pinecone", metavar="PATH", help="Export the Pinecone index to a JSONL file")
+    parser.add_argument("--import-pinecone-export", metavar="PATH", help="Build the local vector index from a Pinecone JSONL export")
+    parser.add_argument("--build-sparse-index", metavar="SOURCE", help="Build the BM25 keyword index from a Pinecone JSONL export or a local index directory")
+    parser.add_argument("--ingest", metavar="PATH", help="Embed new and changed articles from a CSV or JSONL file into the configured vector index")
+    parser.add_argument("--ingest-workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="Embedding processes for --ingest")
+    parser.add_argument("--ingest-batch-size", type=int, default=256, help="Chunks per embedding batch for --ingest")
+    parser.add_argument("--ingest-text-field", default="Cleaned Text", help="Article text column for --ingest")
+    parser.add_argument("--ingest-id-field", default="id", help="Article ID column for --ingest (content hash if missing)")
+    parser.add_argument("--ingest-metadata-fields", help="Comma-separated article columns to store as chunk metadata for --ingest (default: all)")
+    parser.add_argument("--fit-similarity-policy", metavar="LOG", help="Fit the similarity fast-path thresholds on a SIMILARITY_CALIBRATION_LOG file")
+    parser.add_argument("--ivf-lists", type=int, default=0, help="Number of IVF lists for the local index (0 = brute force)")
+    parser.add_argument("--merge-lora", metavar="PATH", help="Merge the LoRA adapter into the base model and save it to PATH")
+    parser.add_argument("--lora-variant", choices=["bf16", "int8"], default="bf16", help="Merged checkpoint variant for --merge-lora")
     args = parser.parse_args()
     
     # 加载环境变量
     load_dotenv()
     
-    # Build the graph for visualization only
-    print("Building multi-agent RAG system...")
-    workflow, _ = build_rag_graph()
+    # Build the merged LoRA checkpoint used when LORA_MERGED_PATH is set
+    if args.merge_lora:
+        from models.lora_model import merge_and_save
+        merge_and_save(args.merge_lora, variant=args.lora_variant)
+        print(f"Set LORA_MERGED_PATH={args.merge_lora} to load it.")
+        return
+    
+    # Local vector index maintenance
+    if args.export_pinecone:
+        from utils.resources import registry
+        from utils.local_index import export_pinecone_index
+        export_pinecone_index(registry.get("pinecone_index"), args.export_pinecone)
+        return
+    if args.import_pinecone_export:
+        from utils.local_index import import_pinecone_export
+        index_path = os.environ.get("LOCAL_INDEX_PATH", "local_index")
+        import_pinecone_export(args.import_pinecone_export, index_path, ivf_lists=args.ivf_lists)
+        print(f"Local index written to {index_path}. Set VECTOR_BACKEND=local to use it.")
+        return
+    
+    if args.ingest:
+        from utils.ingest import ingest, backend_target
+        sink, manifest_path = backend_target(ivf_lists=args.ivf_lists)
+        metadata_fields = [field.strip() for field in args.ingest_metadata_fields.split(",")] \
+            if args.ingest_metadata_fields else None
+        ingest(args.ingest, sink, manifest_path, text_field=args.ingest_text_field, id_field=args.ingest_id_field,
+               batch_size=args.ingest_batch_size, workers=args.ingest_workers, metadata_fields=metadata_fields,
+               sparse_index_path=os.environ.get("SPARSE_INDEX_PATH", "sparse_index"))
+        return
+    if args.build_sparse_index:
+        from utils.sparse_index import build_sparse_index
+        index_path = os.environ.get("SPARSE_INDEX_PATH", "sparse_index")
+        build_sparse_index(args.build_sparse_index, index_path)
+        print(f"Sparse index written to {index_path}. Set HYBRID_RETRIEVAL=true to use it.")
+        return
+    
+    if args.fit_similarity_policy:
+        from utils.similarity_policy import fit_similarity_policy, load_calibration_samples, POLICY_FILE
+        fitted = fit_similarity_policy(load_calibration_samples(args.fit_similarity_policy))
+        policy_path = os.environ.get("SIMILARITY_POLICY_FILE", POLICY_FILE)
+        with open(policy_path, "w", encoding="utf-8") as f:
+            json.dump(fitted, f, indent=2)
+        print(f"Similarity policy fitted: {fitted}")
+        print(f"Thresholds written to {policy_path}. Set SIMILARITY_FAST_PATH=true to use them.")
+        return
+    
+    # Optional Prometheus-style metrics endpoint (/metrics, plus /stats and /traces as JSON)
+    if os.environ.get("METRICS_PORT"):
+        from utils.tracing import start_metrics_server
+        start_metrics_server(int(os.environ["METRICS_PORT"]), host=os.environ.get("METRICS_HOST", "127.0.0.1"))
     
     # 如果指定了--visualize参数，生成并显示RAG系统图
     if args.visualize:
+        from graph import build_rag_graph, visualize_rag_graph
         print("Generating RAG system visualization graph...")
-        visualize_rag_graph(workflow)
+        with startup_timer.phase("visualize"):
+            workflow, _ = build_rag_graph()
+            visualize_rag_graph(workflow)
+        if not (args.evaluate or args.test):
+            # Drawing the graph needs no models, so the warm-up and the UI are skipped
+            startup_timer.report("Startup timing report")
+            return
+    
+    # Warm up the embeddings, vector index, compiled graph and LoRA model in the background;
+    # requests that arrive earlier build whatever they need on first use
+    print("Warming up shared resources in the background...")
+    warm_up = start_background_warm_up(PipelineConfig.from_env())
     
     # 如果指定了--evaluate参数，运行评估
     if args.evaluate:
+        from evaluation.evaluator import evaluate_all_systems
+        warm_up.wait()
         print("Evaluating all system configurations...")
-        evaluate_all_systems()
+        evaluate_all_systems(max_workers=args.eval_workers, resume=not args.eval_restart,
+                             use_caches=args.eval_with_caches)
         return
     
     # 如果指定了--test参数，运行测试查询
     if args.test:
+        warm_up.wait()
         print("\nTesting system...")
         test_query = "Who represented his/her country to receive the 2021 winner of the Earthshot Protect and Restore Nature Award?"
-        result = run_rag_system(test_query)
         print(f"Query: {test_query}")
-        print(f"Answer: {result['answer']}")
         print("Processing Steps:")
-        for step in result["intermediate_steps"]:
-            print(f"- {step}")
+        answer_started = False
+        for event in stream_rag_system(test_query):
+            if event["type"] == "result" and event["state"].get("trace"):
+                # Where the time went, per span kind
+                print("\nTrace summary:")
+                for kind, entry in event["state"]["trace"]["summary"].items():
+                    print(f"- {kind}: {entry['calls']} calls, {entry['seconds']:.2f}s, "
+                          f"{entry['prompt_tokens']} prompt / {entry['completion_tokens']} completion tokens")
+            elif event["type"] == "step":
+                for step in event["steps"]:
+                    print(f"- {step}")
+            elif event["type"] == "token":
+                # Render the answer progressively as tokens arrive
+                if not answer_started:
+                    print("Answer: ", end="", flush=True)
+                    answer_started = True
+                print(event["text"], end="", flush=True)
+        print()
         return
     
     # 否则，启动Gradio界面
     print("\nLaunching Gradio interface...")
-    demo = create_gradio_interface(run_rag_system)
+    with startup_timer.phase("interface build"):
+        from interface import create_gradio_interface
+        demo = create_gradio_interface(run_rag_system, stream_rag_system)
+    startup_timer.report("Startup timing report (interface ready, warm-up may still be running)")
     demo.launch(share=True)
 
 if __name__ == "__main__":
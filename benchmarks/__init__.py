@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+from .stubs import StubChatModel, StubRetriever, StubEmbeddings, StubLoRAModel, install_stubs, synthetic_queries
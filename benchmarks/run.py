@@ -0,0 +1,242 @@
+# benchmarks/run.py
+"""
+Offline benchmark of the four system modes
+
+Runs base LLM, simple RAG and both advanced RAG modes against local stand-ins for
+ChatOpenAI, the Pinecone retriever and (by default) the LoRA model, and writes a JSON
+report with end-to-end and per-node latency, throughput, allocations and peak RSS.
+
+    python -m benchmarks.run --queries both --synthetic 32 --llm-latency-ms 50 --output bench.json
+    python -m benchmarks.run --compare bench.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+
+MODES = ("base_llm", "simple_rag", "advanced_rag_base", "advanced_rag_finetuned")
+
+
+def percentiles(values):
+    """count/mean/p50/p95/p99/max of a list of seconds"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": pick(0.5),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+def _run_advanced(query, use_lora):
+    from app import run_rag_system
+    from utils.config import PipelineConfig
+
+    # Other pipeline settings (RELEVANCE_MODE, SIMILARITY_FAST_PATH, ...) come from the environment
+    return run_rag_system(query, PipelineConfig.from_env(use_lora=use_lora))["trace"]
+
+
+def _runner(mode):
+    if mode in ("base_llm", "simple_rag"):
+        from evaluation.runner import system_runner
+        run = system_runner(mode)
+        return lambda query: run(query)["trace"]
+    use_lora = mode == "advanced_rag_finetuned"
+    return lambda query: _run_advanced(query, use_lora)
+
+
+def _timed(run, query):
+    start = time.perf_counter()
+    trace = run(query)
+    return time.perf_counter() - start, trace
+
+
+def benchmark_mode(mode, queries, concurrency=1, warmup=1, track_allocations=True):
+    """Run every query through `mode` and aggregate latency, throughput and memory figures"""
+    from utils.similarity_policy import get_similarity_policy
+    from utils.sparse_index import hybrid_stats
+
+    run = _runner(mode)
+    for query in queries[:warmup]:
+        run(query)   # First calls compile graphs and fill lazy singletons
+    policy = get_similarity_policy()
+    policy.reset()
+    hybrid_stats.reset()
+
+    if track_allocations:
+        tracemalloc.reset_peak()
+        allocated_before = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(lambda query: _timed(run, query), queries))
+    else:
+        timings = [_timed(run, query) for query in queries]
+    wall_time = time.perf_counter() - start
+
+    nodes, kinds, tokens = {}, {}, {"prompt": 0, "completion": 0}
+    for _, trace in timings:
+        for span in trace["spans"]:
+            kinds.setdefault(span["kind"], []).append(span["duration"])
+            if span["kind"] == "node":
+                nodes.setdefault(span["name"], []).append(span["duration"])
+            tokens["prompt"] += span["attributes"].get("prompt_tokens", 0)
+            tokens["completion"] += span["attributes"].get("completion_tokens", 0)
+
+    result = {
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "wall_time": wall_time,
+        "throughput_qps": len(queries) / wall_time if wall_time else 0.0,
+        "end_to_end": percentiles([seconds for seconds, _ in timings]),
+        "nodes": {name: percentiles(values) for name, values in nodes.items()},
+        "span_kinds": {kind: percentiles(values) for kind, values in kinds.items()},
+        "tokens": tokens,
+    }
+    if track_allocations:
+        current, peak = tracemalloc.get_traced_memory()
+        result["allocations"] = {"peak_bytes": peak - allocated_before, "retained_bytes": current - allocated_before}
+    result["peak_rss_bytes"] = _peak_rss()
+    if policy.stats()["total"]:
+        result["similarity_policy"] = policy.stats()
+    if hybrid_stats.stats()["retrievals"]:
+        result["hybrid_retrieval"] = hybrid_stats.stats()
+    return result
+
+
+def _peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline):
+    """Print the change in end-to-end p50/p95 and throughput per mode against a baseline report"""
+    print(f"Comparison against {baseline['meta'].get('commit') or 'baseline'}:")
+    for mode, result in report["modes"].items():
+        base = baseline["modes"].get(mode)
+        if not base:
+            continue
+        for key in ("p50", "p95"):
+            now, before = result["end_to_end"][key], base["end_to_end"][key]
+            change = (now - before) / before * 100 if before else 0.0
+            print(f"- {mode} {key}: {before * 1000:.1f} ms -> {now * 1000:.1f} ms ({change:+.1f}%)")
+        print(f"- {mode} throughput: {base['throughput_qps']:.2f} -> {result['throughput_qps']:.2f} q/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark with stub LLM, retriever and LoRA model")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--queries", choices=["test", "synthetic", "both"], default="both")
+    parser.add_argument("--synthetic", type=int, default=32, help="Number of synthetic queries")
+    parser.add_argument("--repeat", type=int, default=1, help="Run the query set this many times")
+    parser.add_argument("--concurrency", type=int, default=1, help="Queries in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed queries per mode before measuring")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Injected latency per LLM call")
+    parser.add_argument("--llm-token-latency-ms", type=float, default=0.0, help="Injected latency per generated token")
+    parser.add_argument("--retriever-latency-ms", type=float, default=0.0, help="Injected latency per retrieval")
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0, help="Injected latency per embedding call")
+    parser.add_argument("--lora-latency-ms", type=float, default=0.0, help="Injected latency per stub LoRA generation")
+    parser.add_argument("--doc-chars", type=int, default=2400, help="Characters per stub document")
+    parser.add_argument("--real-lora", action="store_true", help="Load the real LoRA model instead of the stub")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the LLM response cache, semantic cache and document memo enabled")
+    parser.add_argument("--no-allocations", action="store_true", help="Skip tracemalloc (it slows Python code down)")
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' console output")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="Print the change against an earlier report")
+    args = parser.parse_args(argv)
+
+    # Read the baseline first, it may be the file this run overwrites
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # No API keys are needed, but the OpenAI client settings are read from the environment
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    if not args.with_caches:
+        # Measure the pipeline itself, not cache hits
+        os.environ["LLM_CACHE"] = "false"
+        os.environ["SEMANTIC_CACHE"] = "false"
+        os.environ["DOCUMENT_MEMO"] = "false"
+
+    from benchmarks.stubs import install_stubs, synthetic_queries
+    from evaluation.test_question import TEST_QUESTIONS
+
+    install_stubs(
+        llm_latency=args.llm_latency_ms / 1000,
+        llm_token_latency=args.llm_token_latency_ms / 1000,
+        retriever_latency=args.retriever_latency_ms / 1000,
+        lora_latency=args.lora_latency_ms / 1000,
+        embedding_latency=args.embedding_latency_ms / 1000,
+        doc_chars=args.doc_chars,
+        stub_lora=not args.real_lora,
+    )
+
+    queries = []
+    if args.queries in ("test", "both"):
+        queries += TEST_QUESTIONS
+    if args.queries in ("synthetic", "both"):
+        queries += synthetic_queries(args.synthetic)
+    queries = queries * args.repeat
+
+    if not args.no_allocations:
+        tracemalloc.start()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "modes": {},
+    }
+    for mode in args.modes:
+        print(f"Benchmarking {mode} ({len(queries)} queries)...")
+        output = None if args.verbose else io.StringIO()
+        with redirect_stdout(output or sys.stdout):
+            result = benchmark_mode(mode, queries, concurrency=args.concurrency, warmup=args.warmup,
+                                    track_allocations=not args.no_allocations)
+        report["modes"][mode] = result
+        e2e = result["end_to_end"]
+        print(f"  p50 {e2e['p50'] * 1000:.1f} ms, p95 {e2e['p95'] * 1000:.1f} ms, "
+              f"{result['throughput_qps']:.2f} q/s, peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB")
+    report["peak_rss_bytes"] = _peak_rss()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark report written to {args.output}")
+
+    if baseline is not None:
+        compare(report, baseline)
+    return report
+
+
+if __name__ == "__main__":
+    main()
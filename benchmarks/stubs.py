@@ -0,0 +1,251 @@
+# benchmarks/stubs.py
+import re
+import time
+import json
+import asyncio
+import hashlib
+import importlib
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+TOPICS = [
+    "renewable energy", "carbon capture", "deforestation", "biodiversity", "extreme weather",
+    "climate policy", "ocean plastic", "air pollution", "electric vehicles", "green finance",
+]
+
+WORDS = (
+    "climate emissions policy government report energy forest species carbon storage wind solar "
+    "flood drought regulation agreement investment target research community coast wildlife"
+).split()
+
+
+def _seed(*parts):
+    """Deterministic integer seed from strings (Python's hash() is randomized per process)"""
+    return int(hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def _text(seed, n_words):
+    return " ".join(WORDS[(seed // (i + 1) + i * 7) % len(WORDS)] for i in range(n_words))
+
+
+def _count_tokens(text):
+    # Rough whitespace token count, good enough for relative comparisons
+    return len(text.split())
+
+
+class StubChatModel:
+    """
+    Deterministic local stand-in for ChatOpenAI
+
+    Recognizes the agents' prompts by their instructions and answers in the expected
+    format (JSON for relevance evaluation, a query string for analysis/reformulation, ...).
+    Each call sleeps `latency` seconds plus `per_token_latency` per generated token.
+    """
+
+    def __init__(self, model="stub", temperature=0, latency=0.0, per_token_latency=0.0, answer_words=120):
+        self.model = model
+        self.temperature = temperature
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.answer_words = answer_words
+
+    def _respond(self, prompt):
+        prompt = str(prompt)
+        seed = _seed(prompt)
+        if "relevance evaluation expert" in prompt:
+            count = len(re.findall(r"Document \d+:", prompt))
+            evaluation = []
+            for i in range(count):
+                score = _seed(prompt, str(i)) % 10 + 1
+                evaluation.append({"document_index": i, "relevance_score": score, "retain": score >= 6})
+            return json.dumps({
+                "evaluation": evaluation,
+                "retained_document_indices": [item["document_index"] for item in evaluation if item["retain"]]
+            })
+        if "query expansion expert" in prompt:
+            count = int(re.search(r"Write (\d+) alternative", prompt).group(1))
+            return "\n".join(f"{i + 1}. {_text(_seed(prompt, str(i)), 12)}" for i in range(count))
+        if "query analysis expert" in prompt or "query reformulation expert" in prompt:
+            return _text(seed, 20)
+        if "document cleaning expert" in prompt:
+            return _text(seed, 80)
+        return _text(seed, self.answer_words)
+
+    @staticmethod
+    def _usage(prompt, content):
+        prompt_tokens, completion_tokens = _count_tokens(str(prompt)), _count_tokens(content)
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def _message(self, prompt, content):
+        return AIMessage(content=content, usage_metadata=self._usage(prompt, content))
+
+    def _usage_chunk(self, prompt, content):
+        # Usage arrives with a final empty chunk, as with stream_usage=True
+        return AIMessageChunk(content="", usage_metadata=self._usage(prompt, content))
+
+    def _delay(self, content):
+        return self.latency + self.per_token_latency * _count_tokens(content)
+
+    def invoke(self, prompt):
+        content = self._respond(prompt)
+        time.sleep(self._delay(content))
+        return self._message(prompt, content)
+
+    async def ainvoke(self, prompt):
+        content = self._respond(prompt)
+        await asyncio.sleep(self._delay(content))
+        return self._message(prompt, content)
+
+    def _chunks(self, prompt):
+        content = self._respond(prompt)
+        words = content.split(" ")
+        pieces = [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+        return content, pieces
+
+    def stream(self, prompt):
+        content, pieces = self._chunks(prompt)
+        time.sleep(self.latency)
+        for piece in pieces:
+            time.sleep(self.per_token_latency)
+            yield AIMessageChunk(content=piece)
+        yield self._usage_chunk(prompt, content)
+
+    async def astream(self, prompt):
+        content, pieces = self._chunks(prompt)
+        await asyncio.sleep(self.latency)
+        for piece in pieces:
+            await asyncio.sleep(self.per_token_latency)
+            yield AIMessageChunk(content=piece)
+        yield self._usage_chunk(prompt, content)
+
+
+class StubRetriever:
+    """Deterministic stand-in for the Pinecone retriever: k synthetic documents per query"""
+
+    def __init__(self, k=5, doc_chars=2400, latency=0.0):
+        self.k = k
+        self.doc_chars = doc_chars
+        self.latency = latency
+        # Looks like a VectorStoreRetriever to the retriever agent, so similarity scores are available
+        self.vectorstore = self
+        self.search_kwargs = {"k": k}
+
+    def _documents(self, query, k=None):
+        docs = []
+        for i in range(k or self.k):
+            seed = _seed(query, str(i))
+            topic = TOPICS[seed % len(TOPICS)]
+            if i % 3 == 2:
+                # Every third result is a syndicated copy of the previous story
+                docs.append(Document(
+                    page_content=docs[-1].page_content + " Reported by wire services.",
+                    metadata={"id": f"stub-{seed % 100000}", "Title": docs[-1].metadata["Title"]}
+                ))
+                continue
+            words = _text(seed, self.doc_chars // 6).split()
+            # Sentences of 12 words, so sentence-level processing has something to work with
+            sentences = [" ".join(words[j:j + 12]).capitalize() + "." for j in range(0, len(words), 12)]
+            text = f"{topic.title()}. " + " ".join(sentences)
+            docs.append(Document(
+                page_content=text[:self.doc_chars],
+                metadata={"id": f"stub-{seed % 100000}", "Title": topic.title()}
+            ))
+        return docs
+
+    def invoke(self, query, **kwargs):
+        time.sleep(self.latency)
+        return self._documents(query)
+
+    def get_relevant_documents(self, query):
+        return self.invoke(query)
+
+    def similarity_search_with_score(self, query, k=None):
+        time.sleep(self.latency)
+        docs = self._documents(query, k)
+        # Cosine-like similarities spread over 0.1-0.9
+        return [(doc, 0.1 + (_seed(query, doc.page_content) % 800) / 1000) for doc in docs]
+
+
+class StubEmbeddings:
+    """Deterministic bag-of-words stand-in for the MiniLM embeddings (hashed words, 384 dimensions)"""
+
+    def __init__(self, dimension=384, latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+
+    def _vector(self, text):
+        vector = [0.0] * self.dimension
+        for word in re.findall(r"\w+", text.lower()):
+            vector[_seed(word) % self.dimension] += 1.0
+        return vector
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        # One batched call costs about as much as a single text
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+class StubLoRAModel:
+    """Stand-in for models.lora_model.LoRAModel with the same generate/generate_batch interface"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.prefix_stats = {"requests": 0, "prefix_hits": 0, "prefill_tokens": 0, "prefill_tokens_saved": 0}
+
+    def set_prompt_prefix(self, prefix):
+        pass
+
+    def generate(self, prompt, max_new_tokens=100, temperature=0.3):
+        time.sleep(self.latency)
+        return _text(_seed(prompt), min(max_new_tokens, 20))
+
+    def generate_batch(self, prompts, max_new_tokens=100, temperature=0.3):
+        # One batched forward pass costs about as much as a single prompt
+        time.sleep(self.latency)
+        return [_text(_seed(prompt), min(max_new_tokens, 20)) for prompt in prompts]
+
+
+def synthetic_queries(count, seed=0):
+    """Deterministic environmental-news style questions"""
+    templates = [
+        "What are the latest developments in {topic} since {year}?",
+        "How has {topic} policy changed in {region} after {year}?",
+        "Which countries lead on {topic} in {year}?",
+        "What are the main criticisms of {topic} initiatives in {region}?",
+    ]
+    regions = ["the EU", "China", "the UK", "North America", "Brazil", "India"]
+    queries = []
+    for i in range(count):
+        value = _seed(str(seed), str(i))
+        queries.append(templates[value % len(templates)].format(
+            topic=TOPICS[(value // 7) % len(TOPICS)],
+            region=regions[(value // 11) % len(regions)],
+            year=2021 + (value // 13) % 3,
+        ))
+    return queries
+
+
+def install_stubs(llm_latency=0.0, llm_token_latency=0.0, retriever_latency=0.0, lora_latency=0.0,
+                  embedding_latency=0.0, doc_chars=2400, stub_lora=True):
+    """Route the agents' LLM, retriever, embedding and (optionally) LoRA model calls to the local stand-ins"""
+    from utils.llm import set_llm_factory
+    from utils.resources import registry
+    from utils.retriever import TracedEmbeddings
+    # agents/__init__ re-exports the query_analyzer function under the submodule's name
+    query_analyzer = importlib.import_module("agents.query_analyzer")
+
+    set_llm_factory(lambda model, temperature: StubChatModel(
+        model, temperature, latency=llm_latency, per_token_latency=llm_token_latency
+    ))
+    registry.override("retriever", StubRetriever(doc_chars=doc_chars, latency=retriever_latency))
+    registry.override("embeddings", TracedEmbeddings(StubEmbeddings(latency=embedding_latency)))
+    if stub_lora:
+        query_analyzer.lora_model = StubLoRAModel(latency=lora_latency)
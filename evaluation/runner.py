@@ -0,0 +1,203 @@
+# evaluation/runner.py
+"""
+Parallel, resumable evaluation of question x system pairs
+
+Every pair runs in a bounded thread pool and is appended to a JSONL file as soon as it
+finishes, so an interrupted run loses at most the pairs that were in flight. Re-running
+with the same file skips the pairs that already completed without an error.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.config import PipelineConfig
+from utils.state import initialize_state
+from utils.tracing import start_trace, span, VECTORSTORE
+
+SYSTEMS = ("base_llm", "simple_rag", "advanced_rag_base", "advanced_rag_finetuned")
+
+SIMPLE_RAG_PROMPT = """Based on the following context information, please answer the user's question.
+
+            Question: {query}
+
+            Context:
+            {docs_content}
+
+            Please provide a comprehensive and accurate answer based only on the information in the context.
+            """
+
+
+def run_base_llm(query):
+    """Answer with the LLM alone (no retrieval)"""
+    from utils.llm import invoke_llm
+
+    with start_trace(query, "base_llm") as trace:
+        answer = invoke_llm(query)
+    return {"answer": answer, "intermediate_steps": [], "trace": trace.to_dict()}
+
+def run_simple_rag(query):
+    """Retrieve once and answer from the retrieved documents (no agents)"""
+    from utils.llm import invoke_llm
+    from utils.retriever import get_retriever
+
+    with start_trace(query, "simple_rag") as trace:
+        with span("similarity_search", VECTORSTORE):
+            docs = get_retriever().invoke(query)
+        docs_content = "\n\n".join([doc.page_content for doc in docs])
+        answer = invoke_llm(SIMPLE_RAG_PROMPT.format(query=query, docs_content=docs_content))
+    return {"answer": answer, "intermediate_steps": [], "trace": trace.to_dict()}
+
+def run_advanced_rag(query, pipeline_config):
+    """
+    Run the agent graph for one query
+
+    Calls the compiled graph directly rather than app.run_rag_system, so answers are never
+    served from the semantic cache during evaluation.
+    """
+    from graph import get_compiled_graph
+
+    rag_chain = get_compiled_graph(pipeline_config)
+    with start_trace(query, pipeline_config.mode_name) as trace:
+        result = rag_chain.invoke(initialize_state(query), config={"recursion_limit": pipeline_config.recursion_limit})
+    return {"answer": result["answer"], "intermediate_steps": result["intermediate_steps"], "trace": trace.to_dict()}
+
+def system_runner(system):
+    """Callable taking a query and returning {"answer", "intermediate_steps", "trace"} for `system`"""
+    if system == "base_llm":
+        return run_base_llm
+    if system == "simple_rag":
+        return run_simple_rag
+    if system in ("advanced_rag_base", "advanced_rag_finetuned"):
+        # The LoRA switch is part of the pipeline config, so both systems can run side by side
+        pipeline_config = PipelineConfig.from_env(use_lora=system == "advanced_rag_finetuned")
+        return lambda query: run_advanced_rag(query, pipeline_config)
+    raise ValueError(f"Unknown system: {system}")
+
+
+def latency_breakdown(trace, total, queued):
+    """Per-pair latency: wall time, time spent queued, and seconds per span kind and per graph node"""
+    nodes = {}
+    for item in trace["spans"]:
+        if item["kind"] == "node":
+            nodes[item["name"]] = nodes.get(item["name"], 0.0) + (item["duration"] or 0.0)
+    return {
+        "total": total,
+        "queued": queued,
+        "kinds": trace["summary"],
+        "nodes": nodes,
+    }
+
+def load_results(output_file):
+    """
+    Read the records of a results file, keeping the last record per (system, question)
+
+    A truncated last line (the process died mid-write) is ignored.
+    """
+    records = {}
+    if not os.path.exists(output_file):
+        return records
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable line in {output_file}")
+                continue
+            records[(record["system"], record["question"])] = record
+    return records
+
+
+class EvaluationRunner:
+    """
+    Runs question x system pairs concurrently and streams each result to a JSONL file
+
+    Pairs already recorded without an error in `output_file` are skipped when `resume`
+    is true; failed pairs are retried.
+    """
+
+    def __init__(self, questions, systems=SYSTEMS, output_file="evaluation_results.jsonl",
+                 max_workers=4, resume=True):
+        self.questions = list(questions)
+        self.systems = list(systems)
+        self.output_file = output_file
+        self.max_workers = max(1, max_workers)
+        self.resume = resume
+        self._write_lock = threading.Lock()
+
+    def _drop_partial_line(self):
+        # A write cut short by a crash leaves a line without "\n"; new records must not extend it
+        with open(self.output_file, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def pending_pairs(self):
+        """(system, question) pairs that still have to run"""
+        done = set()
+        if self.resume and os.path.exists(self.output_file):
+            self._drop_partial_line()
+            done = {key for key, record in load_results(self.output_file).items() if not record.get("error")}
+        elif os.path.exists(self.output_file):
+            os.remove(self.output_file)
+        return [(system, q) for system in self.systems for q in self.questions if (system, q) not in done]
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._write_lock:
+            with open(self.output_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _run_pair(self, system, question, runner, submitted_at):
+        started = time.perf_counter()
+        record = {"system": system, "question": question}
+        try:
+            result = runner(question)
+            total = time.perf_counter() - started
+            record.update({
+                "answer": result["answer"],
+                "steps": result["intermediate_steps"],
+                "latency": latency_breakdown(result["trace"], total, started - submitted_at),
+                "error": None,
+            })
+        except Exception as e:
+            record.update({
+                "answer": None,
+                "steps": [],
+                "latency": {"total": time.perf_counter() - started, "queued": started - submitted_at},
+                "error": f"{type(e).__name__}: {e}",
+            })
+        record["completed_at"] = time.time()
+        self._write(record)
+        return record
+
+    def run(self):
+        """Run all pending pairs and return every record in the results file"""
+        pairs = self.pending_pairs()
+        skipped = len(self.systems) * len(self.questions) - len(pairs)
+        print(f"Evaluating {len(pairs)} question/system pairs with {self.max_workers} workers"
+              + (f" ({skipped} already done)" if skipped else ""))
+
+        runners = {system: system_runner(system) for system in self.systems}
+        failures = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            submitted_at = time.perf_counter()
+            futures = [
+                executor.submit(self._run_pair, system, q, runners[system], submitted_at)
+                for system, q in pairs
+            ]
+            for finished, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                status = f"failed ({record['error']})" if record["error"] else f"{record['latency']['total']:.2f}s"
+                failures += bool(record["error"])
+                print(f"[{finished}/{len(pairs)}] {record['system']}: {record['question'][:60]} - {status}")
+
+        if failures:
+            print(f"{failures} pairs failed; run again to retry them")
+        return load_results(self.output_file)
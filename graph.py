@@ -1,32 +1,74 @@
 # graph.py
+import time
 import tempfile
+import threading
+from functools import partial
 from langgraph.graph import StateGraph, END
 from typing import TypedDict, List, Optional, Annotated
 from langchain.schema import Document
 
 from utils.state import AgentState
-from utils.decision_functions import should_clean_docs, assess_confidence
+from utils.config import PipelineConfig
+from utils.decision_functions import should_clean_docs, assess_confidence, should_retrieve_again
+from utils.tracing import traced_node
 from agents import (
     query_analyzer, 
     retriever_agent, 
     document_cleaner, 
     relevance_evaluator,
     answer_generator, 
-    retriever_reformulator
+    retriever_reformulator,
+    aquery_analyzer,
+    aretriever_agent,
+    adocument_cleaner,
+    arelevance_evaluator,
+    aanswer_generator,
+    aretriever_reformulator
 )
 
-def build_rag_graph():
-    """Build multi-agent RAG system graph"""
+# Node implementations for the sync and async graphs
+SYNC_NODES = {
+    "query_analyzer": query_analyzer,
+    "retriever": retriever_agent,
+    "document_cleaner": document_cleaner,
+    "relevance_evaluator": relevance_evaluator,
+    "answer_generator": answer_generator,
+    "retriever_reformulator": retriever_reformulator,
+}
+ASYNC_NODES = {
+    "query_analyzer": aquery_analyzer,
+    "retriever": aretriever_agent,
+    "document_cleaner": adocument_cleaner,
+    "relevance_evaluator": arelevance_evaluator,
+    "answer_generator": aanswer_generator,
+    "retriever_reformulator": aretriever_reformulator,
+}
+
+# Compiled graphs keyed by (PipelineConfig, use_async), shared across requests
+_compiled_graphs = {}
+_graph_build_times = {}
+_graph_cache_lock = threading.Lock()
+
+def build_rag_graph(pipeline_config: PipelineConfig = None, use_async: bool = False):
+    """
+    Build multi-agent RAG system graph
+
+    With use_async=True the nodes are the async agents, for running the graph with ainvoke/astream.
+    The routing functions are cheap and non-blocking, so both graphs share them.
+    """
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    nodes = ASYNC_NODES if use_async else SYNC_NODES
+    
     # Create graph
     workflow = StateGraph(AgentState)
     
-    # Add nodes
-    workflow.add_node("query_analyzer", query_analyzer)
-    workflow.add_node("retriever", retriever_agent)
-    workflow.add_node("document_cleaner", document_cleaner)
-    workflow.add_node("relevance_evaluator", relevance_evaluator)
-    workflow.add_node("answer_generator", answer_generator)
-    workflow.add_node("retriever_reformulator", retriever_reformulator)
+    # Add nodes; every execution is recorded as a span of the request's trace
+    workflow.add_node("query_analyzer", traced_node("query_analyzer", partial(nodes["query_analyzer"], pipeline_config=pipeline_config)))
+    workflow.add_node("retriever", traced_node("retriever", partial(nodes["retriever"], pipeline_config=pipeline_config)))
+    workflow.add_node("document_cleaner", traced_node("document_cleaner", partial(nodes["document_cleaner"], pipeline_config=pipeline_config)))
+    workflow.add_node("relevance_evaluator", traced_node("relevance_evaluator", partial(nodes["relevance_evaluator"], pipeline_config=pipeline_config)))
+    workflow.add_node("answer_generator", traced_node("answer_generator", partial(nodes["answer_generator"], pipeline_config=pipeline_config)))
+    workflow.add_node("retriever_reformulator", traced_node("retriever_reformulator", partial(nodes["retriever_reformulator"], pipeline_config=pipeline_config)))
     
     # Add edges
     workflow.add_edge("query_analyzer", "retriever")
@@ -34,7 +76,7 @@ def build_rag_graph():
     # Conditional edge: Determine if document cleaning is needed
     workflow.add_conditional_edges(
         "retriever",
-        should_clean_docs,
+        partial(should_clean_docs, pipeline_config=pipeline_config),
         {
             "clean": "document_cleaner",
             "skip_cleaning": "relevance_evaluator"
@@ -46,7 +88,7 @@ def build_rag_graph():
     # Conditional edge: Determine path based on confidence assessment
     workflow.add_conditional_edges(
         "relevance_evaluator",
-        assess_confidence,
+        partial(assess_confidence, pipeline_config=pipeline_config),
         {
             "generate_answer": "answer_generator",
             "try_reformulate": "retriever_reformulator"
@@ -57,7 +99,7 @@ def build_rag_graph():
     # 使用明确的条件分支而不是基于状态的lambda函数
     workflow.add_conditional_edges(
         "retriever_reformulator",
-        lambda state: "skip_retrieval" if state.get("reformulation_count", 0) >= 2 else "do_retrieval",
+        partial(should_retrieve_again, pipeline_config=pipeline_config),
         {
             "skip_retrieval": "answer_generator",
             "do_retrieval": "retriever"
@@ -69,15 +111,33 @@ def build_rag_graph():
     # Set entry point
     workflow.set_entry_point("query_analyzer")
     
-    # Compile graph with proper config to avoid recursion issues
-    config = {
-        "recursion_limit": 10,  # 减小递归限制，避免过深的递归
-    }
-    
+    # The recursion limit is a per-run setting (PipelineConfig.recursion_limit), passed at invoke time
     rag_chain = workflow.compile()
     
     return workflow, rag_chain
 
+def get_compiled_graph(pipeline_config: PipelineConfig = None, use_async: bool = False):
+    """Return the compiled graph for a pipeline configuration, building it only on first use"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    key = (pipeline_config, use_async)
+    rag_chain = _compiled_graphs.get(key)
+    if rag_chain is not None:
+        return rag_chain
+    
+    with _graph_cache_lock:
+        rag_chain = _compiled_graphs.get(key)
+        if rag_chain is None:
+            start_time = time.perf_counter()
+            _, rag_chain = build_rag_graph(pipeline_config, use_async=use_async)
+            _graph_build_times[key] = time.perf_counter() - start_time
+            _compiled_graphs[key] = rag_chain
+            print(f"Compiled {'async ' if use_async else ''}RAG graph for {pipeline_config} in {_graph_build_times[key]:.3f}s")
+    return rag_chain
+
+def get_graph_build_time(pipeline_config: PipelineConfig = None, use_async: bool = False):
+    """Seconds spent building and compiling the graph for a configuration (None if not built yet)"""
+    return _graph_build_times.get((pipeline_config or PipelineConfig.from_env(), use_async))
+
 def visualize_rag_graph(workflow):
     """Visualize RAG system graph using Mermaid compatible output"""
     try:
@@ -3,10 +3,14 @@ import gradio as gr
 import tempfile
 import matplotlib.pyplot as plt
 import networkx as nx
-import os
 
-def create_gradio_interface(run_system_fn):
-    """Create a Gradio interface with visualization functionality"""
+def create_gradio_interface(run_system_fn, stream_system_fn=None):
+    """
+    Create a Gradio interface with visualization functionality
+
+    If `stream_system_fn` is given, the advanced RAG modes render the answer and processing
+    steps progressively from its events instead of waiting for `run_system_fn` to finish.
+    """
     
     # Function to generate an image
     def generate_rag_graph_image():
@@ -115,62 +119,78 @@ def create_gradio_interface(run_system_fn):
 
     # Define process function for different system modes
     def process_query(query, system_mode, run_system_fn):
-        """Process query based on selected system mode"""
-        from langchain_openai import ChatOpenAI
+        """Process query based on selected system mode, yielding (answer, steps) as they become available"""
+        from utils.llm import invoke_llm
         from langchain.prompts import ChatPromptTemplate
         from utils.retriever import get_retriever
-        from utils.state import initialize_state
+        from utils.config import PipelineConfig
+        from utils.semantic_cache import cached_run
         
         # 1. Base LLM (No RAG)
         if system_mode == "Base LLM (No RAG)":
-            llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
-            answer = llm.invoke(query).content
-            steps = "Used base LLM model without retrieval or agents."
+            def run_base_llm():
+                return {
+                    "answer": invoke_llm(query, temperature=0.3),
+                    "intermediate_steps": ["Used base LLM model without retrieval or agents."]
+                }
+            
+            result = cached_run(query, "base_llm", run_base_llm)
+            answer = result["answer"]
+            steps = "\n".join(result["intermediate_steps"])
             
         # 2. Simple RAG
         elif system_mode == "Simple RAG":
-            llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
-            retriever = get_retriever()
-            docs = retriever.get_relevant_documents(query)
-            
-            docs_content = "\n\n".join([doc.page_content for doc in docs])
-            
-            prompt = ChatPromptTemplate.from_template(
-                """Based on the following context information, please answer the user's question.
+            def run_simple_rag():
+                retriever = get_retriever()
+                docs = retriever.get_relevant_documents(query)
                 
-                Question: {query}
+                docs_content = "\n\n".join([doc.page_content for doc in docs])
                 
-                Context:
-                {docs_content}
+                prompt = ChatPromptTemplate.from_template(
+                    """Based on the following context information, please answer the user's question.
+                    
+                    Question: {query}
+                    
+                    Context:
+                    {docs_content}
+                    
+                    Please provide a comprehensive and accurate answer based only on the information in the context.
+                    """
+                )
                 
-                Please provide a comprehensive and accurate answer based only on the information in the context.
-                """
-            )
+                return {
+                    "answer": invoke_llm(prompt.format(query=query, docs_content=docs_content), temperature=0.3),
+                    "intermediate_steps": [f"Retrieved {len(docs)} documents", "Used simple RAG approach without advanced agents."]
+                }
             
-            answer = llm.invoke(prompt.format(query=query, docs_content=docs_content)).content
-            steps = f"Retrieved {len(docs)} documents\nUsed simple RAG approach without advanced agents."
-            
-        # 3. Advanced RAG without LoRA
-        elif system_mode == "Advanced RAG (No Fine-tuning)":
-            # Disable LoRA
-            os.environ["DISABLE_LORA"] = "true"
-            result = run_system_fn(query)
+            result = cached_run(query, "simple_rag", run_simple_rag)
             answer = result["answer"]
             steps = "\n".join(result["intermediate_steps"])
-            # Clean up environment
-            if "DISABLE_LORA" in os.environ:
-                del os.environ["DISABLE_LORA"]
-                
-        # 4. Advanced RAG with LoRA
-        else:  # Default to Advanced RAG with LoRA
-            # Make sure LoRA is enabled
-            if "DISABLE_LORA" in os.environ:
-                del os.environ["DISABLE_LORA"]
-            result = run_system_fn(query)
+            
+        # 3. Advanced RAG without LoRA / 4. Advanced RAG with LoRA (default)
+        else:
+            # LoRA is switched through the pipeline config, so concurrent requests do not interfere;
+            # the other settings come from the environment, as in the warm-up and the CLI
+            pipeline_config = PipelineConfig.from_env(use_lora=system_mode != "Advanced RAG (No Fine-tuning)")
+            
+            if stream_system_fn is not None:
+                answer, steps = "", []
+                for event in stream_system_fn(query, pipeline_config):
+                    if event["type"] == "step":
+                        steps.extend(event["steps"])
+                    elif event["type"] == "token":
+                        answer += event["text"]
+                    else:
+                        answer = event["state"].get("answer") or answer
+                        steps = list(event["state"].get("intermediate_steps", steps))
+                    yield answer, "\n".join(steps)
+                return
+            
+            result = run_system_fn(query, pipeline_config)
             answer = result["answer"]
             steps = "\n".join(result["intermediate_steps"])
         
-        return answer, steps
+        yield answer, steps
     
     with gr.Blocks(title="Environmental News Multi-Agent RAG System") as demo:
         gr.Markdown("# Environmental News Multi-Agent Retrieval-Augmented Generation System")
@@ -223,9 +243,12 @@ def create_gradio_interface(run_system_fn):
             outputs=[workflow_image, workflow_image, workflow_desc, workflow_desc]
         )
         
-        # Process query
+        # Process query (a generator function, so Gradio streams each partial update)
+        def submit_query(q, mode):
+            yield from process_query(q, mode, run_system_fn)
+        
         submit_btn.click(
-            fn=lambda q, mode: process_query(q, mode, run_system_fn),
+            fn=submit_query,
             inputs=[query_input, system_mode],
             outputs=[answer_output, steps_output]
         )
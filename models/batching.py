@@ -0,0 +1,128 @@
+# models/batching.py
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future
+
+
+class _Request:
+    __slots__ = ("prompt", "options", "future", "enqueued_at", "context")
+
+    def __init__(self, prompt, options):
+        self.prompt = prompt
+        self.options = options
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        # The submitter's trace context, so a batch of one is recorded on the caller's span
+        self.context = contextvars.copy_context()
+
+
+class BatchedGenerator:
+    """
+    Micro-batching scheduler in front of a batched generate function
+
+    Callers submit single prompts from any thread. A worker thread takes the first waiting
+    prompt, keeps collecting prompts for up to `max_wait` seconds or until `max_batch_size`
+    are waiting, runs them through one `generate_batch_fn(prompts, **options)` call and
+    resolves each caller's future with its own output. Only prompts with identical
+    generation options (max_new_tokens, temperature, ...) are batched together.
+    """
+
+    def __init__(self, generate_batch_fn, max_batch_size=4, max_wait=0.02, history=256):
+        self.generate_batch_fn = generate_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = {"requests": 0, "batches": 0, "failed_batches": 0}
+        self.recent_batches = deque(maxlen=history)   # (batch_size, queue_wait, batch_latency)
+        self._queue = queue.Queue()
+        self._deferred = deque()   # Requests whose options did not match the batch being built
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="lora-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt, **options):
+        """Queue a prompt and return a Future for its generated text"""
+        request = _Request(prompt, options)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, prompt, **options):
+        """Queue a prompt and block until its batch has been generated"""
+        return self.submit(prompt, **options).result()
+
+    def _next_request(self, timeout=None):
+        if self._deferred:
+            return self._deferred.popleft()
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect_batch(self):
+        first = self._next_request()
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        skipped = []
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            request = self._next_request(timeout=remaining)
+            if request is None:
+                break
+            if request.options == first.options:
+                batch.append(request)
+            else:
+                skipped.append(request)
+
+        # Keep arrival order for the requests that have to wait for a later batch
+        self._deferred.extendleft(reversed(skipped))
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            queue_wait = max(started - request.enqueued_at for request in batch)
+            try:
+                prompts = [request.prompt for request in batch]
+                if len(batch) == 1:
+                    outputs = batch[0].context.run(self.generate_batch_fn, prompts, **batch[0].options)
+                else:
+                    outputs = self.generate_batch_fn(prompts, **batch[0].options)
+            except Exception as e:
+                with self._lock:
+                    self.metrics["failed_batches"] += 1
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            latency = time.perf_counter() - started
+            with self._lock:
+                self.metrics["requests"] += len(batch)
+                self.metrics["batches"] += 1
+                self.recent_batches.append((len(batch), queue_wait, latency))
+            print(f"LoRA batch: {len(batch)}/{self.max_batch_size} prompts, "
+                  f"generated in {latency:.2f}s (max queue wait {queue_wait * 1000:.0f} ms)")
+
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output)
+
+    def stats(self):
+        """Request/batch counts plus average occupancy, queue wait and latency of recent batches"""
+        with self._lock:
+            recent = list(self.recent_batches)
+            metrics = dict(self.metrics)
+        if recent:
+            sizes, waits, latencies = zip(*recent)
+            metrics.update({
+                "avg_batch_size": sum(sizes) / len(sizes),
+                "avg_occupancy": sum(sizes) / (len(sizes) * self.max_batch_size),
+                "avg_queue_wait": sum(waits) / len(waits),
+                "avg_batch_latency": sum(latencies) / len(latencies),
+                "max_batch_latency": max(latencies),
+            })
+        return metrics
@@ -1,47 +1,254 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import os
+import json
+import time
+import copy
+import threading
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, GenerationConfig
 from peft import PeftModel
 import torch
 
+from utils.tracing import current_span, LORA
+
+BASE_MODEL_NAME = "HuggingFaceTB/SmolLM2-1.7B-Instruct"
+LORA_WEIGHTS_PATH = "lora_mc_model"
+# Written next to a merged checkpoint; records how the weights were produced and how to load them
+MERGED_MARKER_FILE = "merged_lora.json"
+MERGED_VARIANTS = ("bf16", "int8")
+# State dict of the dynamically quantized model, written instead of safetensors by the int8 variant
+INT8_WEIGHTS_FILE = "model_int8.pt"
+
+def merge_and_save(output_path, variant="bf16", base_model_name=BASE_MODEL_NAME,
+                   lora_weights_path=LORA_WEIGHTS_PATH):
+    """
+    Merge the LoRA adapter into the base weights and save a single safetensors checkpoint
+
+    Parameters:
+        output_path: directory for the merged checkpoint (weights, config, tokenizer)
+        variant: "bf16" stores bfloat16 weights; "int8" quantizes the Linear layers to int8
+            (dynamic quantization, for CPU inference) once here and stores the quantized weights
+        base_model_name: base model name
+        lora_weights_path: LoRA weights path
+    """
+    if variant not in MERGED_VARIANTS:
+        raise ValueError(f"Unknown merged checkpoint variant: {variant} (expected one of {MERGED_VARIANTS})")
+
+    # Merge in float32 so the adapter delta is added at full precision
+    model = AutoModelForCausalLM.from_pretrained(base_model_name, torch_dtype=torch.float32)
+    model = PeftModel.from_pretrained(model, lora_weights_path).merge_and_unload()
+    model.eval()
+
+    os.makedirs(output_path, exist_ok=True)
+    if variant == "int8":
+        quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        # Non-persistent buffers (e.g. rotary frequencies) are not in the state dict, so they are saved alongside
+        torch.save({"state_dict": quantized.state_dict(), "buffers": dict(quantized.named_buffers())},
+                   os.path.join(output_path, INT8_WEIGHTS_FILE))
+        model.config.save_pretrained(output_path)
+        model.generation_config.save_pretrained(output_path)
+    else:
+        model.to(torch.bfloat16).save_pretrained(output_path, safe_serialization=True)
+    AutoTokenizer.from_pretrained(base_model_name).save_pretrained(output_path)
+    with open(os.path.join(output_path, MERGED_MARKER_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "variant": variant,
+            "base_model_name": base_model_name,
+            "lora_weights_path": lora_weights_path
+        }, f, indent=2)
+
+    print(f"Merged LoRA checkpoint ({variant}) saved to {output_path}")
+    return output_path
+
+def read_merged_marker(path):
+    """Return the merge marker of a merged checkpoint directory, or None if `path` is not one"""
+    marker_path = os.path.join(path, MERGED_MARKER_FILE) if path else None
+    if not marker_path or not os.path.exists(marker_path):
+        return None
+    with open(marker_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
 class LoRAModel:
-    def __init__(self, base_model_name="HuggingFaceTB/SmolLM2-1.7B-Instruct", 
-                 lora_weights_path="lora_mc_model"):
+    def __init__(self, base_model_name=BASE_MODEL_NAME,
+                 lora_weights_path=LORA_WEIGHTS_PATH, merged_model_path=None):
         """
         Initializing the LoRA trim model
-        
+
         Parameters:
             base_model_name: base model name
             lora_weights_path: LoRA weights path
+            merged_model_path: merged checkpoint written by merge_and_save(); defaults to the
+                LORA_MERGED_PATH env var. When it exists the adapter is not applied at runtime.
         """
-        self.tokenizer = AutoTokenizer.from_pretrained(base_model_name)
-        
-        # Inspection of equipment and loading of models 
+        start = time.perf_counter()
+        merged_model_path = merged_model_path or os.environ.get("LORA_MERGED_PATH")
+        marker = read_merged_marker(merged_model_path)
+
+        # Inspection of equipment and loading of models
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device} for LoRA model")
+
+        if marker is not None:
+            self.variant = marker["variant"]
+            self.tokenizer = AutoTokenizer.from_pretrained(merged_model_path)
+            self.model = self._load_merged(merged_model_path, self.variant)
+            source = f"merged checkpoint {merged_model_path} ({self.variant})"
+        else:
+            if merged_model_path:
+                print(f"No merged LoRA checkpoint found at {merged_model_path}, applying the adapter at load time")
+            self.variant = "adapter"
+            self.tokenizer = AutoTokenizer.from_pretrained(base_model_name)
+
+            # Loading the base model
+            self.model = AutoModelForCausalLM.from_pretrained(
+                base_model_name,
+                torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+                device_map="auto"
+            )
+
+            # Loading LoRA weights
+            self.model = PeftModel.from_pretrained(self.model, lora_weights_path)
+            source = f"{base_model_name} with weights from {lora_weights_path}"
+
+        # generate_batch() left-pads with its own tokenizer copy; the shared one stays as loaded
+        self.batch_tokenizer = copy.deepcopy(self.tokenizer)
+        self.batch_tokenizer.padding_side = "left"
+        if self.batch_tokenizer.pad_token is None:
+            self.batch_tokenizer.pad_token = self.batch_tokenizer.eos_token
         
-        # Loading the base model
-        self.model = AutoModelForCausalLM.from_pretrained(
-            base_model_name,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
-            device_map="auto"
-        )
+        # Past key/values of a shared prompt prefix (see set_prompt_prefix)
+        self.prefix_ids = None
+        self.prefix_cache = None
+        self.prefix_stats = {"requests": 0, "prefix_hits": 0, "prefill_tokens": 0, "prefill_tokens_saved": 0}
+        self._prefix_lock = threading.Lock()
         
-        # Loading LoRA weights
-        self.model = PeftModel.from_pretrained(self.model, lora_weights_path)
+        self.load_time = time.perf_counter() - start
+        print(f"LoRA model loaded successfully in {self.load_time:.2f}s: {source}")
+
+    def _load_merged(self, path, variant):
+        # safetensors files are memory-mapped, and low_cpu_mem_usage skips the random
+        # initialization pass, so weights are only paged in as they are materialized
+        if self.device.type == "cuda":
+            if variant == "int8":
+                raise ValueError(f"{path} is an int8 checkpoint for CPU inference; merge a bf16 checkpoint for GPU")
+            return AutoModelForCausalLM.from_pretrained(
+                path, torch_dtype=torch.float16, device_map="auto", low_cpu_mem_usage=True
+            )
+
+        if variant == "int8":
+            return self._load_int8(path)
+
+        model = AutoModelForCausalLM.from_pretrained(path, torch_dtype=torch.bfloat16, low_cpu_mem_usage=True)
+        model.eval()
+        return model
+
+    @staticmethod
+    def _load_int8(path):
+        """
+        Load the quantized weights written by merge_and_save(variant="int8")
+
+        The model skeleton is built on the meta device and its Linear layers are swapped for
+        dynamic int8 Linear modules before the saved tensors are assigned, so no float copy
+        of the Linear weights is ever materialized.
+        """
+        from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+
+        if not os.path.exists(os.path.join(path, INT8_WEIGHTS_FILE)):
+            raise FileNotFoundError(f"{path} has no {INT8_WEIGHTS_FILE}; re-run --merge-lora with --lora-variant int8")
+        with torch.device("meta"):
+            model = AutoModelForCausalLM.from_config(AutoConfig.from_pretrained(path), torch_dtype=torch.float32)
+        for name, module in list(model.named_modules()):
+            if isinstance(module, torch.nn.Linear):
+                parent_name, _, child_name = name.rpartition(".")
+                setattr(model.get_submodule(parent_name), child_name, DynamicQuantizedLinear(
+                    module.in_features, module.out_features, bias_=module.bias is not None, dtype=torch.qint8
+                ))
+
+        saved = torch.load(os.path.join(path, INT8_WEIGHTS_FILE), map_location="cpu", weights_only=True)
+        model.load_state_dict(saved["state_dict"], assign=True)
+        for name, buffer in saved["buffers"].items():
+            module_name, _, buffer_name = name.rpartition(".")
+            model.get_submodule(module_name)._buffers[buffer_name] = buffer
+        if os.path.exists(os.path.join(path, "generation_config.json")):
+            model.generation_config = GenerationConfig.from_pretrained(path)
+        model.eval()
+        return model
+
+    def set_prompt_prefix(self, prefix):
+        """
+        Precompute the past key/values of a prompt prefix shared by many requests
+
+        generate() then only prefills the tokens after the longest token-level match with
+        this prefix. Matching is done on token IDs, so a prefix ending inside a token that
+        merges with the following text still reuses everything up to that token. Reuse only
+        applies to single-prompt calls: generate_batch() with two or more prompts pads them
+        and prefills every prompt in full.
+        """
+        from transformers import DynamicCache
+        
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.device)
+        with torch.no_grad():
+            past_key_values = self.model(input_ids=prefix_ids, use_cache=True).past_key_values
+        if not isinstance(past_key_values, DynamicCache):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        
+        with self._prefix_lock:
+            self.prefix_ids = prefix_ids
+            self.prefix_cache = past_key_values
+        print(f"Cached past key/values for a {prefix_ids.shape[1]}-token prompt prefix")
+    
+    def _prefix_cache_for(self, input_ids, num_beams):
+        """Return (past_key_values, reused_tokens) for input_ids, or (None, 0) if no prefix is shared"""
+        if self.prefix_cache is None:
+            return None, 0
         
-        print(f"LoRA model loaded successfully: {base_model_name} with weights from {lora_weights_path}")
+        # Longest common token prefix; at least one prompt token must still be prefilled
+        limit = min(self.prefix_ids.shape[1], input_ids.shape[1] - 1)
+        mismatches = (self.prefix_ids[0, :limit] != input_ids[0, :limit]).nonzero()
+        reused = int(mismatches[0, 0]) if len(mismatches) else limit
+        if reused <= 0:
+            return None, 0
+        
+        # generate() extends the cache in place, so every request works on its own copy
+        with self._prefix_lock:
+            past_key_values = copy.deepcopy(self.prefix_cache)
+        if reused < self.prefix_ids.shape[1]:
+            past_key_values.crop(reused - self.prefix_ids.shape[1])
+        if num_beams > 1:
+            # Beam search expands the prompt to one row per beam; the cache has to match
+            past_key_values.batch_repeat_interleave(num_beams)
+        return past_key_values, reused
+    
+    def _record_prefill(self, prompt_tokens, reused):
+        # Per-request counts go on the caller's LoRA span; the model is shared between threads
+        active = current_span()
+        if active is not None and active.kind == LORA:
+            active.set(prompt_tokens=prompt_tokens, prefill_tokens_saved=reused)
+        with self._prefix_lock:
+            self.prefix_stats["requests"] += 1
+            self.prefix_stats["prefix_hits"] += int(reused > 0)
+            self.prefix_stats["prefill_tokens"] += prompt_tokens - reused
+            self.prefix_stats["prefill_tokens_saved"] += reused
+        if reused:
+            print(f"Prefix cache: reused {reused} of {prompt_tokens} prompt tokens, prefilled {prompt_tokens - reused}")
     
     def generate(self, prompt, max_new_tokens=100, temperature=0.3):
         """Generating text using the LoRA model"""
         inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        num_beams = 3
+        
+        # Only the part of the prompt after the cached prefix is prefilled
+        past_key_values, reused = self._prefix_cache_for(inputs["input_ids"], num_beams)
+        cache_kwargs = {"past_key_values": past_key_values} if past_key_values is not None else {}
+        self._record_prefill(inputs["input_ids"].shape[1], reused)
         
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
+                **cache_kwargs,
                 max_new_tokens=max_new_tokens,
                 do_sample=True,
                 temperature=temperature,
                 top_p=0.9,
-                num_beams=3,
+                num_beams=num_beams,
                 early_stopping=True
             )
         
@@ -50,4 +257,37 @@ class LoRAModel:
         if prompt in response:
             response = response.replace(prompt, "").strip()
             
-        return response
\ No newline at end of file
+        return response
+    
+    def generate_batch(self, prompts, max_new_tokens=100, temperature=0.3):
+        """
+        Generate text for several prompts in one left-padded batch, returning one response per prompt
+
+        Only a single-prompt batch reuses the cached prompt prefix (see set_prompt_prefix):
+        larger batches trade the saved prefill for one forward pass over all prompts.
+        """
+        if len(prompts) == 1:
+            # A single prompt has no padding, so it can reuse the cached prefix
+            return [self.generate(prompts[0], max_new_tokens=max_new_tokens, temperature=temperature)]
+        
+        # Decoder-only models continue from the last position, so pad on the left
+        inputs = self.batch_tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=True,
+                temperature=temperature,
+                top_p=0.9,
+                num_beams=3,
+                early_stopping=True,
+                pad_token_id=self.batch_tokenizer.pad_token_id
+            )
+        
+        # Every row starts with the (padded) prompt, so the continuation begins at the same offset
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            self.batch_tokenizer.decode(output[prompt_length:], skip_special_tokens=True).strip()
+            for output in outputs
+        ]
@@ -0,0 +1,64 @@
+# models/reranker.py
+import os
+import math
+import threading
+
+from utils.resources import registry
+from utils.tracing import span, RERANKER
+
+CROSS_ENCODER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def logit_to_relevance(logit, scale=1.0):
+    """
+    Map a cross-encoder logit onto the 1-10 relevance scale used by the LLM evaluator
+
+    The sigmoid of the logit (the model's relevance probability) is spread linearly over
+    1-10, so the retain threshold of 6 corresponds to a probability of about 0.56.
+    """
+    probability = 1.0 / (1.0 + math.exp(-logit / scale))
+    return 1.0 + 9.0 * probability
+
+
+class CrossEncoderReranker:
+    """
+    CPU cross-encoder that scores (query, document) pairs in one batched forward pass
+
+    The underlying tokenizer is not safe to share across threads, so scoring is serialized;
+    one batch of five documents takes tens of milliseconds on CPU.
+    """
+
+    def __init__(self, model_name=None, max_length=512, device="cpu", scale=1.0):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name or os.environ.get("CROSS_ENCODER_MODEL", CROSS_ENCODER_MODEL_NAME)
+        self.scale = scale
+        self.model = CrossEncoder(self.model_name, max_length=max_length, device=device)
+        self._lock = threading.Lock()
+
+    def score(self, query, texts):
+        """Relevance scores (1-10) for each text, in order"""
+        if not texts:
+            return []
+        pairs = [(query, text) for text in texts]
+        with span("cross_encoder", RERANKER, model=self.model_name, documents=len(texts)):
+            with self._lock:
+                # activation_fn=Identity returns raw logits whatever the model config says
+                logits = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False,
+                                            activation_fn=_identity(), convert_to_numpy=True)
+        return [logit_to_relevance(float(logit), self.scale) for logit in logits]
+
+
+def _identity():
+    import torch
+    return torch.nn.Identity()
+
+def _build_reranker():
+    return CrossEncoderReranker(scale=float(os.environ.get("CROSS_ENCODER_SCALE", "1.0")))
+
+registry.register("reranker", _build_reranker,
+                  health_check=lambda reranker: reranker.score("health check", ["health check"]))
+
+def get_reranker():
+    """Return the shared cross-encoder reranker, loading it on first use"""
+    return registry.get("reranker")
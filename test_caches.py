@@ -0,0 +1,125 @@
+# test_caches.py
+"""Focused tests for the semantic answer cache and the LLM response cache (run with pytest)"""
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage
+
+import utils.semantic_cache as semantic_cache
+from utils.semantic_cache import SemanticCache
+from utils.llm import LLMResponseCache, invoke_llm, set_llm_factory
+from utils.resources import registry
+
+VECTORS = {
+    "uk climate policy": [1.0, 0.0, 0.0],
+    "uk climate policies": [0.99, 0.14, 0.0],
+    "arctic sea ice": [0.0, 1.0, 0.0],
+    "ocean plastic": [0.0, 0.0, 1.0],
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(semantic_cache, "time", fake)
+    return fake
+
+
+def test_semantic_cache_hits_only_above_threshold(clock):
+    cache = SemanticCache(VECTORS.get, threshold=0.95)
+    cache.store("uk climate policy", "simple_rag", {"answer": "A"})
+
+    result, similarity = cache.lookup("uk climate policies", "simple_rag")
+    assert result == {"answer": "A"} and similarity >= 0.95
+    result, similarity = cache.lookup("arctic sea ice", "simple_rag")
+    assert result is None and similarity < 0.95
+    # Modes are separate partitions
+    assert cache.lookup("uk climate policy", "base_llm")[0] is None
+
+    strict = SemanticCache(VECTORS.get, threshold=0.999)
+    strict.store("uk climate policy", "simple_rag", {"answer": "A"})
+    assert strict.lookup("uk climate policies", "simple_rag")[0] is None
+
+
+def test_semantic_cache_entries_expire_after_ttl(clock):
+    cache = SemanticCache(VECTORS.get, ttl=60)
+    cache.store("uk climate policy", "simple_rag", {"answer": "A"})
+    clock.now += 59
+    assert cache.lookup("uk climate policy", "simple_rag")[0] == {"answer": "A"}
+    clock.now += 2
+    assert cache.lookup("uk climate policy", "simple_rag")[0] is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_semantic_cache_evicts_least_recently_used(clock):
+    cache = SemanticCache(VECTORS.get, max_entries=2)
+    cache.store("uk climate policy", "simple_rag", "policy")
+    cache.store("arctic sea ice", "simple_rag", "ice")
+    # A hit makes the first entry the most recently used, so the second is evicted
+    assert cache.lookup("uk climate policy", "simple_rag")[0] == "policy"
+    cache.store("ocean plastic", "simple_rag", "plastic")
+
+    assert cache.lookup("arctic sea ice", "simple_rag")[0] is None
+    assert cache.lookup("uk climate policy", "simple_rag")[0] == "policy"
+    assert cache.lookup("ocean plastic", "simple_rag")[0] == "plastic"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_llm_cache_key_covers_model_temperature_and_prompt():
+    key = LLMResponseCache.make_key("gpt-3.5-turbo", 0, "prompt")
+    assert key == LLMResponseCache.make_key("gpt-3.5-turbo", 0.0, "prompt")
+    assert key != LLMResponseCache.make_key("gpt-4o", 0, "prompt")
+    assert key != LLMResponseCache.make_key("gpt-3.5-turbo", 0.7, "prompt")
+    assert key != LLMResponseCache.make_key("gpt-3.5-turbo", 0, "prompt ")
+
+
+class CountingChatModel:
+    calls = 0
+
+    def __init__(self, model, temperature):
+        self.temperature = temperature
+
+    def invoke(self, prompt):
+        CountingChatModel.calls += 1
+        return AIMessage(content=f"answer {CountingChatModel.calls}",
+                         usage_metadata={"input_tokens": 3, "output_tokens": 2, "total_tokens": 5})
+
+
+@pytest.fixture
+def llm_cache(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "true")
+    monkeypatch.delenv("LLM_CACHE_SAMPLING", raising=False)
+    cache = LLMResponseCache()
+    registry.override("llm_cache", cache)
+    CountingChatModel.calls = 0
+    set_llm_factory(CountingChatModel)
+    yield cache
+    set_llm_factory(None)
+
+
+def test_llm_cache_serves_repeated_deterministic_calls(llm_cache):
+    first = invoke_llm("What is COP26?", temperature=0)
+    assert invoke_llm("What is COP26?", temperature=0) == first
+    assert CountingChatModel.calls == 1
+    assert llm_cache.stats()["memory_hits"] == 1 and llm_cache.stats()["tokens_saved"] == 5
+
+
+def test_llm_cache_bypasses_sampling_temperatures(llm_cache, monkeypatch):
+    first = invoke_llm("Write a headline", temperature=0.7)
+    second = invoke_llm("Write a headline", temperature=0.7)
+    assert first != second and CountingChatModel.calls == 2
+    assert llm_cache.stats()["bypassed"] == 2
+
+    # Explicit opt-in caches sampled responses too
+    monkeypatch.setenv("LLM_CACHE_SAMPLING", "true")
+    cached = invoke_llm("Write a headline", temperature=0.7)
+    assert invoke_llm("Write a headline", temperature=0.7) == cached
+    assert CountingChatModel.calls == 3
+    assert invoke_llm("Write a headline", temperature=0.7, cache=False) != cached
@@ -0,0 +1,85 @@
+# test_resume.py
+"""Focused tests for resuming evaluation runs and incremental ingestion (run with pytest)"""
+import json
+import numpy as np
+
+import evaluation.runner as runner
+import utils.ingest as ingest
+from evaluation.runner import EvaluationRunner, load_results
+
+
+def _fake_system(calls):
+    def system_runner(system):
+        def run(question):
+            calls.append((system, question))
+            if question == "fails":
+                raise RuntimeError("offline")
+            return {"answer": f"{system}: {question}", "intermediate_steps": [],
+                    "trace": {"spans": [], "summary": {}}}
+        return run
+    return system_runner
+
+
+def test_evaluation_runner_resume_skips_finished_pairs(tmp_path, monkeypatch):
+    output_file = str(tmp_path / "results.jsonl")
+    calls = []
+    monkeypatch.setattr(runner, "system_runner", _fake_system(calls))
+
+    EvaluationRunner(["q1", "fails"], systems=["base_llm"], output_file=output_file).run()
+    assert sorted(calls) == [("base_llm", "fails"), ("base_llm", "q1")]
+
+    # A crash mid-write leaves a truncated line that is dropped on resume
+    with open(output_file, "a", encoding="utf-8") as f:
+        f.write('{"system": "base_llm", "question": "q2"')
+    calls.clear()
+    records = EvaluationRunner(["q1", "q2", "fails"], systems=["base_llm", "simple_rag"], output_file=output_file).run()
+
+    # Finished pairs are skipped, failed ones are retried
+    assert ("base_llm", "q1") not in calls
+    assert ("base_llm", "fails") in calls and ("base_llm", "q2") in calls
+    assert len(calls) == 5
+    assert set(records) == {(system, q) for system in ("base_llm", "simple_rag") for q in ("q1", "q2", "fails")}
+    assert load_results(output_file)[("base_llm", "q1")]["answer"] == "base_llm: q1"
+
+
+class FakeEmbedder:
+    texts = []
+
+    def submit(self, texts):
+        FakeEmbedder.texts.extend(texts)
+        return ingest._Done(np.ones((len(texts), 4), dtype=np.float32))
+
+    def close(self):
+        pass
+
+
+def _write_articles(path, articles):
+    with open(path, "w", encoding="utf-8") as f:
+        for article in articles:
+            f.write(json.dumps(article) + "\n")
+
+
+def test_ingest_skips_unchanged_articles(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "_InProcessEmbedder", FakeEmbedder)
+    source, manifest = str(tmp_path / "articles.jsonl"), str(tmp_path / "manifest.json")
+    index_path = str(tmp_path / "index")
+    articles = [{"id": "a", "Cleaned Text": "Coral reefs are bleaching."},
+                {"id": "b", "Cleaned Text": "Glaciers are retreating."}]
+    _write_articles(source, articles)
+    FakeEmbedder.texts = []
+    stats = ingest.ingest(source, ingest.LocalIndexSink(index_path), manifest)
+    assert stats["new"] == 2 and len(FakeEmbedder.texts) == 2
+
+    # Same content: nothing is embedded again
+    FakeEmbedder.texts = []
+    stats = ingest.ingest(source, ingest.LocalIndexSink(index_path), manifest)
+    assert stats["unchanged"] == 2 and stats["chunks"] == 0 and FakeEmbedder.texts == []
+
+    # Only the modified and the new article are re-embedded
+    articles[1]["Cleaned Text"] = "Glaciers are retreating faster."
+    articles.append({"id": "c", "Cleaned Text": "Penguin colonies are shrinking."})
+    _write_articles(source, articles)
+    stats = ingest.ingest(source, ingest.LocalIndexSink(index_path), manifest)
+    assert (stats["unchanged"], stats["modified"], stats["new"]) == (1, 1, 1)
+    assert FakeEmbedder.texts == ["Glaciers are retreating faster.", "Penguin colonies are shrinking."]
+    assert ingest.load_manifest(manifest)["b"]["hash"] == ingest.content_hash(articles[1])
@@ -0,0 +1,115 @@
+# test_retrieval.py
+"""Focused tests for the local and BM25 indexes, rank fusion, dedup and context packing (run with pytest)"""
+import numpy as np
+
+from utils.local_index import LocalVectorIndex
+from utils.sparse_index import SparseIndex, reciprocal_rank_fusion
+from utils.dedup import collapse_near_duplicates
+from utils.context_packer import TokenCounter, pack_context, MIN_SOURCE_TOKENS
+from utils.state import DocRecord
+
+
+def _random_vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def test_local_index_upsert_replaces_and_deletes(tmp_path):
+    vectors = _random_vectors(3, dim=4)
+    index = LocalVectorIndex.build(str(tmp_path), ["a", "b", "c"], vectors,
+                                   [{"text": "a"}, {"text": "b"}, {"text": "c"}])
+    index = index.upsert(["b", "d"], [vectors[0], vectors[2]], [{"text": "b2"}, {"text": "d"}], delete_ids=["c"])
+
+    assert index.ids == ["a", "b", "d"]
+    assert index.payload(index.row_of("b")) == {"text": "b2"}
+    assert index.row_of("c") is None
+    # "b" now holds the vector of "a", so both are exact matches for it
+    assert {row for row, _ in index.search(vectors[0], k=2)} == {index.row_of("a"), index.row_of("b")}
+    assert LocalVectorIndex(str(tmp_path)).ids == ["a", "b", "d"]
+
+
+def test_ivf_int8_search_recall(tmp_path):
+    vectors = _random_vectors(2000)
+    ids = [str(i) for i in range(len(vectors))]
+    payloads = [{} for _ in ids]
+    exact = LocalVectorIndex.build(str(tmp_path / "exact"), ids, vectors, payloads)
+    ivf = LocalVectorIndex.build(str(tmp_path / "ivf"), ids, vectors, payloads, ivf_lists=16)
+    assert ivf.centroids is not None
+
+    queries = _random_vectors(50, seed=1)
+    found = total = 0
+    for query in queries:
+        expected = {row for row, _ in exact.search(query, k=10)}
+        found += len(expected & {row for row, _ in ivf.search(query, k=10)})
+        total += len(expected)
+    assert found / total >= 0.8
+
+
+def test_bm25_scores_term_matches_and_document_length(tmp_path):
+    texts = [
+        "Flooding hit the coast after the storm.",
+        "The storm brought wind and rain to the region.",
+        "Flooding, flooding everywhere: the river flooding spread across farmland, towns and roads for days on end.",
+        "Solar energy investment grew in the region.",
+    ]
+    index = SparseIndex.build(str(tmp_path), ["0", "1", "2", "3"], texts, [{} for _ in texts])
+
+    results = index.search("storm flooding", k=4)
+    rows = [row for row, _ in results]
+    assert set(rows) == {0, 1, 2}   # Documents without a query term are not returned
+    assert rows[0] == 0             # Matches both terms
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    # Same term frequency: the shorter document scores higher
+    assert [row for row, _ in index.search("storm")] == [0, 1]
+    assert index.search("photosynthesis") == []
+
+
+def test_reciprocal_rank_fusion_order():
+    dense = ["a", "b", "c"]
+    sparse = ["c", "a", "d"]
+    # a: 1/61 + 1/62, c: 1/63 + 1/61, b: 1/62, d: 1/63
+    assert reciprocal_rank_fusion([dense, sparse]) == ["a", "c", "b", "d"]
+    # Equal fused scores keep the order of first appearance
+    assert reciprocal_rank_fusion([["x", "y"], ["y", "x"]]) == ["x", "y"]
+
+
+def test_collapse_near_duplicates_keeps_best_ranked_copy():
+    vectors = np.array([[1.0, 0.0], [0.999, 0.04], [0.0, 1.0], [0.7, 0.7]], dtype=np.float32)
+    kept, dropped = collapse_near_duplicates(["a", "a'", "b", "c"], k=3, vectors=vectors)
+    assert kept == [0, 2, 3] and dropped == 1
+
+    story = "The government announced a new plan to cut emissions from coal power stations by half before 2030."
+    texts = [story, story + " Reuters", "Wildfires spread across Canada as temperatures reached record highs."]
+    kept, dropped = collapse_near_duplicates(texts, k=3)
+    assert kept == [0, 2] and dropped == 1
+
+
+class CharCounter(TokenCounter):
+    """Four characters per token, without loading tiktoken"""
+
+    def __init__(self):
+        self.model = "test"
+        self.encoding = None
+
+
+def _record(doc_id, text, relevance):
+    record = DocRecord(doc_id, text, {})
+    record.relevance_score = relevance
+    return record
+
+
+def test_pack_context_respects_token_budget():
+    counter = CharCounter()
+    sentence = "Coastal flooding is rising with sea levels. "
+    records = [_record("a", sentence * 20, 5), _record("b", sentence * 20, 9), _record("c", "Short note.", 1)]
+    budget = 200
+
+    content, stats = pack_context("coastal flooding", records, budget, counter)
+    assert counter.count(content) <= budget
+    assert stats["tokens_packed"] <= budget
+    # Emitted in relevance order, numbered by position
+    assert content.index("Source 2:") < content.index("Source 1:")
+
+    # Too little budget left for source 1; the short source 3 still fits whole
+    content, stats = pack_context("coastal flooding", records, MIN_SOURCE_TOKENS + 10, counter)
+    assert stats["dropped_sources"] == [1]
+    assert "Source 3:\nShort note." in content
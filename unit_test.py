@@ -1,7 +1,7 @@
 # unit_test.py
 import os
 from dotenv import load_dotenv
-from utils.state import initialize_state
+from utils.state import initialize_state, apply_update
 from graph import build_rag_graph
 from models.lora_model import LoRAModel
 from utils.retriever import get_retriever
@@ -51,7 +51,7 @@ def run_unit_test():
     print("\n3. Testing Query Analyzer Agent...")
     try:
         state = initialize_state(test_query)
-        updated_state = query_analyzer(state)
+        updated_state = query_analyzer(state)  # Agents return partial state updates
         print(f"Original query: {state['query']}")
         print(f"Analyzed query: {updated_state['analyzed_query']}")
         print("✅ Query analyzer agent test passed")
@@ -65,27 +65,27 @@ def run_unit_test():
         
         # 运行查询分析代理
         print("Running query analyzer...")
-        state = query_analyzer(state)
+        state = apply_update(state, query_analyzer(state))
         
         # 运行检索代理
         print("Running retriever agent...")
-        state = retriever_agent(state)
-        print(f"Retrieved {len(state['retrieved_docs'])} documents")
+        state = apply_update(state, retriever_agent(state))
+        print(f"Retrieved {len(state['retrieved_ids'])} documents")
         
         # 运行文档清洗代理
         print("Running document cleaner...")
-        state = document_cleaner(state)
-        print(f"Cleaned {len(state['cleaned_docs'])} documents")
+        state = apply_update(state, document_cleaner(state))
+        print(f"Cleaned {len(state['cleaned_ids'])} documents")
         
         # 运行相关性评估代理
         print("Running relevance evaluator...")
-        state = relevance_evaluator(state)
-        print(f"Selected {len(state['relevant_docs'])} relevant documents")
+        state = apply_update(state, relevance_evaluator(state))
+        print(f"Selected {len(state['relevant_ids'])} relevant documents")
         print(f"Confidence score: {state['confidence_score']}")
         
         # 运行答案生成代理
         print("Running answer generator...")
-        state = answer_generator(state)
+        state = apply_update(state, answer_generator(state))
         print(f"Generated answer: {state['answer'][:200]}...")
         
         print("✅ Agent pipeline test passed")
@@ -1,3 +1,26 @@
-from .state import AgentState, initialize_state
-from .retriever import get_retriever
-from .decision_functions import should_clean_docs, assess_confidence
\ No newline at end of file
+import importlib
+
+# Exports are resolved on first access, so importing one light submodule (e.g. utils.startup)
+# does not pull in LangChain, Pinecone and the embedding stack
+_EXPORTS = {
+    "AgentState": ".state",
+    "initialize_state": ".state",
+    "PipelineConfig": ".config",
+    "ResourceRegistry": ".resources",
+    "registry": ".resources",
+    "get_retriever": ".retriever",
+    "get_embeddings": ".retriever",
+    "get_vectorstore": ".retriever",
+    "warm_up_retriever": ".retriever",
+    "reload_retriever": ".retriever",
+    "should_clean_docs": ".decision_functions",
+    "assess_confidence": ".decision_functions",
+    "should_retrieve_again": ".decision_functions",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,46 @@
+# utils/config.py
+import os
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class PipelineConfig:
+    """Settings that change the shape or behaviour of the agent graph; hashable so it can key caches"""
+    use_lora: bool = True             # Use the LoRA model in the query analyzer
+    max_reformulations: int = 2       # Reformulation attempts before answering anyway
+    query_variants: int = 1           # Queries searched concurrently in one round, analyzed query included (1 = off, >1 replaces reformulation)
+    hybrid_retrieval: bool = False    # Fuse BM25 keyword matches with the dense results (reciprocal rank fusion)
+    dedup_overfetch: int = 3          # Candidates fetched per returned document before collapsing near-duplicates (1 = off)
+    dedup_threshold: float = 0.95     # Cosine similarity at which two retrieved documents count as copies
+    cleaning_threshold: int = 10000   # Total characters above which retrieved documents are cleaned
+    cleaning_mode: str = "llm"        # Cleaning: "llm" (one call per document) or "extractive" (local sentence selection)
+    cleaning_budget: int = 1500       # Characters kept per document by extractive cleaning
+    cleaning_llm_pass: bool = False   # After extraction, LLM-clean documents that are still over budget
+    recursion_limit: int = 20         # LangGraph recursion limit per run
+    context_token_budget: int = 3000  # Prompt tokens for the answer's sources (0 = include every document in full)
+    relevance_mode: str = "llm"       # Relevance scoring: "llm" (one JSON-scoring prompt) or "cross_encoder" (local model)
+    relevance_llm_fallback: bool = False  # Score with the LLM when the cross-encoder fails
+    similarity_fast_path: bool = False    # Decide relevance from vector similarities when they are clearly high or low
+
+    @classmethod
+    def from_env(cls, **overrides):
+        """Build a config from environment variables (DISABLE_LORA, RELEVANCE_MODE, ..., SIMILARITY_FAST_PATH), with explicit overrides"""
+        values = {
+            "use_lora": os.environ.get("DISABLE_LORA") != "true",
+            "relevance_mode": os.environ.get("RELEVANCE_MODE", "llm").lower(),
+            "relevance_llm_fallback": os.environ.get("RELEVANCE_LLM_FALLBACK") == "true",
+            "query_variants": int(os.environ.get("QUERY_VARIANTS", "1")),
+            "hybrid_retrieval": os.environ.get("HYBRID_RETRIEVAL") == "true",
+            "dedup_overfetch": int(os.environ.get("DEDUP_OVERFETCH", "3")),
+            "dedup_threshold": float(os.environ.get("DEDUP_THRESHOLD", "0.95")),
+            "similarity_fast_path": os.environ.get("SIMILARITY_FAST_PATH") == "true",
+            "cleaning_mode": os.environ.get("CLEANING_MODE", "llm").lower(),
+            "cleaning_budget": int(os.environ.get("CLEANING_BUDGET", "1500")),
+            "cleaning_llm_pass": os.environ.get("CLEANING_LLM_PASS") == "true",
+            "context_token_budget": int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000")),
+        }
+        values.update(overrides)
+        return cls(**values)
+
+    @property
+    def mode_name(self):
+        return "advanced_rag_finetuned" if self.use_lora else "advanced_rag_base"
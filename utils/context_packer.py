@@ -0,0 +1,142 @@
+# utils/context_packer.py
+import math
+import threading
+
+from utils.text import split_sentences, words
+
+# Sources that would get fewer tokens than this are dropped rather than cut to a stub
+MIN_SOURCE_TOKENS = 40
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in the answer model's tokens
+
+    Uses tiktoken's encoding for `model`. If the encoding cannot be loaded (tiktoken is
+    missing, or its BPE file cannot be downloaded offline) it falls back to an estimate of
+    four characters per token, which is close for English text.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        try:
+            import tiktoken
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception as e:
+            print(f"tiktoken encoding for {model} unavailable, estimating tokens from characters: {e}")
+            self.encoding = None
+
+    def count(self, text):
+        if self.encoding is None:
+            return math.ceil(len(text) / 4)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        if self.encoding is None:
+            return text[:max_tokens * 4]
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+def get_token_counter(model):
+    """Shared TokenCounter per model (loading an encoding takes a moment)"""
+    counter = _counters.get(model)
+    if counter is None:
+        with _counters_lock:
+            counter = _counters.setdefault(model, TokenCounter(model))
+    return counter
+
+
+def _source_priority(indexed_record):
+    # Highest relevance score first, then highest similarity, then retrieval order
+    index, record = indexed_record
+    relevance = record.relevance_score if record.relevance_score is not None else -1
+    similarity = record.similarity if record.similarity is not None else -1
+    return (-relevance, -similarity, index)
+
+def trim_to_tokens(text, query_terms, max_tokens, counter):
+    """
+    Keep the sentences of `text` that share most words with the query, within `max_tokens`
+
+    Kept sentences stay in their original order. A single sentence longer than the budget
+    is cut at the token limit.
+    """
+    if counter.count(text) <= max_tokens:
+        return text
+    sentences = split_sentences(text)
+    scored = []
+    for i, sentence in enumerate(sentences):
+        sentence_words = words(sentence)
+        overlap = sum(1 for word in sentence_words if word in query_terms)
+        # Length-normalized so long sentences do not win on size alone
+        scored.append((overlap / math.sqrt(len(sentence_words) or 1), -i))
+
+    chosen, used = [], 0
+    for _, negative_index in sorted(scored, reverse=True):
+        i = -negative_index
+        tokens = counter.count(sentences[i]) + 1
+        if used + tokens > max_tokens:
+            continue
+        chosen.append(i)
+        used += tokens
+    if not chosen:
+        return counter.truncate(text, max_tokens)
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+def pack_context(query, records, token_budget, counter):
+    """
+    Fit the documents into `token_budget` tokens as "Source N:" blocks
+
+    Sources are numbered by their position in `records`, and the numbers stay the same
+    whatever is trimmed or dropped. The budget is handed out in relevance order: each source
+    gets an equal share of what is left, and budget still unused at the end goes back to
+    trimmed sources. Sources over their allowance are trimmed to their highest-value
+    sentences; sources that would get fewer than MIN_SOURCE_TOKENS tokens are dropped and
+    listed by number in stats["dropped_sources"]. The packed sources are emitted in relevance
+    order, so a model that truncates the prompt loses the least relevant ones first.
+
+    Returns (docs_content, stats).
+    """
+    query_terms = set(words(query))
+    headers = {i: f"Source {i + 1}:\n" for i in range(len(records))}
+    original_tokens = {i: counter.count(record.content) for i, record in enumerate(records)}
+
+    packed, remaining = {}, token_budget
+    ordered = sorted(enumerate(records), key=_source_priority)
+    for position, (i, record) in enumerate(ordered):
+        # Split what is left over the remaining sources, but never so thin that all of them get dropped
+        slots = max(1, min(len(ordered) - position, remaining // (2 * MIN_SOURCE_TOKENS)))
+        share = remaining // slots
+        allowance = share - counter.count(headers[i])
+        if allowance < min(MIN_SOURCE_TOKENS, original_tokens[i]):
+            continue
+        text = trim_to_tokens(record.content, query_terms, allowance, counter)
+        packed[i] = text
+        remaining -= counter.count(headers[i]) + counter.count(text)
+
+    # Budget left over (sources shorter than their share) goes back to trimmed sources, most relevant first
+    for i, record in ordered:
+        if remaining <= 0:
+            break
+        if i in packed and packed[i] != record.content:
+            used = counter.count(packed[i])
+            packed[i] = trim_to_tokens(record.content, query_terms, used + remaining, counter)
+            remaining -= counter.count(packed[i]) - used
+
+    blocks = [headers[i] + packed[i] for i, _ in ordered if i in packed]
+    packed_tokens = sum(counter.count(packed[i]) for i in packed)
+    total_tokens = sum(original_tokens.values())
+    stats = {
+        "budget": token_budget,
+        "sources": len(records),
+        "sources_packed": len(packed),
+        "sources_trimmed": sum(1 for i in packed if packed[i] != records[i].content),
+        "sources_dropped": len(records) - len(packed),
+        "dropped_sources": [i + 1 for i, _ in ordered if i not in packed],
+        "tokens_total": total_tokens,
+        "tokens_packed": packed_tokens,
+        "tokens_dropped": total_tokens - packed_tokens,
+    }
+    return "\n\n".join(blocks), stats
@@ -1,19 +1,34 @@
 # utils/decision_functions.py
 from utils.state import AgentState
+from utils.config import PipelineConfig
+from utils.sparse_index import hybrid_stats
 
-def should_clean_docs(state: AgentState) -> str:
+def should_clean_docs(state: AgentState, pipeline_config: PipelineConfig = None) -> str:
     """Decide whether document cleaning is necessary"""
-    if state["retrieved_docs"] and len(state["retrieved_docs"]) > 0:
-        total_length = sum(len(doc.page_content) for doc in state["retrieved_docs"])
-        if total_length > 10000:  # Assume cleaning is needed if the total length exceeds 10,000 characters
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    if state["retrieved_ids"] and len(state["retrieved_ids"]) > 0:
+        total_length = sum(len(record.text) for record in state["doc_store"].records_for(state["retrieved_ids"]))
+        if total_length > pipeline_config.cleaning_threshold:  # Assume cleaning is needed if the total length exceeds the threshold
             return "clean"
         else:
             return "skip_cleaning"
     else:
         return "skip_cleaning"
 
-def assess_confidence(state: AgentState) -> str:
+def _record_hybrid_outcome(state, confidence_score):
+    """Count first-round answers that relied on a document only keyword search found"""
+    relevant = state["doc_store"].records_for(state.get("relevant_ids"))
+    retrieved = state["doc_store"].records_for(state.get("retrieved_ids"))
+    if not any(record.retrieved_by for record in retrieved):
+        return   # Not a hybrid retrieval
+    hybrid_stats.record("first_round_evaluations")
+    if confidence_score >= 5 and any(record.retrieved_by == ("sparse",) for record in relevant):
+        print("Keyword-only match judged relevant, no reformulation needed")
+        hybrid_stats.record("reformulations_prevented")
+
+def assess_confidence(state: AgentState, pipeline_config: PipelineConfig = None) -> str:
     """Decide whether additional processing is needed based on confidence score and reformulation attempts"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
     confidence_score = state.get("confidence_score", 0)  # Add default values using get
     reformulation_count = state.get("reformulation_count", 0)
     
@@ -23,16 +38,29 @@ def assess_confidence(state: AgentState) -> str:
     if confidence_score is None:
         confidence_score = 0
     
+    if reformulation_count == 0:
+        _record_hybrid_outcome(state, confidence_score)
+    
     # More explicit conditional judgments
     if confidence_score >= 5:
         print("Decision: Generate answer - confidence is sufficient")
         return "generate_answer"
-    elif reformulation_count >= 2:
+    elif reformulation_count >= pipeline_config.max_reformulations:
         print("Decision: Generate answer - reformulation limit reached")
         return "generate_answer"
-    elif reformulation_count > 0 and (not state.get("relevant_docs") or len(state.get("relevant_docs", [])) == 0):
+    elif pipeline_config.query_variants > 1:
+        print("Decision: Generate answer - multi-query retrieval already searched the query variants")
+        return "generate_answer"
+    elif reformulation_count > 0 and not state.get("relevant_ids"):
         print("Decision: Generate answer - no relevant docs after reformulation")
         return "generate_answer"
     else:
         print("Decision: Reformulate query - confidence too low and reformulation attempts available")
-        return "try_reformulate"
\ No newline at end of file
+        return "try_reformulate"
+
+def should_retrieve_again(state: AgentState, pipeline_config: PipelineConfig = None) -> str:
+    """Decide whether a reformulated query should be retrieved or the reformulation limit has been reached"""
+    pipeline_config = pipeline_config or PipelineConfig.from_env()
+    if state.get("reformulation_count", 0) >= pipeline_config.max_reformulations:
+        return "skip_retrieval"
+    return "do_retrieval"
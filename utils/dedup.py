@@ -0,0 +1,64 @@
+# utils/dedup.py
+import zlib
+import numpy as np
+
+from utils.text import words
+
+# Estimated Jaccard similarity of word shingles above which two texts count as copies
+JACCARD_THRESHOLD = 0.7
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+_rng = np.random.default_rng(0)
+_PERM_A = _rng.integers(1, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash_signature(text):
+    """MinHash signature over word shingles; fixed seeds, so signatures are comparable across processes"""
+    tokens = words(text)
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))}
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+    # a < 2^31 and hashes < 2^32, so a * hash fits in 64 bits
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+def _cosine_matrix(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized = vectors / np.maximum(norms, 1e-12)
+    return normalized @ normalized.T
+
+def _minhash_matrix(texts):
+    signatures = np.stack([minhash_signature(text) for text in texts])
+    # Share of equal signature slots estimates the Jaccard similarity of every pair
+    return (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+
+def collapse_near_duplicates(texts, k, vectors=None, cosine_threshold=0.95, jaccard_threshold=JACCARD_THRESHOLD):
+    """
+    Pick up to k mutually distinct candidates, best-ranked first
+
+    `texts` (and `vectors`, if given) are in ranking order. With vectors, two candidates are
+    near-duplicates when their cosine similarity is at least `cosine_threshold`; for stores
+    that return no vectors, MinHash signatures of word shingles are compared against
+    `jaccard_threshold` instead. All pairwise similarities are computed in one matrix.
+
+    Returns (kept indices in ranking order, number of duplicates skipped).
+    """
+    if not texts:
+        return [], 0
+    if vectors is not None:
+        similarity, threshold = _cosine_matrix(vectors), cosine_threshold
+    else:
+        similarity, threshold = _minhash_matrix(texts), jaccard_threshold
+
+    kept, dropped = [], 0
+    for i in range(len(texts)):
+        if len(kept) == k:
+            break
+        if kept and similarity[i, kept].max() >= threshold:
+            dropped += 1
+            continue
+        kept.append(i)
+    return kept, dropped
@@ -0,0 +1,92 @@
+# utils/document_memo.py
+import os
+import threading
+from collections import OrderedDict
+
+from utils.resources import registry
+from utils.tracing import metrics
+
+# Kinds of per-document work the memo holds
+CLEANED, RELEVANCE = "cleaned", "relevance"
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query, without trailing punctuation"""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def cleaning_settings(pipeline_config):
+    """Settings a cleaned text depends on besides the document and the query"""
+    if pipeline_config.cleaning_mode == "extractive":
+        return ("extractive", pipeline_config.cleaning_budget, pipeline_config.cleaning_llm_pass)
+    return ("llm",)
+
+def relevance_settings(pipeline_config):
+    """Settings a relevance score depends on: the scorer and the text it saw"""
+    return (pipeline_config.relevance_mode,) + cleaning_settings(pipeline_config)
+
+
+class DocumentMemo:
+    """
+    Process-wide LRU of cleaned texts and relevance scores
+
+    Entries are keyed by (kind, document ID, normalized query, settings), where the settings
+    are whatever else the result depends on (cleaning mode and budget, relevance mode), so a
+    document retrieved again for the same question is not cleaned or scored twice. Within a
+    request the DocRecords already carry this across reformulation rounds; this tier extends
+    it across requests.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counts = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, doc_id, query, settings):
+        return (kind, doc_id, normalize_query(query), settings)
+
+    def get(self, kind, doc_id, query, settings):
+        """Return the memoized value or None"""
+        key = self.make_key(kind, doc_id, query, settings)
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.counts["misses"] += 1
+            else:
+                self.entries.move_to_end(key)
+                self.counts["hits"] += 1
+        metrics.increment("document_memo_total", kind=kind, result="miss" if value is None else "hit")
+        return value
+
+    def put(self, kind, doc_id, query, settings, value):
+        key = self.make_key(kind, doc_id, query, settings)
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.counts["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return {
+                **self.counts,
+                "hit_rate": self.counts["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+
+def _build_document_memo():
+    return DocumentMemo(max_entries=int(os.environ.get("DOCUMENT_MEMO_SIZE", "4096")))
+
+registry.register("document_memo", _build_document_memo)
+
+def get_document_memo():
+    """Return the shared memo, or None unless DOCUMENT_MEMO=true"""
+    if os.environ.get("DOCUMENT_MEMO", "false").lower() != "true":
+        return None
+    return registry.get("document_memo")
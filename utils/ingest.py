@@ -0,0 +1,362 @@
+# utils/ingest.py
+import os
+import csv
+import sys
+import json
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from utils.text import split_sentences
+from utils.retriever import EMBEDDING_MODEL_NAME, TEXT_KEY
+
+# all-MiniLM-L6-v2 reads at most 256 word pieces, roughly 1000 characters of English
+CHUNK_CHARS = 1000
+MANIFEST_FILE = "ingest_manifest.json"
+PINECONE_UPSERT_BATCH = 100
+# Pinecone rejects vectors whose metadata exceeds 40 KB; leave headroom for the chunk fields
+MAX_METADATA_BYTES = 36 * 1024
+METADATA_VALUE_CHARS = 2000
+# Written batches between checkpoints when each one rewrites a whole index (local or sparse)
+REWRITE_CHECKPOINT_BATCHES = 20
+
+
+def read_articles(path, text_field=TEXT_KEY):
+    """Stream article dicts from a CSV file (with a header row) or a JSONL file, skipping rows without text"""
+    if path.lower().endswith(".csv"):
+        # News articles can exceed the csv module's default 128 KB field limit
+        csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                if (row.get(text_field) or "").strip():
+                    yield row
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if str(row.get(text_field) or "").strip():
+                    yield row
+
+
+def content_hash(article):
+    """Hash of an article's fields, text included; changes whenever the article is modified"""
+    payload = json.dumps(article, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def chunk_text(text, max_chars=CHUNK_CHARS):
+    """
+    Split text into chunks of whole sentences of at most `max_chars` characters
+
+    Consecutive chunks share one sentence so facts spanning a boundary stay retrievable.
+    A sentence longer than `max_chars` becomes a chunk of its own.
+    """
+    sentences = split_sentences(text)
+    if len(text) <= max_chars or len(sentences) <= 1:
+        return [text.strip()]
+    chunks, current = [], []
+    for sentence in sentences:
+        if current and len(" ".join(current + [sentence])) > max_chars:
+            chunks.append(" ".join(current))
+            # Carry the last sentence over unless it alone fills most of a chunk
+            current = current[-1:] if len(current[-1]) < max_chars // 2 else []
+        current.append(sentence)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def _metadata_value(value):
+    # Pinecone metadata holds strings, numbers, booleans and lists of strings
+    if isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return [item[:METADATA_VALUE_CHARS] for item in value]
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return value[:METADATA_VALUE_CHARS]
+
+
+def _metadata_size(metadata):
+    return len(json.dumps(metadata, ensure_ascii=False).encode("utf-8"))
+
+
+def _article_metadata(article, text_field, fields=None):
+    """
+    Metadata copied from an article to each of its chunks
+
+    Only `fields` are kept when given, otherwise every non-text field. Long values are
+    truncated to METADATA_VALUE_CHARS, and the largest fields are dropped while the
+    result exceeds MAX_METADATA_BYTES.
+    """
+    metadata = {key: _metadata_value(value) for key, value in article.items()
+                if key != text_field and (fields is None or key in fields) and value is not None and value != ""}
+    while metadata and _metadata_size(metadata) > MAX_METADATA_BYTES:
+        largest = max(metadata, key=lambda key: _metadata_size({key: metadata[key]}))
+        del metadata[largest]
+    return metadata
+
+
+def _chunk_records(article_id, article, text_field, chunk_chars, metadata_fields=None):
+    """(ids, texts, payloads) of an article's chunks; payloads carry the text under TEXT_KEY like the existing index"""
+    metadata = _article_metadata(article, text_field, metadata_fields)
+    chunks = chunk_text(str(article[text_field]), chunk_chars)
+    ids = [f"{article_id}#{i}" for i in range(len(chunks))]
+    payloads = [{**metadata, "article_id": article_id, "chunk": i, TEXT_KEY: chunk} for i, chunk in enumerate(chunks)]
+    return ids, chunks, payloads
+
+
+# Model loaded once per embedding worker process
+_worker_model = None
+
+def _init_worker(model_name, threads):
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    # Workers split the cores between them instead of each starting one thread per core
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+def _embed_batch(texts):
+    return _worker_model.encode(texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+
+class _InProcessEmbedder:
+    """Embeds batches with the shared embedding model; for single-worker runs"""
+
+    def __init__(self):
+        from utils.retriever import get_embeddings
+        self.embeddings = get_embeddings()
+
+    def submit(self, texts):
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return _Done(vectors)
+
+    def close(self):
+        pass
+
+
+class _Done:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _PoolEmbedder:
+    """Embeds batches across a pool of processes, each with its own copy of the model"""
+
+    def __init__(self, workers, model_name):
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        # spawn: forking a process that has loaded torch can deadlock
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(model_name, threads))
+
+    def submit(self, texts):
+        return self.executor.submit(_embed_batch, texts)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class PineconeSink:
+    """Upserts chunks into a Pinecone index in requests of PINECONE_UPSERT_BATCH vectors"""
+
+    checkpoint_batches = 1   # Each write is stored when it returns, so every batch can be checkpointed
+
+    def __init__(self, index):
+        self.index = index
+
+    def write(self, ids, vectors, payloads):
+        for start in range(0, len(ids), PINECONE_UPSERT_BATCH):
+            self.index.upsert(vectors=[
+                {"id": doc_id, "values": vector.tolist(), "metadata": payload}
+                for doc_id, vector, payload in zip(ids[start:start + PINECONE_UPSERT_BATCH],
+                                                   vectors[start:start + PINECONE_UPSERT_BATCH],
+                                                   payloads[start:start + PINECONE_UPSERT_BATCH])
+            ])
+
+    def delete(self, ids):
+        for start in range(0, len(ids), PINECONE_UPSERT_BATCH):
+            self.index.delete(ids=ids[start:start + PINECONE_UPSERT_BATCH])
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalIndexSink:
+    """
+    Collects chunks and writes them to the local index when flushed
+
+    Every local upsert rewrites the index files, so chunks are buffered and written every
+    REWRITE_CHECKPOINT_BATCHES batches rather than per batch; a crash loses at most the
+    chunks written since the last flush.
+    """
+
+    checkpoint_batches = REWRITE_CHECKPOINT_BATCHES
+
+    def __init__(self, path, ivf_lists=0):
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.ids, self.vectors, self.payloads, self.deleted = [], [], [], []
+
+    def write(self, ids, vectors, payloads):
+        self.ids.extend(ids)
+        self.vectors.append(vectors)
+        self.payloads.extend(payloads)
+
+    def delete(self, ids):
+        self.deleted.extend(ids)
+
+    def flush(self):
+        from utils.local_index import LocalVectorIndex, IDS_FILE
+        if not self.ids and not self.deleted:
+            return
+        vectors = np.vstack(self.vectors) if self.vectors else np.empty((0, 0), dtype=np.float32)
+        if os.path.exists(os.path.join(self.path, IDS_FILE)):
+            index = LocalVectorIndex(self.path)
+            index.upsert(self.ids, vectors, self.payloads, ivf_lists=self.ivf_lists or None, delete_ids=self.deleted)
+        else:
+            LocalVectorIndex.build(self.path, self.ids, vectors, self.payloads, ivf_lists=self.ivf_lists)
+        self.ids, self.vectors, self.payloads, self.deleted = [], [], [], []
+
+    def close(self):
+        self.flush()
+
+
+def load_manifest(path):
+    """{article_id: {"hash", "chunks"}} of everything ingested so far"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def ingest(source, sink, manifest_path, text_field=TEXT_KEY, id_field="id", chunk_chars=CHUNK_CHARS,
+           batch_size=256, workers=1, model_name=EMBEDDING_MODEL_NAME, metadata_fields=None, sparse_index_path=None):
+    """
+    Embed new and modified articles from `source` and write them to `sink`
+
+    Articles whose content hash matches the manifest are skipped. The rest are chunked and
+    embedded in batches of `batch_size` chunks, on `workers` processes when workers > 1
+    (with at most two batches queued per worker), and written in source order. Chunks left
+    over from an article's earlier, longer version are deleted. Articles without `id_field`
+    are identified by their content hash, so a modified version of such an article is added
+    as a new article. `metadata_fields` limits the article fields copied into chunk metadata.
+
+    Every `sink.checkpoint_batches` written batches (at least REWRITE_CHECKPOINT_BATCHES when
+    a sparse index is kept in sync) the sink is flushed, the same chunks are written to the
+    sparse index at `sparse_index_path` if one exists, and only then are their articles
+    recorded in the manifest. An interrupted run therefore re-ingests everything after the
+    last checkpoint into both indexes. The sparse index is marked stale while it lags behind
+    the vector index, so loading it in the meantime warns.
+
+    Returns ingestion statistics.
+    """
+    from utils.sparse_index import SparseIndex, IDS_FILE as SPARSE_IDS_FILE, mark_stale
+    manifest = load_manifest(manifest_path)
+    sparse = SparseIndex(sparse_index_path) \
+        if sparse_index_path and os.path.exists(os.path.join(sparse_index_path, SPARSE_IDS_FILE)) else None
+    checkpoint_batches = sink.checkpoint_batches if sparse is None \
+        else max(sink.checkpoint_batches, REWRITE_CHECKPOINT_BATCHES)
+    stats = {"articles": 0, "unchanged": 0, "new": 0, "modified": 0, "chunks": 0, "chunks_deleted": 0}
+    embedder = _PoolEmbedder(workers, model_name) if workers > 1 else _InProcessEmbedder()
+    in_flight = deque()   # (future, ids, texts, payloads, deleted ids, manifest entries completed by this batch)
+    batch_ids, batch_texts, batch_payloads, batch_deleted, batch_done = [], [], [], [], {}
+    # Written since the last checkpoint: chunks for the sparse index and the manifest entries they complete
+    unsynced = {"ids": [], "texts": [], "payloads": [], "deleted": [], "done": {}, "batches": 0}
+    start_time = time.perf_counter()
+
+    def checkpoint():
+        nonlocal sparse
+        sink.flush()
+        if sparse is not None and (unsynced["ids"] or unsynced["deleted"]):
+            sparse = sparse.upsert(unsynced["ids"], unsynced["texts"], unsynced["payloads"],
+                                   delete_ids=unsynced["deleted"], text_key=TEXT_KEY)
+        manifest.update(unsynced["done"])
+        save_manifest(manifest_path, manifest)
+        unsynced.update({"ids": [], "texts": [], "payloads": [], "deleted": [], "done": {}, "batches": 0})
+
+    def write_oldest():
+        future, ids, texts, payloads, deleted, done = in_flight.popleft()
+        if sparse is not None and unsynced["batches"] == 0:
+            mark_stale(sparse_index_path)
+        sink.write(ids, future.result(), payloads)
+        for key, values in (("ids", ids), ("texts", texts), ("payloads", payloads), ("deleted", deleted)):
+            unsynced[key].extend(values)
+        unsynced["done"].update(done)
+        unsynced["batches"] += 1
+        stats["chunks"] += len(ids)
+        if unsynced["batches"] >= checkpoint_batches:
+            checkpoint()
+        elapsed = time.perf_counter() - start_time
+        print(f"Ingested {stats['chunks']} chunks from {stats['articles']} articles ({stats['chunks'] / elapsed:.1f} chunks/s)")
+
+    def flush():
+        nonlocal batch_ids, batch_texts, batch_payloads, batch_deleted, batch_done
+        if not batch_ids:
+            return
+        in_flight.append((embedder.submit(batch_texts), batch_ids, batch_texts, batch_payloads, batch_deleted, batch_done))
+        batch_ids, batch_texts, batch_payloads, batch_deleted, batch_done = [], [], [], [], {}
+        while len(in_flight) > 2 * max(1, workers):
+            write_oldest()
+
+    try:
+        for article in read_articles(source, text_field):
+            stats["articles"] += 1
+            digest = content_hash(article)
+            article_id = str(article.get(id_field) or digest[:32])
+            previous = manifest.get(article_id)
+            if previous is not None and previous["hash"] == digest:
+                stats["unchanged"] += 1
+                continue
+            stats["modified" if previous is not None else "new"] += 1
+
+            ids, texts, payloads = _chunk_records(article_id, article, text_field, chunk_chars, metadata_fields)
+            if previous is not None and previous["chunks"] > len(ids):
+                stale = [f"{article_id}#{i}" for i in range(len(ids), previous["chunks"])]
+                sink.delete(stale)
+                batch_deleted.extend(stale)
+                stats["chunks_deleted"] += len(stale)
+            batch_ids.extend(ids)
+            batch_texts.extend(texts)
+            batch_payloads.extend(payloads)
+            batch_done[article_id] = {"hash": digest, "chunks": len(ids)}
+            if len(batch_ids) >= batch_size:
+                flush()
+        flush()
+        while in_flight:
+            write_oldest()
+        checkpoint()
+        sink.close()
+    finally:
+        embedder.close()
+
+    stats["seconds"] = time.perf_counter() - start_time
+    print(f"Ingestion finished: {stats}")
+    return stats
+
+
+def backend_target(ivf_lists=0):
+    """(sink, manifest path) for the configured VECTOR_BACKEND"""
+    from utils.retriever import get_vector_backend, INDEX_NAME
+    if get_vector_backend() == "local":
+        index_path = os.environ.get("LOCAL_INDEX_PATH", "local_index")
+        return LocalIndexSink(index_path, ivf_lists=ivf_lists), os.path.join(index_path, MANIFEST_FILE)
+    from utils.resources import registry
+    return PineconeSink(registry.get("pinecone_index")), os.path.join(".cache", f"{INDEX_NAME}_{MANIFEST_FILE}")
@@ -0,0 +1,367 @@
+# utils/llm.py
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import openai
+from langchain_openai import ChatOpenAI
+
+from utils.resources import registry
+from utils.tracing import span, metrics, LLM
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+
+class LLMResponseCache:
+    """
+    Content-addressed cache of LLM responses
+
+    Keys are a hash of (model, temperature, rendered prompt). Lookups go to an in-memory
+    LRU tier first, then to an optional SQLite tier that survives restarts. Entries older
+    than `ttl` seconds are treated as misses in both tiers; the SQLite tier is pruned to
+    its `max_disk_entries` newest entries (and expired ones dropped) every PRUNE_INTERVAL writes.
+    """
+
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, max_entries=1024, db_path=None, ttl=7 * 86400, max_disk_entries=100000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()   # key -> (content, total_tokens, created_at)
+        self.metrics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "tokens_saved": 0}
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                "key TEXT PRIMARY KEY, model TEXT, temperature REAL, content TEXT, total_tokens INTEGER, created_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS llm_responses_created_at ON llm_responses (created_at)")
+            self._db.commit()
+            self._prune()
+
+    @staticmethod
+    def make_key(model, temperature, prompt):
+        payload = json.dumps([model, float(temperature), prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the cached (content, total_tokens) or None"""
+        oldest = time.time() - self.ttl
+        with self._lock:
+            if key in self.memory:
+                content, tokens, created_at = self.memory[key]
+                if created_at >= oldest:
+                    self.memory.move_to_end(key)
+                    self.metrics["memory_hits"] += 1
+                    self.metrics["tokens_saved"] += tokens
+                    return content, tokens
+                del self.memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT content, total_tokens, created_at FROM llm_responses WHERE key = ? AND created_at >= ?", (key, oldest)
+                ).fetchone()
+                if row is not None:
+                    content, tokens = row[0], row[1] or 0
+                    self._remember(key, content, tokens, row[2])
+                    self.metrics["disk_hits"] += 1
+                    self.metrics["tokens_saved"] += tokens
+                    return content, tokens
+            self.metrics["misses"] += 1
+            return None
+
+    def put(self, key, model, temperature, content, total_tokens):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, content, total_tokens, created_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, float(temperature), content, total_tokens, created_at)
+                )
+                self._db.commit()
+                self._writes += 1
+                if self._writes % self.PRUNE_INTERVAL == 0:
+                    self._prune()
+
+    def _prune(self):
+        # Drop expired entries, then everything beyond the newest max_disk_entries
+        self._db.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM llm_responses WHERE key IN "
+            "(SELECT key FROM llm_responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,)
+        )
+        self._db.commit()
+
+    def _remember(self, key, content, tokens, created_at):
+        self.memory[key] = (content, tokens, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def record_bypass(self):
+        with self._lock:
+            self.metrics["bypassed"] += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.metrics["memory_hits"] + self.metrics["disk_hits"]
+            lookups = hits + self.metrics["misses"]
+            return {
+                **self.metrics,
+                "hits": hits,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+            }
+
+
+def _build_llm_cache():
+    # The on-disk tier is opt-in: persisted responses would otherwise leak into later runs and measurements
+    return LLMResponseCache(
+        max_entries=int(os.environ.get("LLM_CACHE_SIZE", "1024")),
+        db_path=os.environ.get("LLM_CACHE_DB") or None,
+        ttl=float(os.environ.get("LLM_CACHE_TTL", str(7 * 86400))),
+        max_disk_entries=int(os.environ.get("LLM_CACHE_DB_MAX_ENTRIES", "100000")),
+    )
+
+registry.register("llm_cache", _build_llm_cache)
+
+# Chat clients shared by all agents, one per (model, temperature)
+_clients = {}
+_clients_lock = threading.Lock()
+# Builds a chat client from (model, temperature); replaced by set_llm_factory() for offline runs
+_llm_factory = None
+
+# Transient OpenAI errors worth retrying; the client's own retries are disabled so they can be counted
+_RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+def get_llm(model=DEFAULT_MODEL, temperature=0):
+    """Return a shared ChatOpenAI client"""
+    key = (model, float(temperature))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                if _llm_factory is not None:
+                    client = _llm_factory(model, temperature)
+                else:
+                    client = ChatOpenAI(model=model, temperature=temperature, max_retries=0, stream_usage=True)
+                _clients[key] = client
+    return client
+
+def set_llm_factory(factory):
+    """
+    Build chat clients with factory(model, temperature) instead of ChatOpenAI (None restores it)
+
+    The client only needs invoke/ainvoke/stream/astream; the benchmarks use this to swap in a
+    local stand-in. Already created clients are dropped.
+    """
+    global _llm_factory
+    with _clients_lock:
+        _llm_factory = factory
+        _clients.clear()
+
+def get_llm_cache():
+    """Return the shared response cache, or None if LLM_CACHE=false"""
+    if os.environ.get("LLM_CACHE", "true").lower() != "true":
+        return None
+    return registry.get("llm_cache")
+
+def get_max_retries():
+    """Retries per LLM call after transient OpenAI errors (LLM_MAX_RETRIES, default 2)"""
+    return int(os.environ.get("LLM_MAX_RETRIES", "2"))
+
+def _retry_delay(attempt):
+    return min(8.0, 0.5 * 2 ** attempt)
+
+def _note_retry(llm_span, attempt, error):
+    llm_span.set(retries=attempt)
+    metrics.increment("llm_retries_total")
+    print(f"LLM call failed ({type(error).__name__}), retry {attempt}/{get_max_retries()}")
+
+def _call_with_retries(call, llm_span):
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except _RETRYABLE_ERRORS as e:
+            if attempt >= get_max_retries():
+                raise
+            attempt += 1
+            _note_retry(llm_span, attempt, e)
+            time.sleep(_retry_delay(attempt))
+
+async def _acall_with_retries(call, llm_span):
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except _RETRYABLE_ERRORS as e:
+            if attempt >= get_max_retries():
+                raise
+            attempt += 1
+            _note_retry(llm_span, attempt, e)
+            await asyncio.sleep(_retry_delay(attempt))
+
+def _use_cache(temperature, cache):
+    # Sampling temperatures bypass the cache unless explicitly opted in
+    if cache is not None:
+        return cache
+    return temperature == 0 or os.environ.get("LLM_CACHE_SAMPLING", "false").lower() == "true"
+
+def _token_counts(message):
+    """(prompt_tokens, completion_tokens) reported for a response"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage.get("total_tokens"):
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+def _total_tokens(message):
+    return sum(_token_counts(message))
+
+def _record_cache_status(llm_span, status, response_cache):
+    llm_span.set(cache=status)
+    metrics.increment("llm_cache_total", status=status)
+    if status == "bypass" and response_cache is not None:
+        response_cache.record_bypass()
+
+def _record_usage(llm_span, message):
+    prompt_tokens, completion_tokens = _token_counts(message)
+    llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    metrics.increment("llm_tokens_total", prompt_tokens, type="prompt")
+    metrics.increment("llm_tokens_total", completion_tokens, type="completion")
+
+def invoke_llm(prompt, model=DEFAULT_MODEL, temperature=0, cache=None):
+    """
+    Send a rendered prompt to the chat model and return the response text
+
+    Parameters:
+        prompt: rendered prompt string
+        model: OpenAI chat model name
+        temperature: sampling temperature
+        cache: True/False to force or skip the response cache; None caches only temperature 0
+    """
+    with span("chat_completion", LLM, model=model, temperature=temperature) as llm_span:
+        response_cache = get_llm_cache()
+        if response_cache is None or not _use_cache(temperature, cache):
+            _record_cache_status(llm_span, "bypass", response_cache)
+            message = _call_with_retries(lambda: get_llm(model, temperature).invoke(prompt), llm_span)
+            _record_usage(llm_span, message)
+            return message.content
+        
+        key = LLMResponseCache.make_key(model, temperature, prompt)
+        cached = response_cache.get(key)
+        if cached is not None:
+            _record_cache_status(llm_span, "hit", response_cache)
+            return cached[0]
+        
+        _record_cache_status(llm_span, "miss", response_cache)
+        message = _call_with_retries(lambda: get_llm(model, temperature).invoke(prompt), llm_span)
+        _record_usage(llm_span, message)
+        response_cache.put(key, model, temperature, message.content, _total_tokens(message))
+        return message.content
+
+async def ainvoke_llm(prompt, model=DEFAULT_MODEL, temperature=0, cache=None):
+    """Async version of invoke_llm; the OpenAI request does not block the event loop"""
+    with span("chat_completion", LLM, model=model, temperature=temperature) as llm_span:
+        response_cache = get_llm_cache()
+        if response_cache is None or not _use_cache(temperature, cache):
+            _record_cache_status(llm_span, "bypass", response_cache)
+            message = await _acall_with_retries(lambda: get_llm(model, temperature).ainvoke(prompt), llm_span)
+            _record_usage(llm_span, message)
+            return message.content
+        
+        key = LLMResponseCache.make_key(model, temperature, prompt)
+        cached = response_cache.get(key)
+        if cached is not None:
+            _record_cache_status(llm_span, "hit", response_cache)
+            return cached[0]
+        
+        _record_cache_status(llm_span, "miss", response_cache)
+        message = await _acall_with_retries(lambda: get_llm(model, temperature).ainvoke(prompt), llm_span)
+        _record_usage(llm_span, message)
+        response_cache.put(key, model, temperature, message.content, _total_tokens(message))
+        return message.content
+
+def stream_llm(prompt, model=DEFAULT_MODEL, temperature=0, cache=None):
+    """Like invoke_llm, but yield the response text in chunks as the model produces it"""
+    with span("chat_completion_stream", LLM, activate=False, model=model, temperature=temperature) as llm_span:
+        response_cache = get_llm_cache()
+        use_cache = response_cache is not None and _use_cache(temperature, cache)
+        
+        if use_cache:
+            key = LLMResponseCache.make_key(model, temperature, prompt)
+            cached = response_cache.get(key)
+            if cached is not None:
+                _record_cache_status(llm_span, "hit", response_cache)
+                yield cached[0]
+                return
+        _record_cache_status(llm_span, "miss" if use_cache else "bypass", response_cache)
+        
+        message = None
+        attempt = 0
+        while message is None:
+            try:
+                for chunk in get_llm(model, temperature).stream(prompt):
+                    message = chunk if message is None else message + chunk
+                    if chunk.content:
+                        yield chunk.content
+                break
+            except _RETRYABLE_ERRORS as e:
+                # Once text has been yielded the stream cannot be restarted transparently
+                if message is not None or attempt >= get_max_retries():
+                    raise
+                attempt += 1
+                _note_retry(llm_span, attempt, e)
+                time.sleep(_retry_delay(attempt))
+        
+        if message is not None:
+            _record_usage(llm_span, message)
+            if use_cache:
+                response_cache.put(key, model, temperature, message.content, _total_tokens(message))
+
+async def astream_llm(prompt, model=DEFAULT_MODEL, temperature=0, cache=None):
+    """Async version of stream_llm"""
+    with span("chat_completion_stream", LLM, activate=False, model=model, temperature=temperature) as llm_span:
+        response_cache = get_llm_cache()
+        use_cache = response_cache is not None and _use_cache(temperature, cache)
+        
+        if use_cache:
+            key = LLMResponseCache.make_key(model, temperature, prompt)
+            cached = response_cache.get(key)
+            if cached is not None:
+                _record_cache_status(llm_span, "hit", response_cache)
+                yield cached[0]
+                return
+        _record_cache_status(llm_span, "miss" if use_cache else "bypass", response_cache)
+        
+        message = None
+        attempt = 0
+        while message is None:
+            try:
+                async for chunk in get_llm(model, temperature).astream(prompt):
+                    message = chunk if message is None else message + chunk
+                    if chunk.content:
+                        yield chunk.content
+                break
+            except _RETRYABLE_ERRORS as e:
+                if message is not None or attempt >= get_max_retries():
+                    raise
+                attempt += 1
+                _note_retry(llm_span, attempt, e)
+                await asyncio.sleep(_retry_delay(attempt))
+        
+        if message is not None:
+            _record_usage(llm_span, message)
+            if use_cache:
+                response_cache.put(key, model, temperature, message.content, _total_tokens(message))
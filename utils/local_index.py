@@ -0,0 +1,299 @@
+# utils/local_index.py
+import os
+import json
+import numpy as np
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_FILE = "vectors.npy"
+PAYLOADS_FILE = "payloads.bin"
+OFFSETS_FILE = "offsets.npy"
+IDS_FILE = "ids.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_ASSIGNMENTS_FILE = "ivf_assignments.npy"
+CODES_FILE = "codes_int8.npy"
+SCALES_FILE = "code_scales.npy"
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _save_array(path, array):
+    # Write to a temporary file and swap it in, so open memory maps keep the old inode
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, sorted descending"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class LocalVectorIndex:
+    """
+    On-disk vector index for single-node serving
+
+    Vectors are stored L2-normalized in a memory-mapped float32 .npy file, so dot products
+    are cosine similarities. Payloads (metadata including the text) are stored as JSON
+    records concatenated in one binary file addressed through an offsets array.
+    """
+
+    def __init__(self, path, nprobe=8):
+        self.path = path
+        self.nprobe = nprobe
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.payloads = np.memmap(os.path.join(path, PAYLOADS_FILE), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+        with open(os.path.join(path, IDS_FILE), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self._rows = None   # ID -> row, built on first lookup
+
+        # Optional IVF + int8 quantized mode for large corpora
+        self.centroids = None
+        if os.path.exists(os.path.join(path, IVF_CENTROIDS_FILE)):
+            self.centroids = np.load(os.path.join(path, IVF_CENTROIDS_FILE))
+            self.assignments = np.load(os.path.join(path, IVF_ASSIGNMENTS_FILE), mmap_mode="r")
+            self.codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")
+            self.scales = np.load(os.path.join(path, SCALES_FILE))
+            # Inverted lists: row indices grouped by centroid
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, path, ids, vectors, payloads, ivf_lists=0):
+        """Write a new index to `path` and open it"""
+        os.makedirs(path, exist_ok=True)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = _normalize(vectors.reshape(len(ids), -1) if len(ids) else vectors.reshape(0, vectors.shape[-1]))
+        if len(ids) != len(vectors) or len(ids) != len(payloads):
+            raise ValueError("ids, vectors and payloads must have the same length")
+
+        encoded = [json.dumps(payload, ensure_ascii=False).encode("utf-8") for payload in payloads]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(record) for record in encoded])
+
+        _save_array(os.path.join(path, VECTORS_FILE), vectors)
+        _save_array(os.path.join(path, OFFSETS_FILE), offsets)
+        payloads_path = os.path.join(path, PAYLOADS_FILE)
+        with open(payloads_path + ".tmp", "wb") as f:
+            for record in encoded:
+                f.write(record)
+        os.replace(payloads_path + ".tmp", payloads_path)
+        ids_path = os.path.join(path, IDS_FILE)
+        with open(ids_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(list(ids), f)
+        os.replace(ids_path + ".tmp", ids_path)
+
+        for name in (IVF_CENTROIDS_FILE, IVF_ASSIGNMENTS_FILE, CODES_FILE, SCALES_FILE):
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        if ivf_lists:
+            cls._build_ivf(path, vectors, ivf_lists)
+
+        return cls(path)
+
+    @staticmethod
+    def _build_ivf(path, vectors, n_lists, iterations=10, seed=0):
+        """Train spherical k-means centroids and int8 codes for the IVF search mode"""
+        n_lists = min(n_lists, len(vectors))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = vectors[assignments == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+        # Symmetric per-vector int8 quantization
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+
+        _save_array(os.path.join(path, IVF_CENTROIDS_FILE), centroids)
+        _save_array(os.path.join(path, IVF_ASSIGNMENTS_FILE), assignments)
+        _save_array(os.path.join(path, CODES_FILE), codes)
+        _save_array(os.path.join(path, SCALES_FILE), scales.astype(np.float32))
+
+    def row_of(self, doc_id):
+        """Row of a record ID, or None if it is not in the index"""
+        if self._rows is None:
+            self._rows = {record_id: row for row, record_id in enumerate(self.ids)}
+        return self._rows.get(doc_id)
+
+    def payload(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return json.loads(bytes(self.payloads[start:end]).decode("utf-8"))
+
+    def search(self, query_vector, k=5):
+        """Return [(row, cosine_similarity), ...] for the k nearest vectors"""
+        if len(self) == 0:
+            return []
+        query = _normalize(query_vector)
+
+        if self.centroids is None:
+            # Vectorized brute force over the memory-mapped matrix
+            scores = self.vectors @ query
+            top = _top_k(scores, k)
+            return [(int(row), float(scores[row])) for row in top]
+
+        # IVF: probe the nearest lists, score candidates on int8 codes, then re-rank exactly
+        probes = _top_k(self.centroids @ query, self.nprobe)
+        candidates = np.concatenate([self.lists[c] for c in probes])
+        if len(candidates) == 0:
+            return []
+        approx = (self.codes[candidates].astype(np.float32) @ query) * self.scales[candidates]
+        shortlist = candidates[_top_k(approx, max(k * 4, k))]
+        exact = self.vectors[shortlist] @ query
+        order = _top_k(exact, k)
+        return [(int(shortlist[i]), float(exact[i])) for i in order]
+
+    def upsert(self, ids, vectors, payloads, ivf_lists=None, delete_ids=()):
+        """Insert or replace records by id, drop `delete_ids`, and rewrite the index files; returns the reopened index"""
+        delete_ids = set(delete_ids)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in delete_ids]
+        all_ids = [self.ids[row] for row in keep]
+        all_vectors = np.array(self.vectors[keep], dtype=np.float32)
+        all_payloads = [self.payload(row) for row in keep]
+        positions = {doc_id: row for row, doc_id in enumerate(all_ids)}
+
+        new_rows = []
+        for doc_id, vector, payload in zip(ids, vectors, payloads):
+            if doc_id in positions:
+                row = positions[doc_id]
+                all_vectors[row] = vector
+                all_payloads[row] = payload
+            else:
+                positions[doc_id] = len(all_ids)
+                all_ids.append(doc_id)
+                all_payloads.append(payload)
+                new_rows.append(vector)
+        if new_rows:
+            all_vectors = np.vstack([all_vectors.reshape(-1, len(new_rows[0])), np.asarray(new_rows, dtype=np.float32)])
+
+        if ivf_lists is None:
+            ivf_lists = len(self.centroids) if self.centroids is not None else 0
+        return LocalVectorIndex.build(self.path, all_ids, all_vectors, all_payloads, ivf_lists=ivf_lists)
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain vector store over a LocalVectorIndex, mirroring the Pinecone store's text_key layout"""
+
+    def __init__(self, index, embedding, text_key="Cleaned Text"):
+        self.index = index
+        self._embedding = embedding
+        self.text_key = text_key
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def _to_document(self, row):
+        metadata = self.index.payload(row)
+        text = metadata.pop(self.text_key, "")
+        # The stored ID, so hits match the same record found by keyword search or an earlier round
+        return Document(id=self.index.ids[row], page_content=text, metadata=metadata)
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        return [(self._to_document(row), score) for row, score in self.index.search(embedding, k)]
+
+    def similarity_search_with_vectors(self, query, k=4):
+        """[(Document, score, normalized vector), ...] for the k nearest records"""
+        results = self.index.search(self._embedding.embed_query(query), k)
+        return [(self._to_document(row), score, np.asarray(self.index.vectors[row])) for row, score in results]
+
+    def vectors_for(self, ids):
+        """Stored normalized vectors for the given record IDs, or None if any ID is not in the index"""
+        rows = [self.index.row_of(doc_id) for doc_id in ids]
+        if any(row is None for row in rows):
+            return None
+        return [np.asarray(self.index.vectors[row]) for row in rows]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(len(self.index) + i) for i in range(len(texts))]
+        vectors = self._embedding.embed_documents(texts)
+        payloads = [{**metadata, self.text_key: text} for text, metadata in zip(texts, metadatas)]
+        self.index = self.index.upsert(ids, vectors, payloads)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path="local_index", text_key="Cleaned Text", **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(texts))]
+        vectors = embedding.embed_documents(texts)
+        payloads = [{**metadata, text_key: text} for text, metadata in zip(texts, metadatas)]
+        index = LocalVectorIndex.build(path, ids, vectors, payloads)
+        return cls(index, embedding, text_key=text_key)
+
+
+def import_pinecone_export(export_path, index_path, ivf_lists=0):
+    """
+    Build a local index from a Pinecone export
+
+    The export is a JSONL file with one {"id", "values", "metadata"} record per line,
+    as written by export_pinecone_index().
+    """
+    ids, vectors, payloads = [], [], []
+    with open(export_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            ids.append(record["id"])
+            vectors.append(record["values"])
+            payloads.append(record.get("metadata") or {})
+    print(f"Importing {len(ids)} vectors from {export_path} into {index_path}")
+    return LocalVectorIndex.build(index_path, ids, np.asarray(vectors, dtype=np.float32), payloads, ivf_lists=ivf_lists)
+
+
+def export_pinecone_index(index, export_path, batch_size=100):
+    """Dump every vector of a Pinecone index (values and metadata) to a JSONL file"""
+    count = 0
+    with open(export_path, "w", encoding="utf-8") as f:
+        for id_batch in index.list():
+            for start in range(0, len(id_batch), batch_size):
+                fetched = index.fetch(ids=id_batch[start:start + batch_size])
+                for doc_id, vector in fetched.vectors.items():
+                    f.write(json.dumps({
+                        "id": doc_id,
+                        "values": list(vector.values),
+                        "metadata": dict(vector.metadata or {})
+                    }, ensure_ascii=False) + "\n")
+                    count += 1
+    print(f"Exported {count} vectors to {export_path}")
+    return count
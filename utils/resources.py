@@ -0,0 +1,125 @@
+# utils/resources.py
+import threading
+import time
+
+
+class ResourceRegistry:
+    """Thread-safe, process-wide registry that builds expensive resources once and reuses them"""
+
+    def __init__(self):
+        self._factories = {}
+        self._health_checks = {}
+        self._dependencies = {}
+        self._resources = {}
+        self._init_times = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, depends_on=(), health_check=None):
+        """
+        Register a resource factory
+
+        Parameters:
+            name: resource name
+            factory: zero-argument callable that builds the resource
+            depends_on: names of resources that must be rebuilt before this one on reload
+            health_check: optional callable taking the resource and raising if it is unhealthy
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._dependencies[name] = tuple(depends_on)
+            self._health_checks[name] = health_check
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Return the named resource, building it on first use"""
+        resource = self._resources.get(name)
+        if resource is not None:
+            return resource
+
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource: {name}")
+
+        # Per-resource lock so slow builds (e.g. model loading) do not block unrelated resources
+        with self._locks[name]:
+            resource = self._resources.get(name)
+            if resource is None:
+                start_time = time.perf_counter()
+                resource = self._factories[name]()
+                self._init_times[name] = time.perf_counter() - start_time
+                self._resources[name] = resource
+                print(f"Initialized resource '{name}' in {self._init_times[name]:.2f}s")
+        return resource
+
+    def override(self, name, resource):
+        """Use a prebuilt resource (e.g. a local stand-in for benchmarks) instead of calling its factory"""
+        if name not in self._factories:
+            raise KeyError(f"Unknown resource: {name}")
+        with self._locks[name]:
+            self._resources[name] = resource
+            self._init_times[name] = 0.0
+
+    def is_loaded(self, name):
+        return name in self._resources
+
+    def names(self):
+        return list(self._factories)
+
+    def warm_up(self, names=None):
+        """Build the given resources (all registered ones by default) and return their init times"""
+        for name in names or self.names():
+            self.get(name)
+        return self.init_times()
+
+    def reload(self, name=None):
+        """
+        Drop a resource together with its dependents and rebuild it
+
+        Without a name every resource built so far is rebuilt. Dependents and, for a full
+        reload, resources never used are left unbuilt (e.g. the Pinecone client when the
+        local index is in use).
+        """
+        if name is None:
+            targets = [target for target in self.names() if self.is_loaded(target)]
+        else:
+            targets = [name] + [target for target in self._with_dependents(name)[1:] if self.is_loaded(target)]
+        with self._lock:
+            for target in targets:
+                self._resources.pop(target, None)
+                self._init_times.pop(target, None)
+        for target in targets:
+            self.get(target)
+        return self.init_times()
+
+    def _with_dependents(self, name):
+        result = [name]
+        for other, deps in self._dependencies.items():
+            if name in deps and other not in result:
+                result.extend(dep for dep in self._with_dependents(other) if dep not in result)
+        return result
+
+    def health(self):
+        """Report load state, init time and health of every registered resource"""
+        report = {}
+        for name in self.names():
+            entry = {"loaded": self.is_loaded(name), "init_time": self._init_times.get(name)}
+            check = self._health_checks.get(name)
+            if entry["loaded"] and check is not None:
+                try:
+                    check(self._resources[name])
+                    entry["healthy"] = True
+                except Exception as e:
+                    entry["healthy"] = False
+                    entry["error"] = str(e)
+            else:
+                entry["healthy"] = entry["loaded"]
+            report[name] = entry
+        return report
+
+    def init_times(self):
+        """Init time per resource; includes time spent building its dependencies on first use"""
+        return dict(self._init_times)
+
+
+# Shared registry used by the whole process
+registry = ResourceRegistry()
@@ -2,6 +2,11 @@
 import os
 import pinecone
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from utils.resources import registry
+from utils.tracing import span, EMBEDDING
 
 # Update Pinecone import, using the new package path
 try:
@@ -10,29 +15,59 @@ except ImportError:
     # If the new package is not installed, fall back to the old import
     from langchain.vectorstores import Pinecone
 
-def get_retriever():
-    """Connect to Pinecone vector database and return a retriever"""
-    PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
-    
+INDEX_NAME = "text-embedding-index"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+TEXT_KEY = "Cleaned Text"
+
+def get_vector_backend():
+    """Return the vector store backend selected by the VECTOR_BACKEND env var (pinecone or local)"""
+    return os.environ.get("VECTOR_BACKEND", "pinecone").lower()
+
+class TracedEmbeddings(Embeddings):
+    """Embedding model wrapper that records every call as an "embedding" span"""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def embed_query(self, text):
+        with span("embed_query", EMBEDDING, model=EMBEDDING_MODEL_NAME):
+            return self.embeddings.embed_query(text)
+
+    def embed_documents(self, texts):
+        with span("embed_documents", EMBEDDING, model=EMBEDDING_MODEL_NAME, texts=len(texts)):
+            return self.embeddings.embed_documents(texts)
+
+def _build_embeddings():
+    # Initialize embedding model - Using all-MiniLM-L6-v2 (384 dimensions)
+    return TracedEmbeddings(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME))
+
+def _build_pinecone_client():
     # Initialize Pinecone
-    pc = pinecone.Pinecone(
-        api_key=PINECONE_API_KEY
-    )
-    
+    return pinecone.Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+
+def _build_pinecone_index():
     # Connect to index
-    index_name = "text-embedding-index"
-    
-    # Initialize embedding model - Using all-MiniLM-L6-v2 (384 dimensions)
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2"
-    )
-    
+    return registry.get("pinecone_client").Index(INDEX_NAME)
+
+def _build_local_index():
+    from utils.local_index import LocalVectorIndex
+    index_path = os.environ.get("LOCAL_INDEX_PATH", "local_index")
+    nprobe = int(os.environ.get("LOCAL_INDEX_NPROBE", "8"))
+    return LocalVectorIndex(index_path, nprobe=nprobe)
+
+def _build_vectorstore():
+    embeddings = registry.get("embeddings")
+
+    if get_vector_backend() == "local":
+        from utils.local_index import LocalVectorStore
+        return LocalVectorStore(registry.get("local_index"), embeddings, text_key=TEXT_KEY)
+
     # Create vector store
     try:
         vectorstore = Pinecone(
-            index=pc.Index(index_name),
+            index=registry.get("pinecone_index"),
             embedding=embeddings,
-            text_key="Cleaned Text"
+            text_key=TEXT_KEY
         )
     except Exception as e:
         print(f"Error creating vector store: {e}")
@@ -40,18 +75,93 @@ def get_retriever():
         try:
             # Try fallback method
             vectorstore = Pinecone.from_existing_index(
-                index_name=index_name,
+                index_name=INDEX_NAME,
                 embedding=embeddings,
-                text_key="Cleaned Text"
+                text_key=TEXT_KEY
             )
         except Exception as e2:
             print(f"Fallback method also failed: {e2}")
             raise Exception("Unable to connect to Pinecone index, please check index name and API key")
-    
+
+    return vectorstore
+
+def _build_sparse_index():
+    from utils.sparse_index import SparseIndex
+    return SparseIndex(os.environ.get("SPARSE_INDEX_PATH", "sparse_index"))
+
+def _build_retriever():
     # Create retriever
-    retriever = vectorstore.as_retriever(
+    return registry.get("vectorstore").as_retriever(
         search_type="similarity",
         search_kwargs={"k": 5}
     )
-    
-    return retriever
\ No newline at end of file
+
+registry.register("embeddings", _build_embeddings,
+                  health_check=lambda embeddings: embeddings.embed_query("health check"))
+registry.register("pinecone_client", _build_pinecone_client)
+registry.register("pinecone_index", _build_pinecone_index, depends_on=("pinecone_client",),
+                  health_check=lambda index: index.describe_index_stats())
+registry.register("local_index", _build_local_index)
+registry.register("vectorstore", _build_vectorstore, depends_on=("embeddings", "pinecone_index", "local_index"))
+registry.register("retriever", _build_retriever, depends_on=("vectorstore",))
+registry.register("sparse_index", _build_sparse_index)
+
+def search_with_vectors(vectorstore, query, k):
+    """
+    Similarity search that also returns each match's stored vector
+
+    Returns [(Document, score, vector), ...], or None if the store cannot return vectors.
+    """
+    if hasattr(vectorstore, "similarity_search_with_vectors"):
+        return vectorstore.similarity_search_with_vectors(query, k=k)
+    if not isinstance(vectorstore, Pinecone):
+        return None
+    # Pinecone store (built with TEXT_KEY and the default namespace): the same query LangChain
+    # runs, sent through the shared index handle with include_values so vectors come back too
+    results = registry.get("pinecone_index").query(
+        vector=vectorstore.embeddings.embed_query(query),
+        top_k=k,
+        include_metadata=True,
+        include_values=True,
+    )
+    matches = []
+    for match in results["matches"]:
+        metadata = dict(match["metadata"])
+        if TEXT_KEY not in metadata:
+            continue
+        text = metadata.pop(TEXT_KEY)
+        matches.append((Document(id=match.get("id"), page_content=text, metadata=metadata), match["score"], match["values"]))
+    return matches
+
+def get_embeddings():
+    """Return the shared embedding model"""
+    return registry.get("embeddings")
+
+def get_vectorstore():
+    """Return the shared vector store"""
+    return registry.get("vectorstore")
+
+def get_retriever():
+    """Return the shared retriever connected to the configured vector database"""
+    return registry.get("retriever")
+
+def _backend_resources():
+    if get_vector_backend() == "local":
+        return ["local_index"]
+    return ["pinecone_client", "pinecone_index"]
+
+def get_sparse_index():
+    """Return the shared BM25 keyword index (SPARSE_INDEX_PATH), or None if it cannot be loaded"""
+    try:
+        return registry.get("sparse_index")
+    except Exception as e:
+        print(f"Sparse index unavailable, using dense retrieval only: {e}")
+        return None
+
+def warm_up_retriever():
+    """Pre-build the embedding model, vector index connection and retriever, returning init times per resource"""
+    return registry.warm_up(["embeddings"] + _backend_resources() + ["vectorstore", "retriever"])
+
+def reload_retriever():
+    """Rebuild the vector index connection and everything built on it"""
+    return registry.reload(_backend_resources()[0])
@@ -0,0 +1,240 @@
+# utils/semantic_cache.py
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from utils.resources import registry
+
+# System modes used as cache partitions (same names as the evaluation results)
+CACHE_MODES = ("base_llm", "simple_rag", "advanced_rag_base", "advanced_rag_finetuned")
+
+
+class _Partition:
+    """LRU-ordered entries of one system mode plus a lazily rebuilt embedding matrix"""
+
+    def __init__(self):
+        self.entries = OrderedDict()   # key -> entry dict
+        self.matrix = None
+        self.keys = []
+
+    def invalidate(self):
+        self.matrix = None
+
+    def ensure_matrix(self):
+        if self.matrix is None:
+            self.keys = list(self.entries)
+            self.matrix = np.stack([self.entries[key]["vector"] for key in self.keys]) \
+                if self.keys else None
+        return self.matrix
+
+
+class SemanticCache:
+    """
+    Answer cache for repeated and near-duplicate questions
+
+    Queries are embedded and normalized; a lookup returns the cached result of the most
+    similar earlier query in the same mode if the cosine similarity reaches `threshold`.
+    Entries expire after `ttl` seconds and each mode keeps at most `max_entries` (LRU).
+    """
+
+    def __init__(self, embed_fn, threshold=0.95, ttl=86400, max_entries=1000, db_path=None):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.partitions = {}
+        self.metrics = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+        self.mode_metrics = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _partition(self, mode):
+        if mode not in self.partitions:
+            self.partitions[mode] = _Partition()
+            self.mode_metrics[mode] = {"hits": 0, "misses": 0}
+        return self.partitions[mode]
+
+    def _embed(self, query):
+        vector = np.asarray(self.embed_fn(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query, mode):
+        """Return (result, similarity) for a cached near-duplicate of `query`, or (None, best_similarity)"""
+        vector = self._embed(query)
+        with self._lock:
+            partition = self._partition(mode)
+            self._expire(mode, partition)
+            matrix = partition.ensure_matrix()
+            best_similarity = 0.0
+            if matrix is not None:
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                best_similarity = float(similarities[best])
+                if best_similarity >= self.threshold:
+                    key = partition.keys[best]
+                    partition.entries.move_to_end(key)
+                    self.metrics["hits"] += 1
+                    self.mode_metrics[mode]["hits"] += 1
+                    return partition.entries[key]["result"], best_similarity
+            self.metrics["misses"] += 1
+            self.mode_metrics[mode]["misses"] += 1
+            return None, best_similarity
+
+    def store(self, query, mode, result):
+        """Cache a JSON-serializable result for `query` in `mode`"""
+        vector = self._embed(query)
+        with self._lock:
+            partition = self._partition(mode)
+            key = self._next_key
+            self._next_key += 1
+            entry = {"query": query, "vector": vector, "result": result, "created_at": time.time()}
+            partition.entries[key] = entry
+            partition.invalidate()
+            self.metrics["stores"] += 1
+            self._persist(mode, key, entry)
+            while len(partition.entries) > self.max_entries:
+                old_key, _ = partition.entries.popitem(last=False)
+                self._unpersist(mode, old_key)
+                self.metrics["evictions"] += 1
+
+    def _expire(self, mode, partition):
+        cutoff = time.time() - self.ttl
+        expired = [key for key, entry in partition.entries.items() if entry["created_at"] < cutoff]
+        for key in expired:
+            del partition.entries[key]
+            self._unpersist(mode, key)
+        if expired:
+            partition.invalidate()
+            self.metrics["expirations"] += len(expired)
+
+    def clear(self, mode=None):
+        with self._lock:
+            for name in ([mode] if mode else list(self.partitions)):
+                self.partitions.pop(name, None)
+                if self._db is not None:
+                    self._db.execute("DELETE FROM semantic_cache WHERE mode = ?", (name,))
+                    self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            return {
+                **self.metrics,
+                "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+                "entries": {mode: len(p.entries) for mode, p in self.partitions.items()},
+                "modes": {mode: dict(m) for mode, m in self.mode_metrics.items()},
+            }
+
+    # Optional SQLite persistence
+    def _open_db(self, db_path):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS semantic_cache ("
+            "mode TEXT, key INTEGER, query TEXT, vector BLOB, result TEXT, created_at REAL, "
+            "PRIMARY KEY (mode, key))"
+        )
+        self._db.execute("DELETE FROM semantic_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT mode, key, query, vector, result, created_at FROM semantic_cache ORDER BY created_at"
+        ).fetchall()
+        for mode, key, query, vector, result, created_at in rows:
+            self._partition(mode).entries[key] = {
+                "query": query,
+                "vector": np.frombuffer(vector, dtype=np.float32),
+                "result": json.loads(result),
+                "created_at": created_at,
+            }
+            self._next_key = max(self._next_key, key + 1)
+        for mode, partition in self.partitions.items():
+            while len(partition.entries) > self.max_entries:
+                old_key, _ = partition.entries.popitem(last=False)
+                self._unpersist(mode, old_key)
+        if rows:
+            print(f"Loaded {len(rows)} semantic cache entries from {db_path}")
+
+    def _persist(self, mode, key, entry):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO semantic_cache VALUES (?, ?, ?, ?, ?, ?)",
+            (mode, key, entry["query"], entry["vector"].astype(np.float32).tobytes(),
+             json.dumps(entry["result"], ensure_ascii=False), entry["created_at"])
+        )
+        self._db.commit()
+
+    def _unpersist(self, mode, key):
+        if self._db is None:
+            return
+        self._db.execute("DELETE FROM semantic_cache WHERE mode = ? AND key = ?", (mode, key))
+        self._db.commit()
+
+
+def _build_semantic_cache():
+    # Reuse the already-loaded MiniLM embedding model
+    embeddings = registry.get("embeddings")
+    return SemanticCache(
+        embed_fn=embeddings.embed_query,
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        ttl=float(os.environ.get("SEMANTIC_CACHE_TTL", "86400")),
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+        db_path=os.environ.get("SEMANTIC_CACHE_DB") or None,
+    )
+
+registry.register("semantic_cache", _build_semantic_cache, depends_on=("embeddings",))
+
+
+def get_semantic_cache():
+    """Return the shared semantic cache, or None unless SEMANTIC_CACHE=true"""
+    if os.environ.get("SEMANTIC_CACHE", "false").lower() != "true":
+        return None
+    return registry.get("semantic_cache")
+
+
+def lookup_cached_result(query, mode):
+    """Return the cached result for a near-duplicate of `query` in `mode`, or None"""
+    cache = get_semantic_cache()
+    if cache is None:
+        return None
+    cached, similarity = cache.lookup(query, mode)
+    if cached is None:
+        return None
+    print(f"Semantic cache hit ({mode}, similarity {similarity:.3f})")
+    result = dict(cached)
+    result["intermediate_steps"] = [f"Semantic cache hit (similarity {similarity:.3f})"] + list(cached["intermediate_steps"])
+    return result
+
+
+def store_result(query, mode, result):
+    """Cache the answer, steps and confidence of a successful run; runs with an "error" key are skipped"""
+    cache = get_semantic_cache()
+    if cache is None or not result.get("answer") or result.get("error"):
+        return
+    cache.store(query, mode, {
+        "answer": result["answer"],
+        "intermediate_steps": list(result.get("intermediate_steps", [])),
+        "confidence_score": result.get("confidence_score"),
+    })
+
+
+def cached_run(query, mode, run_fn):
+    """
+    Serve `query` from the semantic cache for `mode`, or call `run_fn()` and cache its result
+
+    `run_fn` returns a dict with at least "answer" and "intermediate_steps".
+    """
+    result = lookup_cached_result(query, mode)
+    if result is not None:
+        return result
+    result = run_fn()
+    store_result(query, mode, result)
+    return result
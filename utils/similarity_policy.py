@@ -0,0 +1,201 @@
+# utils/similarity_policy.py
+import os
+import json
+import threading
+import numpy as np
+
+from utils.tracing import metrics
+
+ACCEPT, REJECT, AMBIGUOUS, NO_SCORES = "accept", "reject", "ambiguous", "no_scores"
+
+# Fitted thresholds written by fit_similarity_policy() and read by SimilarityPolicy.from_env()
+POLICY_FILE = "similarity_policy.json"
+# assess_confidence answers at this evaluator confidence and reformulates below it
+ANSWER_CONFIDENCE = 5
+# Fewest labelled documents a fit is accepted from
+MIN_FIT_SAMPLES = 20
+
+
+class SimilarityPolicy:
+    """
+    Decides relevance from vector similarity scores when they are clear enough
+
+    Similarities (of each document to the user's question) are calibrated onto the 1-10
+    relevance scale linearly between `floor` (score 1) and `ceiling` (score 10). The mean
+    calibrated score plays the role of the LLM evaluator's confidence score: at or above
+    `accept_above` the documents are clearly relevant, at or below `reject_below` clearly
+    not, and anything in between is left to the evaluator. Documents calibrated at
+    `retain_threshold` or more are retained.
+
+    The constructor defaults are uncalibrated starting points; fit_similarity_policy()
+    derives all four thresholds from the evaluator's own scores.
+    """
+
+    def __init__(self, floor=0.2, ceiling=0.8, accept_above=7.5, reject_below=2.5, retain_threshold=6):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.accept_above = accept_above
+        self.reject_below = reject_below
+        self.retain_threshold = retain_threshold
+        self.counts = {ACCEPT: 0, REJECT: 0, AMBIGUOUS: 0, NO_SCORES: 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Thresholds fitted into SIMILARITY_POLICY_FILE (default similarity_policy.json) if it
+        exists, each overridable with SIMILARITY_FLOOR/CEILING and SIMILARITY_ACCEPT_ABOVE/REJECT_BELOW
+        """
+        thresholds = {"floor": 0.2, "ceiling": 0.8, "accept_above": 7.5, "reject_below": 2.5}
+        path = os.environ.get("SIMILARITY_POLICY_FILE", POLICY_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                fitted = json.load(f)
+            thresholds.update({name: fitted[name] for name in thresholds})
+            print(f"Similarity policy thresholds fitted on {fitted.get('samples')} documents loaded from {path}")
+        for name in thresholds:
+            value = os.environ.get(f"SIMILARITY_{name.upper()}")
+            if value is not None:
+                thresholds[name] = float(value)
+        return cls(**thresholds)
+
+    def calibrate(self, similarity):
+        """Map a similarity score onto the 1-10 relevance scale"""
+        fraction = (similarity - self.floor) / (self.ceiling - self.floor)
+        return 1.0 + 9.0 * min(1.0, max(0.0, fraction))
+
+    def decide(self, similarities):
+        """
+        Return (decision, calibrated scores) for one set of retrieved documents
+
+        The decision is "accept" or "reject" when the fast path applies, "ambiguous" when
+        the evaluator has to run, and "no_scores" when some document has no similarity.
+        """
+        if not similarities or any(similarity is None for similarity in similarities):
+            decision, scores = NO_SCORES, []
+        else:
+            scores = [self.calibrate(similarity) for similarity in similarities]
+            confidence = sum(scores) / len(scores)
+            if confidence >= self.accept_above:
+                decision = ACCEPT
+            elif confidence <= self.reject_below:
+                decision = REJECT
+            else:
+                decision = AMBIGUOUS
+        with self._lock:
+            self.counts[decision] += 1
+        metrics.increment("similarity_policy_decisions_total", decision=decision)
+        return decision, scores
+
+    def stats(self):
+        """Decision counts and the share of evaluations that took the fast path"""
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        fast = counts[ACCEPT] + counts[REJECT]
+        return {**counts, "total": total, "fast_path_rate": fast / total if total else 0.0}
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+
+
+def _precision_cutoff(values, correct, target, upper):
+    """
+    Loosest cut-off t on `values` such that the cases at or beyond t are correct at `target` precision
+
+    Cases beyond t are those >= t when `upper` is true, else those <= t. Returns None if no
+    cut-off reaches the target.
+    """
+    order = np.argsort(-values if upper else values, kind="stable")
+    hits = np.cumsum(correct[order])
+    precision = hits / np.arange(1, len(order) + 1)
+    reached = np.flatnonzero(precision >= target)
+    if len(reached) == 0:
+        return None
+    return float(values[order[reached[-1]]])
+
+def fit_similarity_policy(samples, target_precision=0.9, retain_threshold=6):
+    """
+    Fit the policy's thresholds on documents the LLM or cross-encoder evaluator has scored
+
+    `samples` are dicts with "evaluation" (one ID per evaluator call), "similarity" (to the
+    question) and "relevance" (the evaluator's 1-10 score), as written to
+    SIMILARITY_CALIBRATION_LOG. `floor` and `ceiling` come from a least-squares line of
+    relevance on similarity, at the similarities it predicts 1 and 10. Per evaluation, the
+    mean calibrated score is then compared with the evaluator's confidence (the mean
+    relevance): `accept_above` is the lowest mean whose evaluations at or above it all
+    reached ANSWER_CONFIDENCE in `target_precision` of cases, and `reject_below` the highest
+    mean whose evaluations at or below it stayed under ANSWER_CONFIDENCE as often. A side
+    without such a cut-off is disabled (11 for accept, 0 for reject). If the two overlap,
+    both move to their midpoint, which keeps the precision of each side.
+
+    Returns the thresholds with the sample and evaluation counts.
+    """
+    if len(samples) < MIN_FIT_SAMPLES:
+        raise ValueError(f"Need at least {MIN_FIT_SAMPLES} scored documents to fit the similarity policy, got {len(samples)}")
+    similarities = np.array([sample["similarity"] for sample in samples], dtype=np.float64)
+    relevance = np.array([sample["relevance"] for sample in samples], dtype=np.float64)
+    slope, intercept = np.polyfit(similarities, relevance, 1)
+    if slope <= 0:
+        raise ValueError("Evaluator scores do not increase with similarity; the fast path cannot be calibrated on these samples")
+    policy = SimilarityPolicy(floor=(1.0 - intercept) / slope, ceiling=(10.0 - intercept) / slope,
+                              retain_threshold=retain_threshold)
+
+    evaluations = {}
+    for sample in samples:
+        evaluations.setdefault(sample["evaluation"], []).append(sample)
+    means = np.array([np.mean([policy.calibrate(sample["similarity"]) for sample in group])
+                      for group in evaluations.values()])
+    confidences = np.array([np.mean([sample["relevance"] for sample in group]) for group in evaluations.values()])
+    accept_above = _precision_cutoff(means, confidences >= ANSWER_CONFIDENCE, target_precision, upper=True)
+    reject_below = _precision_cutoff(means, confidences < ANSWER_CONFIDENCE, target_precision, upper=False)
+    accept_above = accept_above if accept_above is not None else 11.0
+    reject_below = reject_below if reject_below is not None else 0.0
+    if reject_below >= accept_above:
+        accept_above = reject_below = (accept_above + reject_below) / 2
+    return {
+        "floor": float(policy.floor),
+        "ceiling": float(policy.ceiling),
+        "accept_above": accept_above,
+        "reject_below": reject_below,
+        "target_precision": target_precision,
+        "samples": len(samples),
+        "evaluations": len(evaluations),
+    }
+
+def load_calibration_samples(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+_log_lock = threading.Lock()
+
+def calibration_enabled():
+    return bool(os.environ.get("SIMILARITY_CALIBRATION_LOG"))
+
+def log_calibration_samples(evaluation_id, records):
+    """Append (similarity, evaluator score) pairs to SIMILARITY_CALIBRATION_LOG, if set"""
+    path = os.environ.get("SIMILARITY_CALIBRATION_LOG")
+    if not path:
+        return
+    lines = [json.dumps({"evaluation": evaluation_id, "similarity": record.question_similarity,
+                         "relevance": record.relevance_score, "scored_by": record.scored_by})
+             for record in records]
+    if not lines:
+        return
+    with _log_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+def get_similarity_policy():
+    """Return the process-wide policy, so its statistics cover every request"""
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = SimilarityPolicy.from_env()
+    return _policy
@@ -0,0 +1,237 @@
+# utils/sparse_index.py
+import os
+import json
+import threading
+from collections import Counter
+import numpy as np
+
+from utils.text import words
+from utils.tracing import metrics
+
+VOCAB_FILE = "vocab.json"
+POSTING_OFFSETS_FILE = "posting_offsets.npy"
+POSTING_DOCS_FILE = "posting_docs.npy"
+POSTING_TFS_FILE = "posting_tfs.npy"
+DOC_LENGTHS_FILE = "doc_lengths.npy"
+PAYLOADS_FILE = "payloads.bin"
+PAYLOAD_OFFSETS_FILE = "payload_offsets.npy"
+IDS_FILE = "ids.json"
+# Present while the index lags behind the vector index it was built from
+STALE_FILE = "STALE"
+
+# Reciprocal rank fusion constant (the usual k = 60)
+RRF_K = 60
+
+STOPWORDS = frozenset(
+    "a an and are as at be been by for from has have how in is it its of on or since that the their this "
+    "to was were what when where which who whom why will with after before about into over than then there "
+    "these those do does did not no can could would should may might latest recent new".split()
+)
+
+
+def tokenize(text):
+    """Lower-cased word tokens without stopwords"""
+    return [word for word in words(text) if word not in STOPWORDS]
+
+
+def _save_array(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+class SparseIndex:
+    """
+    In-process BM25 keyword index
+
+    Postings are stored term by term in flat arrays: document rows as int32 and term
+    frequencies as uint16, sliced through a per-term offsets array. The arrays are
+    memory-mapped .npy files, and payloads (metadata including the text) use the same
+    offsets-addressed JSON blob layout as the local vector index.
+    """
+
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        with open(os.path.join(path, VOCAB_FILE), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(path, IDS_FILE), "r", encoding="utf-8") as f:
+            self.ids = json.load(f)
+        self.posting_offsets = np.load(os.path.join(path, POSTING_OFFSETS_FILE))
+        self.posting_docs = np.load(os.path.join(path, POSTING_DOCS_FILE), mmap_mode="r")
+        self.posting_tfs = np.load(os.path.join(path, POSTING_TFS_FILE), mmap_mode="r")
+        self.doc_lengths = np.load(os.path.join(path, DOC_LENGTHS_FILE)).astype(np.float32)
+        self.payload_offsets = np.load(os.path.join(path, PAYLOAD_OFFSETS_FILE))
+        self.payloads = np.memmap(os.path.join(path, PAYLOADS_FILE), dtype=np.uint8, mode="r") \
+            if self.payload_offsets[-1] > 0 else np.empty(0, dtype=np.uint8)
+        self.average_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) else 1.0
+        if is_stale(path):
+            print(f"Warning: sparse index at {path} is out of date with the vector index; rebuild it with --build-sparse-index")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, path, ids, texts, payloads):
+        """Tokenize `texts` and write a new index to `path`"""
+        os.makedirs(path, exist_ok=True)
+        vocab, postings, doc_lengths = {}, [], []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = vocab.setdefault(term, len(vocab))
+                postings.append((term_id, row, min(tf, np.iinfo(np.uint16).max)))
+
+        postings = np.array(postings, dtype=np.int64).reshape(-1, 3)
+        postings = postings[np.lexsort((postings[:, 1], postings[:, 0]))]
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(postings[:, 0], minlength=len(vocab)))
+
+        _save_array(os.path.join(path, POSTING_OFFSETS_FILE), offsets)
+        _save_array(os.path.join(path, POSTING_DOCS_FILE), postings[:, 1].astype(np.int32))
+        _save_array(os.path.join(path, POSTING_TFS_FILE), postings[:, 2].astype(np.uint16))
+        _save_array(os.path.join(path, DOC_LENGTHS_FILE), np.asarray(doc_lengths, dtype=np.int32))
+
+        encoded = [json.dumps(payload, ensure_ascii=False).encode("utf-8") for payload in payloads]
+        payload_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        payload_offsets[1:] = np.cumsum([len(record) for record in encoded])
+        _save_array(os.path.join(path, PAYLOAD_OFFSETS_FILE), payload_offsets)
+        with open(os.path.join(path, PAYLOADS_FILE) + ".tmp", "wb") as f:
+            for record in encoded:
+                f.write(record)
+        os.replace(os.path.join(path, PAYLOADS_FILE) + ".tmp", os.path.join(path, PAYLOADS_FILE))
+        for name, value in ((VOCAB_FILE, vocab), (IDS_FILE, list(ids))):
+            with open(os.path.join(path, name) + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(os.path.join(path, name) + ".tmp", os.path.join(path, name))
+        if is_stale(path):
+            os.remove(os.path.join(path, STALE_FILE))
+        print(f"Sparse index: {len(ids)} documents, {len(vocab)} terms, {len(postings)} postings")
+        return cls(path)
+
+    def upsert(self, ids, texts, payloads, delete_ids=(), text_key="Cleaned Text"):
+        """
+        Insert or replace documents by id, drop `delete_ids`, and rewrite the index files; returns the reopened index
+
+        Kept documents are re-tokenized from their stored payloads' `text_key`.
+        """
+        replaced = set(delete_ids) | set(ids)
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in replaced]
+        kept_payloads = [self.payload(row) for row in keep]
+        all_ids = [self.ids[row] for row in keep] + list(ids)
+        all_texts = [payload.get(text_key, "") for payload in kept_payloads] + list(texts)
+        all_payloads = kept_payloads + list(payloads)
+        return SparseIndex.build(self.path, all_ids, all_texts, all_payloads)
+
+    def payload(self, row):
+        start, end = self.payload_offsets[row], self.payload_offsets[row + 1]
+        return json.loads(bytes(self.payloads[start:end]).decode("utf-8"))
+
+    def search(self, query, k=5):
+        """Return [(row, bm25_score), ...] for the k best-scoring documents that contain a query term"""
+        scores = np.zeros(len(self), dtype=np.float32)
+        n_docs = len(self)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+            docs = self.posting_docs[start:end]
+            tfs = self.posting_tfs[start:end].astype(np.float32)
+            idf = np.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_lengths[docs] / self.average_length)
+            # Each document appears once per term, so plain fancy-index accumulation is safe
+            scores[docs] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        top = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def mark_stale(path):
+    """Flag the index at `path` as lagging behind its vector index until the next build"""
+    with open(os.path.join(path, STALE_FILE), "w", encoding="utf-8") as f:
+        f.write("")
+
+def is_stale(path):
+    return os.path.exists(os.path.join(path, STALE_FILE))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """
+    Fuse ranked lists of keys: score(key) = sum over lists of 1 / (k + rank)
+
+    Returns the keys ordered by fused score, ties broken by first appearance.
+    """
+    scores, first_seen = {}, {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            first_seen.setdefault(key, len(first_seen))
+    return sorted(scores, key=lambda key: (-scores[key], first_seen[key]))
+
+
+def build_sparse_index(source, index_path, text_key="Cleaned Text"):
+    """
+    Build the sparse index over the same corpus as the vector index
+
+    `source` is either a Pinecone JSONL export (see export_pinecone_index) or a local
+    vector index directory.
+    """
+    ids, texts, payloads = [], [], []
+    if os.path.isdir(source):
+        from utils.local_index import LocalVectorIndex
+        index = LocalVectorIndex(source)
+        for row, doc_id in enumerate(index.ids):
+            payload = index.payload(row)
+            ids.append(doc_id)
+            texts.append(payload.get(text_key, ""))
+            payloads.append(payload)
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                payload = record.get("metadata") or {}
+                ids.append(record["id"])
+                texts.append(payload.get(text_key, ""))
+                payloads.append(payload)
+    print(f"Indexing {len(ids)} documents from {source} into {index_path}")
+    return SparseIndex.build(index_path, ids, texts, payloads)
+
+
+class HybridStats:
+    """
+    How often keyword retrieval changed the outcome of a request
+
+    `contributed` counts retrievals whose final documents include keyword-only matches
+    (missed by the dense search). `reformulations_prevented` counts first-round evaluations
+    that went straight to answering with at least one keyword-only document judged relevant.
+    Without that document, the request would probably have gone through query reformulation.
+    """
+
+    def __init__(self):
+        self.counts = {"retrievals": 0, "contributed": 0, "first_round_evaluations": 0, "reformulations_prevented": 0}
+        self._lock = threading.Lock()
+
+    def record(self, name):
+        with self._lock:
+            self.counts[name] += 1
+        metrics.increment("hybrid_retrieval_total", event=name)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        evaluated = counts["first_round_evaluations"]
+        return {**counts, "prevented_rate": counts["reformulations_prevented"] / evaluated if evaluated else 0.0}
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(self.counts, 0)
+
+
+hybrid_stats = HybridStats()
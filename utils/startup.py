@@ -0,0 +1,123 @@
+# utils/startup.py
+import time
+import threading
+from contextlib import contextmanager
+
+# Taken when this module is first imported; app.py imports it before anything heavy
+PROCESS_START = time.perf_counter()
+
+
+class StartupTimer:
+    """Wall-clock durations of named startup phases, reported relative to process start"""
+
+    def __init__(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.phases = {}   # name -> (seconds, finished_at offset from start)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = (seconds, time.perf_counter() - self.start)
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as startup phase `name`"""
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - phase_start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def report(self, title="Startup timing report"):
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1][1])
+        print(f"{title}:")
+        for name, (seconds, finished_at) in phases:
+            print(f"- {name}: {seconds:.2f}s (done at +{finished_at:.2f}s)")
+        print(f"Elapsed since process start: {self.elapsed():.2f}s")
+
+
+class BackgroundWarmUp:
+    """
+    Runs warm-up tasks in background threads and exposes a readiness flag
+
+    Tasks are (name, zero-argument callable) pairs and run concurrently. `ready` is set once
+    all of them have finished; failures are kept in `errors` and do not stop the others,
+    since the resources are built lazily on first use anyway.
+    """
+
+    def __init__(self, tasks, timer):
+        self.tasks = list(tasks)
+        self.timer = timer
+        self.ready = threading.Event()
+        self.errors = {}
+
+    def start(self):
+        threading.Thread(target=self._run_all, name="warm-up", daemon=True).start()
+        return self
+
+    def _run_task(self, name, task):
+        try:
+            with self.timer.phase(f"warm-up: {name}"):
+                task()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+            self.errors[name] = str(e)
+
+    def _run_all(self):
+        with self.timer.phase("warm-up (total)"):
+            threads = [threading.Thread(target=self._run_task, args=task, daemon=True) for task in self.tasks]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.ready.set()
+        status = "with errors in " + ", ".join(self.errors) if self.errors else "successfully"
+        print(f"Background warm-up finished {status}")
+        self.timer.report()
+
+    def is_ready(self):
+        return self.ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until warm-up has finished; returns False on timeout"""
+        return self.ready.wait(timeout)
+
+
+startup_timer = StartupTimer(PROCESS_START)
+_warm_up = None
+
+def start_background_warm_up(pipeline_config):
+    """Warm up the embeddings, vector index, retriever, compiled graph and (if enabled) the LoRA model and reranker"""
+    global _warm_up
+
+    def warm_up_retriever():
+        from utils.retriever import warm_up_retriever
+        warm_up_retriever()
+
+    def warm_up_graph():
+        from graph import get_compiled_graph
+        get_compiled_graph(pipeline_config)
+
+    def warm_up_lora_model():
+        from agents.query_analyzer import get_lora_model
+        get_lora_model()
+
+    def warm_up_reranker():
+        from models.reranker import get_reranker
+        get_reranker()
+
+    tasks = [("retriever", warm_up_retriever), ("graph", warm_up_graph)]
+    if pipeline_config.use_lora:
+        tasks.append(("lora_model", warm_up_lora_model))
+    if pipeline_config.relevance_mode == "cross_encoder":
+        tasks.append(("reranker", warm_up_reranker))
+    _warm_up = BackgroundWarmUp(tasks, startup_timer).start()
+    return _warm_up
+
+def is_ready():
+    """True once the background warm-up has finished (False if it was never started)"""
+    return _warm_up is not None and _warm_up.is_ready()
@@ -1,28 +1,109 @@
 # utils/state.py
-from typing import Dict, List, Any, Optional, TypedDict
-from langchain.schema import Document
+import hashlib
+import operator
+from typing import Dict, List, Any, Optional, TypedDict, Annotated
+from langchain_core.documents import Document
+
+class DocRecord:
+    """A retrieved document stored once per request; agents refer to it by doc_id"""
+    __slots__ = ("doc_id", "text", "metadata", "cleaned_text", "similarity", "question_similarity",
+                 "relevance_score", "scored_by", "retrieved_by")
+
+    def __init__(self, doc_id, text, metadata, similarity=None):
+        self.doc_id = doc_id
+        self.text = text                 # Original retrieved text
+        self.metadata = metadata
+        self.cleaned_text = None         # Set by the document cleaner
+        self.similarity = similarity     # Vector similarity to the retrieval query, if the store reported it
+        self.question_similarity = None  # Embedding similarity to the user's question, set by the relevance evaluator
+        self.relevance_score = None      # 1-10 score set by the relevance evaluator
+        self.scored_by = None            # What set the score: "llm", "cross_encoder" or "similarity"
+        self.retrieved_by = ()           # Retrieval paths that found it ("dense", "sparse") in hybrid retrieval
+
+    @property
+    def content(self):
+        """Cleaned text if the document has been cleaned, otherwise the original text"""
+        return self.cleaned_text if self.cleaned_text is not None else self.text
+
+    def to_document(self):
+        return Document(page_content=self.content, metadata=self.metadata)
+
+class DocumentStore:
+    """Per-request store of DocRecords keyed by document ID"""
+    __slots__ = ("records",)
+
+    def __init__(self):
+        self.records = {}
+
+    @staticmethod
+    def document_id(doc):
+        """Stable ID for a retrieved document: its vector store ID if present, else a content hash"""
+        doc_id = getattr(doc, "id", None) or doc.metadata.get("id")
+        if doc_id:
+            return str(doc_id)
+        return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+    def add(self, doc, similarity=None):
+        """Store a retrieved Document (once per ID) and return its ID; keeping its latest similarity score"""
+        doc_id = self.document_id(doc)
+        record = self.records.get(doc_id)
+        if record is None:
+            self.records[doc_id] = DocRecord(doc_id, doc.page_content, doc.metadata, similarity)
+        else:
+            # Retrieved again for a reformulated query; the score must refer to the current query
+            record.similarity = similarity
+        return doc_id
+
+    def get(self, doc_id):
+        return self.records[doc_id]
+
+    def records_for(self, doc_ids):
+        return [self.records[doc_id] for doc_id in doc_ids or []]
+
+    def documents(self, doc_ids):
+        """Materialize Documents (cleaned text where available) for the given IDs"""
+        return [record.to_document() for record in self.records_for(doc_ids)]
+
+    def __len__(self):
+        return len(self.records)
 
 class AgentState(TypedDict, total=False):
     query: str                        # User query
     analyzed_query: Optional[str]     # Analyzed query
-    retrieved_docs: Optional[List[Document]]  # Retrieved documents
-    cleaned_docs: Optional[List[Document]]    # Cleaned documents
-    relevant_docs: Optional[List[Document]]   # Filtered relevant documents
+    query_variants: Optional[List[str]]  # Alternative queries searched alongside the analyzed query (multi-query mode)
+    doc_store: DocumentStore          # Per-request document store shared by all agents
+    retrieved_ids: Optional[List[str]]  # IDs of retrieved documents
+    cleaned_ids: Optional[List[str]]    # IDs of cleaned documents (cleaned text lives on the record)
+    relevant_ids: Optional[List[str]]   # IDs of filtered relevant documents
     answer: Optional[str]             # Final answer
-    intermediate_steps: List[str]     # Intermediate steps log
+    intermediate_steps: Annotated[List[str], operator.add]  # Intermediate steps log; agents return only new steps
     confidence_score: Optional[float] # Confidence score
     reformulation_count: int          # Query reformulation counter
+    graph_build_time: Optional[float] # Seconds spent getting the compiled graph (set by run_rag_system)
+    query_time: Optional[float]       # Seconds spent running the graph (set by run_rag_system)
+    error: Optional[str]              # Error raised while running the graph (set by run_rag_system)
 
 def initialize_state(query: str) -> AgentState:
     """Initialize state with a query"""
     return {
         "query": query,
         "analyzed_query": None,
-        "retrieved_docs": None,
-        "cleaned_docs": None,
-        "relevant_docs": None,
+        "query_variants": None,
+        "doc_store": DocumentStore(),
+        "retrieved_ids": None,
+        "cleaned_ids": None,
+        "relevant_ids": None,
         "answer": None,
         "intermediate_steps": [],
         "confidence_score": None,
         "reformulation_count": 0
-    }
\ No newline at end of file
+    }
+
+def apply_update(state: AgentState, update: Dict[str, Any]) -> AgentState:
+    """Merge an agent's partial update into a state the way the graph does (steps are appended)"""
+    for key, value in update.items():
+        if key == "intermediate_steps":
+            state["intermediate_steps"] = state.get("intermediate_steps", []) + list(value)
+        else:
+            state[key] = value
+    return state
@@ -0,0 +1,13 @@
+# utils/text.py
+import re
+
+# Sentence boundaries: end punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?。！？])\s+|\n+")
+WORD = re.compile(r"\w+")
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence and sentence.strip()]
+
+def words(text):
+    """Lower-cased word tokens"""
+    return WORD.findall(text.lower())
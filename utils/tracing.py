@@ -0,0 +1,302 @@
+# utils/tracing.py
+import os
+import json
+import time
+import uuid
+import inspect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.runnables import RunnableConfig
+
+# Span kinds used by the agents
+NODE, LLM, LORA, EMBEDDING, VECTORSTORE, RERANKER = "node", "llm", "lora", "embedding", "vectorstore", "reranker"
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation; attributes hold tokens, cache status, retries, errors, ..."""
+    __slots__ = ("span_id", "parent_id", "name", "kind", "start", "duration", "attributes")
+
+    def __init__(self, name, kind, parent_id, attributes):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attributes = dict(attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self, trace_start):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start - trace_start, 6),
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """All spans recorded while answering one request"""
+
+    def __init__(self, query, mode):
+        self.trace_id = uuid.uuid4().hex
+        self.query = query
+        self.mode = mode
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self):
+        """Total time, tokens and calls per span kind"""
+        summary = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = summary.setdefault(span.kind, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            entry["calls"] += 1
+            entry["seconds"] += span.duration or 0.0
+            entry["prompt_tokens"] += span.attributes.get("prompt_tokens", 0)
+            entry["completion_tokens"] += span.attributes.get("completion_tokens", 0)
+        return summary
+
+    def to_dict(self):
+        with self._lock:
+            spans = [span.to_dict(self.start) for span in sorted(self.spans, key=lambda span: span.start)]
+        return {
+            "trace_id": self.trace_id,
+            "query": self.query,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "summary": self.summary(),
+            "spans": spans,
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), ensure_ascii=False, **kwargs)
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms
+
+    Histograms keep the most recent `window` observations per (kind, name) and report
+    count, sum and p50/p95/p99 over them.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=2048):
+        self.window = window
+        self.histograms = {}   # (kind, name) -> {"count", "sum", "samples"}
+        self.counters = {}     # (metric, labels tuple) -> value
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get((kind, name))
+            if histogram is None:
+                histogram = {"count": 0, "sum": 0.0, "samples": deque(maxlen=self.window)}
+                self.histograms[(kind, name)] = histogram
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["samples"].append(seconds)
+
+    def increment(self, metric, amount=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @staticmethod
+    def _quantile(sorted_samples, q):
+        if not sorted_samples:
+            return 0.0
+        index = min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+
+    def snapshot(self):
+        """JSON-serializable view of all histograms and counters"""
+        with self._lock:
+            histograms = {key: (h["count"], h["sum"], sorted(h["samples"])) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+        return {
+            "latency": {
+                f"{kind}:{name}": {
+                    "count": count,
+                    "sum": total,
+                    **{f"p{int(q * 100)}": self._quantile(samples, q) for q in self.QUANTILES},
+                }
+                for (kind, name), (count, total, samples) in histograms.items()
+            },
+            "counters": [
+                {"metric": metric, "labels": dict(labels), "value": value}
+                for (metric, labels), value in counters.items()
+            ],
+        }
+
+    def prometheus_text(self, prefix="rag"):
+        """Render the metrics in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = {key: (h["count"], h["sum"], sorted(h["samples"])) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = [f"# TYPE {prefix}_span_duration_seconds summary"]
+        for (kind, name), (count, total, samples) in sorted(histograms.items()):
+            labels = f'kind="{kind}",name="{name}"'
+            for q in self.QUANTILES:
+                lines.append(f'{prefix}_span_duration_seconds{{{labels},quantile="{q}"}} {self._quantile(samples, q):.6f}')
+            lines.append(f"{prefix}_span_duration_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{prefix}_span_duration_seconds_count{{{labels}}} {count}")
+
+        for metric in sorted({metric for metric, _ in counters}):
+            lines.append(f"# TYPE {prefix}_{metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name != metric:
+                    continue
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"{prefix}_{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+metrics = MetricsRegistry()
+# Finished traces, newest last, for the /traces endpoint
+recent_traces = deque(maxlen=int(os.environ.get("TRACE_HISTORY", "100")))
+
+
+def current_trace():
+    return _current_trace.get()
+
+def current_span():
+    return _current_span.get()
+
+@contextmanager
+def start_trace(query, mode):
+    """Make a new Trace current for the enclosed block and keep it in recent_traces when done"""
+    trace = Trace(query, mode)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.duration = time.perf_counter() - trace.start
+        _current_trace.reset(token)
+        recent_traces.append(trace)
+
+@contextmanager
+def span(name, kind, activate=True, **attributes):
+    """
+    Time the enclosed block as a span of the current trace and record its latency
+
+    The latency is always observed in the metrics registry; the span is added to the
+    current trace if there is one.
+    Exceptions are recorded on the span and re-raised. Pass activate=False for spans
+    around generators, so code running between yields is not parented to the span.
+    """
+    parent = _current_span.get()
+    current = Span(name, kind, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current) if activate else None
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        metrics.increment("errors_total", kind=kind, name=name)
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.start
+        if token is not None:
+            _current_span.reset(token)
+        metrics.observe(kind, name, current.duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(current)
+
+def propagate_context(fn):
+    """Wrap `fn` so calls from pool threads record into the caller's current trace and span"""
+    trace, parent = _current_trace.get(), _current_span.get()
+
+    def run(*args, **kwargs):
+        trace_token, span_token = _current_trace.set(trace), _current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+    return run
+
+def traced_node(name, fn):
+    """
+    Wrap a graph node so every execution is recorded as a "node" span
+
+    The wrapper always takes the run config (LangGraph passes it to nodes whose signature
+    has a RunnableConfig `config` parameter) and forwards it only if `fn` accepts it.
+    """
+    passes_config = "config" in inspect.signature(fn).parameters
+
+    if inspect.iscoroutinefunction(fn) or inspect.iscoroutinefunction(getattr(fn, "func", None)):
+        async def async_node(state, config: RunnableConfig = None):
+            with span(name, NODE):
+                return await (fn(state, config=config) if passes_config else fn(state))
+        async_node.__name__ = name
+        return async_node
+
+    def node(state, config: RunnableConfig = None):
+        with span(name, NODE):
+            return fn(state, config=config) if passes_config else fn(state)
+    node.__name__ = name
+    return node
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+        elif self.path.startswith("/traces"):
+            body, content_type = json.dumps([trace.to_dict() for trace in list(recent_traces)], ensure_ascii=False), "application/json"
+        elif self.path.startswith("/stats"):
+            body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve /metrics (Prometheus text), /stats and /traces (JSON) from a daemon thread
+
+    /traces contains raw user queries, so the server listens on loopback unless another
+    host (e.g. "0.0.0.0" inside a container) is passed explicitly.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server